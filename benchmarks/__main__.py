@@ -0,0 +1,101 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import os
+import pathlib
+import sys
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from collections.abc import Callable
+
+from benchmarks.crypto import bench_crypto
+from benchmarks.folder_scan import bench_folder_scan, make_listing
+from benchmarks.hashcash import bench_hashcash
+from benchmarks.results import BenchResult, compare_results, load_results, save_results
+from benchmarks.transfer import bench_transfer
+from mega_download.api import Mem
+
+
+def _run_crypto(parsed: Namespace) -> list[BenchResult]:
+    return bench_crypto(parsed.crypto_size * Mem.MB, parsed.nodes, parsed.easiness, parsed.repeats)
+
+
+def _run_transfer(parsed: Namespace) -> list[BenchResult]:
+    results = run(bench_transfer(parsed.transfer_size * Mem.MB, 1, parsed.repeats))
+    return [BenchResult('transfer_throughput', max(_.throughput for _ in results), 'MB/s', True)]
+
+
+def _run_hashcash(parsed: Namespace) -> list[BenchResult]:
+    results = run(bench_hashcash(parsed.easiness, parsed.repeats, parsed.workers))
+    bench_results: list[BenchResult] = []
+    for easiness in parsed.easiness:
+        solve_times = [_.solve_time for _ in results if _.easiness == easiness]
+        bench_results.append(BenchResult(f'hashcash_pool_solve_{easiness:d}', sum(solve_times) / len(solve_times), 's', False))
+        bench_results.append(BenchResult(
+            f'hashcash_pool_loop_stall_{easiness:d}', max(_.loop_stall for _ in results if _.easiness == easiness), 's', False))
+    return bench_results
+
+
+def _run_folder_scan(parsed: Namespace) -> list[BenchResult]:
+    shared_key = tuple(int.from_bytes(os.urandom(4), 'big') for _ in range(4))
+    nodes = make_listing(parsed.nodes, shared_key)
+    results = run(bench_folder_scan(nodes, shared_key, parsed.workers, per_node=False))
+    # single-process bulk decryption goes first, pooled one follows (if any)
+    return [BenchResult('folder_scan_bulk' if i == 0 else 'folder_scan_bulk_pool', _.nodes / max(_.elapsed, 1e-6), 'nodes/s', True)
+            for i, _ in enumerate(results)]
+
+
+SUITES: dict[str, Callable[[Namespace], list[BenchResult]]] = {
+    'crypto': _run_crypto,
+    'transfer': _run_transfer,
+    'hashcash': _run_hashcash,
+    'folder_scan': _run_folder_scan,
+}
+
+
+def main(args: list[str]) -> int:
+    parser = ArgumentParser(prog='python -m benchmarks', description='Runs benchmark suites, saves and compares their results')
+    parser.add_argument('suites', metavar='suite', nargs='*', help=f'Suites to run: {", ".join(SUITES)}. Default is all')
+    parser.add_argument('--crypto-size', metavar='#MB', default=1024, type=int, help='Data size to decrypt and MAC, MB')
+    parser.add_argument('--transfer-size', metavar='#MB', default=256, type=int, help='Transferred file size, MB')
+    parser.add_argument('--nodes', metavar='#number', default=100000, type=int, help='Nodes to unwrap keys and decrypt attributes of')
+    parser.add_argument('--easiness', metavar='#number', nargs='+', default=[255, 220, 200], type=int, help='Hashcash easiness values')
+    parser.add_argument('--workers', metavar='#number', default=0, type=int, help='Worker processes, 0 to use all cores')
+    parser.add_argument('--repeats', metavar='#number', default=3, type=int, help='Runs per measurement')
+    parser.add_argument('--save', metavar='#filepath', type=pathlib.Path, help='Save results to this JSON file')
+    parser.add_argument('--baseline', metavar='#filepath', type=pathlib.Path, help='Compare results to ones saved in this JSON file')
+    parser.add_argument('--threshold', metavar='#percent', default=10.0, type=float, help='Change considered a regression, percent')
+    parsed = parser.parse_args(args)
+    if unknown_suites := [_ for _ in parsed.suites if _ not in SUITES]:
+        parser.error(f'unknown suites: {", ".join(unknown_suites)}')
+    results: list[BenchResult] = []
+    for suite in parsed.suites or SUITES:
+        print(f'[{suite}]')
+        suite_results = SUITES[suite](parsed)
+        for result in suite_results:
+            print(result)
+        results.extend(suite_results)
+    if parsed.save:
+        save_results(results, parsed.save)
+    if parsed.baseline:
+        regressions = compare_results(results, load_results(parsed.baseline), parsed.threshold / 100)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        print(f'{len(regressions):d} regressions against {parsed.baseline.name}, threshold {parsed.threshold:.1f}%')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
+
+#
+#
+#########################################
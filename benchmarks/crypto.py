@@ -0,0 +1,161 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable, Sequence
+
+from Crypto.Cipher import AES
+
+from benchmarks.results import BenchResult
+from mega_download.api.chunkgen import condense_chunk_macs, make_chunk_decryptor, make_chunk_generator, make_chunk_mac
+from mega_download.api.defs import DOWNLOAD_CHUNK_SIZE_MAX, Mem
+from mega_download.api.encryption import (
+    base64_to_ints,
+    base64_url_decode,
+    base64_url_encode,
+    decrypt_attr,
+    decrypt_key,
+    hashcash_nonce_matches,
+    make_hashcash_buffer,
+    make_hashcash_token,
+    pack_sequence,
+    parse_hashcash_challenge,
+)
+
+__all__ = ('bench_crypto',)
+
+
+def _random_ints(count: int) -> tuple[int, ...]:
+    return tuple(random.getrandbits(32) for _ in range(count))
+
+
+def _best_rate(func: Callable[[], int], repeats: int) -> float:
+    """:returns best of `repeats` rates, `func` returns number of operations done"""
+    best = 0.0
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        ops = func()
+        best = max(best, ops / max(time.perf_counter() - time_start, 1e-9))
+    return best
+
+
+def _decrypt_and_mac(size: int, key: bytes, iv: bytes, data: bytearray) -> int:
+    """Decrypts and MACs `size` bytes in download chunks, reusing single chunk buffer as transfers do"""
+    decryptor = make_chunk_decryptor(iv, key)
+    next(decryptor)
+    view = memoryview(data)
+    chunk_macs = [make_chunk_mac(key, iv + iv, decryptor.send(view[:chunk.size])) for chunk in make_chunk_generator(size)]
+    condense_chunk_macs(key, chunk_macs)
+    decryptor.close()
+    return size
+
+
+def _make_nodes(count: int, shared_key: Sequence[int]) -> list[tuple[str, str, tuple[int, ...]]]:
+    """Synthetic file nodes: base64 wrapped key, base64 encrypted attributes and the attributes key"""
+    nodes: list[tuple[str, str, tuple[int, ...]]] = []
+    for i in range(count):
+        key = _random_ints(8)
+        k = tuple(key[j] ^ key[j + 4] for j in range(4))
+        attr = b'MEGA' + json.dumps({'n': f'node_{i:07d}.bin'}).encode()
+        attr_enc = AES.new(pack_sequence(k), AES.MODE_CBC, b'\0' * 16).encrypt(attr + b'\0' * (-len(attr) % 16))
+        wrapped = AES.new(pack_sequence(shared_key), AES.MODE_ECB).encrypt(pack_sequence(key))
+        nodes.append((base64_url_encode(wrapped), base64_url_encode(attr_enc), k))
+    return nodes
+
+
+def _make_challenge(easiness: int, seed: int) -> str:
+    """Challenges are seeded so every run searches through the same nonces"""
+    token = random.Random(seed).randbytes(48)
+    return f'1:{easiness:d}:{seed:d}:{base64_url_encode(token)}'
+
+
+def _hashcash_nonces(nonces: int) -> int:
+    hashcash = parse_hashcash_challenge(_make_challenge(0, 0))
+    buffer = make_hashcash_buffer(hashcash.token)
+    for nonce in range(nonces):
+        hashcash_nonce_matches(buffer, nonce, 0)
+    return nonces
+
+
+def bench_crypto(size: int, nodes: int, easiness_values: Sequence[int], repeats: int) -> list[BenchResult]:
+    """
+    Measures crypto and chunk hot paths on synthetic keys and data
+    :param size: bytes to decrypt and MAC per run
+    :param nodes: synthetic nodes to unwrap keys and decrypt attributes of per run
+    :param easiness_values: hashcash easiness values to measure solve time for
+    :param repeats: runs per measurement, best run is reported (mean of `repeats` seeded challenges for hashcash solve time)
+    :returns results of each measurement
+    """
+    key, iv = os.urandom(16), os.urandom(8)
+    data = bytearray(os.urandom(DOWNLOAD_CHUNK_SIZE_MAX))
+    shared_key = _random_ints(4)
+    node_list = _make_nodes(nodes, shared_key)
+
+    def chunk_plan() -> int:
+        return sum(1 for _ in make_chunk_generator(size * 0x10))
+
+    def key_unwraps() -> int:
+        for k_b64, _, _ in node_list:
+            decrypt_key(base64_to_ints(k_b64), shared_key)
+        return len(node_list)
+
+    def attr_decrypts() -> int:
+        for _, a_b64, k in node_list:
+            decrypt_attr(base64_url_decode(a_b64), k)
+        return len(node_list)
+
+    def b64_decodes() -> int:
+        for k_b64, a_b64, _ in node_list:
+            base64_url_decode(k_b64)
+            base64_url_decode(a_b64)
+        return len(node_list) * 2
+
+    results = [
+        BenchResult('decrypt_mac', _best_rate(lambda: _decrypt_and_mac(size, key, iv, data), repeats) / Mem.MB, 'MB/s', True),
+        BenchResult('chunk_generator', _best_rate(chunk_plan, repeats), 'chunks/s', True),
+        BenchResult('key_unwrap', _best_rate(key_unwraps, repeats), 'keys/s', True),
+        BenchResult('attr_decrypt', _best_rate(attr_decrypts, repeats), 'attrs/s', True),
+        BenchResult('base64_url_decode', _best_rate(b64_decodes, repeats), 'strings/s', True),
+        BenchResult('hashcash_nonce', _best_rate(lambda: _hashcash_nonces(0x40), repeats), 'nonces/s', True),
+    ]
+    for easiness in easiness_values:
+        solve_times: list[float] = []
+        for seed in range(repeats):
+            challenge = _make_challenge(easiness, seed)
+            time_start = time.perf_counter()
+            make_hashcash_token(challenge)
+            solve_times.append(time.perf_counter() - time_start)
+        results.append(BenchResult(f'hashcash_solve_{easiness:d}', sum(solve_times) / len(solve_times), 's', False))
+    return results
+
+
+def main(args: list[str]) -> int:
+    parser = ArgumentParser(description='Offline crypto and chunk processing micro-benchmarks')
+    parser.add_argument('--size', metavar='#MB', default=1024, type=int, help='Data size to decrypt and MAC, MB')
+    parser.add_argument('--nodes', metavar='#number', default=100000, type=int, help='Nodes to unwrap keys and decrypt attributes of')
+    parser.add_argument('--easiness', metavar='#number', nargs='*', default=[255, 220, 200], type=int, help='Hashcash easiness values')
+    parser.add_argument('--repeats', metavar='#number', default=3, type=int, help='Runs per measurement')
+    parsed = parser.parse_args(args)
+    for result in bench_crypto(parsed.size * Mem.MB, parsed.nodes, parsed.easiness, parsed.repeats):
+        print(result)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
+
+#
+#
+#########################################
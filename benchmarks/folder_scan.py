@@ -0,0 +1,186 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from asyncio import run
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from Crypto.Cipher import AES
+
+from mega_download.api.containers import NodeType
+from mega_download.api.defs import NODE_DECRYPT_BATCH_SIZE, Mem
+from mega_download.api.encryption import (
+    base64_to_ints,
+    base64_url_decode,
+    base64_url_encode,
+    decrypt_attr,
+    decrypt_key,
+    pack_sequence,
+    unpack_sequence,
+)
+from mega_download.api.node_decryptor import DecryptedNode, EncryptedNode, NodeDecryptor, decrypt_nodes
+from mega_download.api.node_table import NodeTable
+from mega_download.api.process_pool import ProcessPool
+
+__all__ = ('MemoryResult', 'ScanResult', 'bench_folder_scan', 'bench_node_memory', 'make_listing')
+
+
+class ScanResult(NamedTuple):
+    mode: str
+    nodes: int
+    elapsed: float  # seconds
+
+    def __str__(self) -> str:
+        return f'{self.mode}: {self.nodes:d} nodes in {self.elapsed:.2f} s ({self.nodes / max(self.elapsed, 1e-6):.0f} nodes/s)'
+
+
+class MemoryResult(NamedTuple):
+    mode: str
+    nodes: int
+    size: int  # bytes retained after scan
+
+    def __str__(self) -> str:
+        return f'{self.mode}: {self.size / max(self.nodes, 1):.0f} bytes per node ({self.size / Mem.MB:.1f} MB for {self.nodes:d} nodes)'
+
+
+def make_listing(num_nodes: int, shared_key: Sequence[int]) -> list[EncryptedNode]:
+    """Synthetic folder listing, one folder per 20 files"""
+    node_types = [NodeType.FOLDER if i % 20 == 0 else NodeType.FILE for i in range(num_nodes)]
+    keys = [os.urandom(16 if t == NodeType.FOLDER else 32) for t in node_types]
+    wrapped = AES.new(pack_sequence(shared_key), AES.MODE_ECB).encrypt(b''.join(keys))
+    nodes: list[EncryptedNode] = []
+    offset = 0
+    for i, (node_type, key) in enumerate(zip(node_types, keys, strict=True)):
+        k = bytes(a ^ b for a, b in zip(key[:16], key[16:], strict=True)) if node_type == NodeType.FILE else key
+        attr = b'MEGA' + json.dumps({'n': f'node_{i:07d}.bin'}).encode()
+        attr_enc = AES.new(k, AES.MODE_CBC, b'\0' * 16).encrypt(attr + b'\0' * (-len(attr) % 16))
+        nodes.append(EncryptedNode(node_type, f'root:{base64_url_encode(wrapped[offset:offset + len(key)])}', base64_url_encode(attr_enc)))
+        offset += len(key)
+    return nodes
+
+
+def _decrypt_per_node(nodes: Sequence[EncryptedNode], shared_key: Sequence[int]) -> list[DecryptedNode]:
+    """Node by node decryption, as done before bulk decryption was introduced"""
+    decrypted: list[DecryptedNode] = []
+    for node in nodes:
+        key = decrypt_key(base64_to_ints(node.k.split(':')[1]), shared_key)
+        k = (key[0] ^ key[4], key[1] ^ key[5], key[2] ^ key[6], key[3] ^ key[7]) if node.t == NodeType.FILE else key
+        key_data = pack_sequence(k) + pack_sequence(key[4:8]) if node.t == NodeType.FILE else pack_sequence(k) + bytes(16)
+        decrypted.append(DecryptedNode(decrypt_attr(base64_url_decode(node.a), k), key_data))
+    return decrypted
+
+
+async def bench_folder_scan(nodes: Sequence[EncryptedNode], shared_key: Sequence[int], workers: int, *, per_node: bool) -> list[ScanResult]:
+    """
+    Decrypts the listing with every available method
+    :param per_node: also measure node by node decryption
+    :returns results of each method
+    """
+    results: list[ScanResult] = []
+    expected: list[DecryptedNode] | None = None
+    modes: list[tuple[str, NodeDecryptor | None]] = [('per-node', None)] if per_node else []
+    modes.append(('bulk', NodeDecryptor()))
+    pool = ProcessPool(workers)
+    if workers != 1:
+        decryptor = NodeDecryptor(pool)
+        modes.append((f'bulk, {decryptor.workers:d} workers', decryptor))
+    try:
+        for mode, decryptor in modes:
+            time_start = time.perf_counter()
+            decrypted = _decrypt_per_node(nodes, shared_key) if decryptor is None else await decryptor.decrypt(nodes, shared_key)
+            results.append(ScanResult(mode, len(nodes), time.perf_counter() - time_start))
+            expected = expected or decrypted
+            assert decrypted == expected, f'{mode} result mismatch!'
+    finally:
+        pool.shutdown()
+    return results
+
+
+def _listing_parts(nodes: Sequence[EncryptedNode]) -> list[str]:
+    """Raw listing nodes as JSON, in parts of decryption batch size, the way they are received"""
+    raw_nodes = [{'h': f'{i:08x}', 'p': f'{i // 20 * 20:08x}' if i else 'up', 't': node.t, 'a': node.a, 'k': node.k, 's': 1 << 20,
+                  'ts': 1700000000 + i, 'u': 'owner'} for i, node in enumerate(nodes)]
+    return [json.dumps(raw_nodes[offset:offset + NODE_DECRYPT_BATCH_SIZE]) for offset in range(0, len(raw_nodes), NODE_DECRYPT_BATCH_SIZE)]
+
+
+def _scan_to_dicts(parts: Sequence[str], shared_key: Sequence[int]) -> list[dict]:
+    """Listing nodes kept as dicts with decrypted fields added, as done before node table was introduced"""
+    nodes: list[dict] = []
+    for part in parts:
+        batch = json.loads(part)
+        for node, decrypted in zip(batch, decrypt_nodes([EncryptedNode(n['t'], n['k'], n['a']) for n in batch], shared_key), strict=True):
+            key = unpack_sequence(decrypted.key_data)
+            node['attributes'] = decrypted.attributes
+            node['k_decrypted'] = key[:4]
+            if node['t'] == NodeType.FILE:
+                node['iv'] = (*key[4:6], 0, 0)
+                node['meta_mac'] = key[6:8]
+            node['timestamp'] = datetime.datetime.fromtimestamp(node['ts'])
+            nodes.append(node)
+    return nodes
+
+
+def _scan_to_table(parts: Sequence[str], shared_key: Sequence[int]) -> NodeTable:
+    table = NodeTable()
+    for part in parts:
+        batch = json.loads(part)
+        rows = [table.add(node) for node in batch]
+        for row, decrypted in zip(rows, decrypt_nodes([EncryptedNode(n['t'], n['k'], n['a']) for n in batch], shared_key), strict=True):
+            table.set_decrypted(row, decrypted.attributes.get('n', ''), decrypted.key_data)
+    table.link()
+    return table
+
+
+def bench_node_memory(nodes: Sequence[EncryptedNode], shared_key: Sequence[int]) -> list[MemoryResult]:
+    """
+    Scans the listing into every node representation
+    :returns memory retained by each representation
+    """
+    parts = _listing_parts(nodes)
+    results: list[MemoryResult] = []
+    for mode, scan in (('node dicts', _scan_to_dicts), ('node table', _scan_to_table)):
+        tracemalloc.start()
+        scanned = scan(parts, shared_key)
+        results.append(MemoryResult(mode, len(scanned), tracemalloc.get_traced_memory()[0]))
+        tracemalloc.stop()
+        del scanned
+    return results
+
+
+def main(args: list[str]) -> int:
+    parser = ArgumentParser(description='Folder listing decryption time')
+    parser.add_argument('--nodes', metavar='#number', default=1000000, type=int, help='Listing size')
+    parser.add_argument('--workers', metavar='#number', default=0, type=int, help='Decryption processes, 0 to use all cores')
+    parser.add_argument('--per-node', action='store_true', help='Also measure node by node decryption')
+    parser.add_argument('--memory', action='store_true', help='Measure memory retained per node instead of decryption time')
+    parsed = parser.parse_args(args)
+    shared_key = tuple(int.from_bytes(os.urandom(4), 'big') for _ in range(4))
+    time_start = time.perf_counter()
+    nodes = make_listing(parsed.nodes, shared_key)
+    print(f'listing of {len(nodes):d} nodes generated in {time.perf_counter() - time_start:.2f} s')
+    results = bench_node_memory(nodes, shared_key) if parsed.memory else run(bench_folder_scan(nodes, shared_key, parsed.workers, per_node=parsed.per_node))
+    for result in results:
+        print(result)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
+
+#
+#
+#########################################
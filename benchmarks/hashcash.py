@@ -0,0 +1,98 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import base64
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from asyncio import create_task, get_running_loop, run, sleep
+from typing import NamedTuple
+
+from mega_download.api.encryption import make_hashcash_token
+from mega_download.api.hashcash import HashcashSolver
+from mega_download.api.process_pool import ProcessPool
+
+__all__ = ('SolveResult', 'bench_hashcash')
+
+
+class SolveResult(NamedTuple):
+    easiness: int
+    solve_time: float  # seconds
+    nonces: int  # -1 if unknown
+    loop_stall: float  # longest event loop stall, seconds
+
+
+def make_challenge(easiness: int) -> str:
+    return f'1:{easiness:d}:{int(time.time()):d}:{base64.urlsafe_b64encode(random.randbytes(48)).decode().rstrip("=")}'
+
+
+async def _watch_loop(stalls: list[float]) -> None:
+    loop = get_running_loop()
+    while True:
+        time_before = loop.time()
+        await sleep(0.005)
+        stalls.append(loop.time() - time_before - 0.005)
+
+
+async def bench_hashcash(easiness_values: list[int], repeats: int, workers: int, *, blocking: bool = False) -> list[SolveResult]:
+    """
+    Solves `repeats` random challenges for every easiness value while measuring event loop responsiveness
+    :param blocking: use single-threaded blocking `make_hashcash_token` instead of `HashcashSolver`
+    :returns results of each solve
+    """
+    results: list[SolveResult] = []
+    pool = ProcessPool(workers)
+    solver = HashcashSolver(pool)
+    try:
+        for easiness in easiness_values:
+            for _ in range(repeats):
+                challenge = make_challenge(easiness)
+                stalls: list[float] = []
+                watcher = create_task(_watch_loop(stalls))
+                await sleep(0)
+                time_start = time.perf_counter()
+                if blocking:
+                    make_hashcash_token(challenge)
+                else:
+                    await solver.solve(challenge)
+                solve_time = time.perf_counter() - time_start
+                await sleep(0.01)
+                watcher.cancel()
+                nonces = -1 if blocking else solver.history[-1].nonces
+                results.append(SolveResult(easiness, solve_time, nonces, max(stalls, default=solve_time)))
+    finally:
+        pool.shutdown()
+    return results
+
+
+def main(args: list[str]) -> int:
+    parser = ArgumentParser(description='Hashcash challenge solve time against easiness')
+    parser.add_argument('--easiness', metavar='#number', nargs='+', default=[255, 220, 200, 192], type=int, help='Easiness values')
+    parser.add_argument('--repeats', metavar='#number', default=3, type=int, help='Challenges per easiness value')
+    parser.add_argument('--workers', metavar='#number', default=0, type=int, help='Solver processes, 0 to use all cores')
+    parser.add_argument('--blocking', action='store_true', help='Use blocking single-core solver')
+    parsed = parser.parse_args(args)
+    results = run(bench_hashcash(parsed.easiness, parsed.repeats, parsed.workers, blocking=parsed.blocking))
+    for easiness in parsed.easiness:
+        rs = [_ for _ in results if _.easiness == easiness]
+        nonces_str = f', {sum(_.nonces for _ in rs) / sum(_.solve_time for _ in rs):.1f} nonces/s' if not parsed.blocking else ''
+        print(f'hashcash easiness {easiness:d}: ' + ', '.join(f'{_.solve_time:.2f}' for _ in rs)
+              + f' s (mean {sum(_.solve_time for _ in rs) / len(rs):.2f} s{nonces_str}),'
+              f' max loop stall {max(_.loop_stall for _ in rs) * 1000:.1f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
+
+#
+#
+#########################################
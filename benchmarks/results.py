@@ -0,0 +1,68 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import json
+import pathlib
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from mega_download.api.defs import UTF8
+
+__all__ = ('BenchResult', 'Regression', 'compare_results', 'load_results', 'save_results')
+
+
+class BenchResult(NamedTuple):
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.value:.6g} {self.unit}'
+
+
+class Regression(NamedTuple):
+    name: str
+    baseline: float
+    value: float
+    change: float  # relative, negative is worse
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.baseline:.6g} -> {self.value:.6g} ({self.change * 100:+.1f}%)'
+
+
+def save_results(results: Sequence[BenchResult], path: pathlib.Path) -> None:
+    path.write_text(json.dumps({_.name: _._asdict() for _ in results}, indent=1), encoding=UTF8)
+
+
+def load_results(path: pathlib.Path) -> list[BenchResult]:
+    return [BenchResult(**_) for _ in json.loads(path.read_text(encoding=UTF8)).values()]
+
+
+def compare_results(results: Sequence[BenchResult], baseline: Sequence[BenchResult], threshold: float) -> list[Regression]:
+    """
+    :param threshold: relative change considered a regression
+    :returns results worse than baseline ones by more than `threshold`, measurements missing from baseline are skipped
+    """
+    baseline_values = {_.name: _.value for _ in baseline}
+    regressions: list[Regression] = []
+    for result in results:
+        if not (base_value := baseline_values.get(result.name)):
+            continue
+        change = (result.value - base_value) / base_value
+        if not result.higher_is_better:
+            change = -change
+        if change < -threshold:
+            regressions.append(Regression(result.name, base_value, result.value, change))
+    return regressions
+
+#
+#
+#########################################
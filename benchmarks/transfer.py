@@ -0,0 +1,155 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import os
+import pathlib
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from asyncio import run
+from tempfile import TemporaryDirectory
+from typing import NamedTuple
+
+from aiohttp import ClientTimeout, web
+from Crypto.Cipher import AES
+
+from mega_download.api import FSYNC_MODES, DownloadMode, DownloadParams, FsyncMode, Mega, MegaOptions, Mem, OutputPolicy
+from mega_download.api.chunkgen import make_chunk_generator
+from mega_download.api.containers import ParsedUrl
+from mega_download.api.context import LinkContext
+
+__all__ = ('StandInStorage', 'TransferResult', 'bench_transfer')
+
+
+class BenchLogger:
+    @staticmethod
+    def log(text: str) -> None:
+        pass
+
+    fatal = error = warn = info = debug = trace = log
+
+
+class StandInStorage:
+    """
+    Local stand-in for mega.nz storage host: serves single file encrypted with random key, supports byte ranges.
+    Meta mac is not computed, mac check result is ignored
+    """
+    def __init__(self, size: int) -> None:
+        self.key = os.urandom(16)
+        self.iv = os.urandom(8)
+        self.encrypted = AES.new(self.key, AES.MODE_CTR, nonce=self.iv, initial_value=0).encrypt(os.urandom(size))
+        self._runner: web.AppRunner | None = None
+        self.url = ''
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        start, end = 0, len(self.encrypted) - 1
+        if range_header := request.headers.get('Range'):
+            start, end = (int(_) for _ in range_header.removeprefix('bytes=').split('-'))
+        response = web.StreamResponse(status=206 if range_header else 200)
+        response.content_length = end + 1 - start
+        await response.prepare(request)
+        view = memoryview(self.encrypted)
+        for offset in range(start, end + 1, 64 * Mem.KB):
+            await response.write(view[offset:min(offset + 64 * Mem.KB, end + 1)])
+        return response
+
+    async def __aenter__(self) -> StandInStorage:
+        app = web.Application()
+        app.router.add_get('/dl', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{self._runner.addresses[0][1]:d}/dl'
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self._runner.cleanup()
+
+
+class TransferResult(NamedTuple):
+    throughput: float  # MB/s
+    chunks: int
+    chunk_buffer_allocations: int  # -1 if buffer pool is not available
+    peak_memory: int  # -1 if not traced
+
+
+async def bench_transfer(
+    size: int, segments: int, repeats: int, *, output_policy: OutputPolicy = OutputPolicy(), trace_alloc: bool = False,
+) -> list[TransferResult]:
+    """
+    Downloads a file of given size from local stand-in server `repeats` times
+    :param output_policy: output file policy (preallocation, writes coalescing, fsync)
+    :param trace_alloc: trace memory allocations (tracemalloc), throughput is affected
+    :returns results of each run
+    """
+    results: list[TransferResult] = []
+    async with StandInStorage(size) as storage:
+        for _ in range(repeats):
+            with TemporaryDirectory(prefix='mega_download_bench_') as tempdir_name:
+                dest_base = pathlib.Path(tempdir_name)
+                options = MegaOptions(
+                    dest_base=dest_base, retries=0, max_jobs=segments, segments=segments,
+                    timeout=ClientTimeout(total=None, connect=5, sock_read=30.0), nodelay=True, noconfirm=True, proxy='',
+                    api_request_rate=0.0, storage_request_rate=0.0, overwrite_policy=None, prompts=None,
+                    extra_headers=[], extra_cookies=[], filters=(), hooks_before_download=(), hooks_after_scan=(),
+                    download_mode=DownloadMode.FULL, output_policy=output_policy, output_backend=None,
+                    session_cache=None, listing_cache=None, manifest=False, logger=BenchLogger,
+                )
+                params = DownloadParams(0, 1, storage.url, dest_base / 'file.bin', size, storage.iv, bytes(8), storage.key)
+                async with Mega(options) as mega:
+                    if trace_alloc:
+                        tracemalloc.start()
+                    time_start = time.perf_counter()
+                    await mega._download(params, LinkContext(ParsedUrl.default(), 1))
+                    throughput = size / Mem.MB / (time.perf_counter() - time_start)
+                    peak_memory = -1
+                    if trace_alloc:
+                        peak_memory = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                    pool = getattr(mega, '_buffer_pool', None)
+                    results.append(TransferResult(
+                        throughput, len(list(make_chunk_generator(size))), pool.allocations if pool else -1, peak_memory))
+    return results
+
+
+def main(args: list[str]) -> int:
+    parser = ArgumentParser(description='Per-file transfer throughput against local stand-in storage server')
+    parser.add_argument('--size', metavar='#MB', default=256, type=int, help='File size, MB')
+    parser.add_argument('--segments', metavar='#number', default=1, type=int, help='Segments per file')
+    parser.add_argument('--repeats', metavar='#number', default=3, type=int, help='Number of runs')
+    parser.add_argument('--coalesce', metavar='#KB', default=OutputPolicy().coalesce_size // Mem.KB, type=int,
+                        help='Coalesced write size, KB. 0 to write chunks as is')
+    parser.add_argument('--sync-mode', default=FsyncMode.NEVER.value, choices=FSYNC_MODES, help='Output file fsync mode')
+    parser.add_argument('--no-preallocate', action='store_true', help='Do not preallocate output file')
+    parser.add_argument('--trace-alloc', action='store_true', help='Report chunk buffer allocations and peak traced memory')
+    parsed = parser.parse_args(args)
+    output_policy = OutputPolicy(
+        preallocate=not parsed.no_preallocate, coalesce_size=parsed.coalesce * Mem.KB, fsync_mode=FsyncMode(parsed.sync_mode))
+    results = run(bench_transfer(
+        parsed.size * Mem.MB, parsed.segments, parsed.repeats, output_policy=output_policy, trace_alloc=parsed.trace_alloc))
+    print(f'transfer {parsed.size:d} MB x{parsed.segments:d}: ' + ', '.join(f'{_.throughput:.1f}' for _ in results)
+          + f' MB/s (best {max(_.throughput for _ in results):.1f} MB/s)')
+    if parsed.trace_alloc:
+        for result in results:
+            allocs_str = (f'{result.chunk_buffer_allocations:d} chunk buffers allocated for {result.chunks:d} chunks'
+                          f' ({result.chunk_buffer_allocations / result.chunks:.3f} per chunk)'
+                          if result.chunk_buffer_allocations >= 0 else 'no buffer pool')
+            print(f'{allocs_str}, peak traced memory {result.peak_memory / Mem.MB:.2f} MB')
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
+
+#
+#
+#########################################
@@ -1,28 +1,68 @@
 from .api import Mega
 from .containers import DownloadParams, DownloadParamsDump, File, FileSystemDump, Folder
-from .defs import DOWNLOAD_MODE_DEFAULT, DOWNLOAD_MODES, SITE_PRIMARY, DownloadMode, DownloadResult, Mem, NumRange
+from .defs import (
+    API_REQUEST_RATE,
+    DOWNLOAD_MODE_DEFAULT,
+    DOWNLOAD_MODES,
+    FSYNC_MODE_DEFAULT,
+    FSYNC_MODES,
+    OVERWRITE_POLICIES,
+    SITE_PRIMARY,
+    STORAGE_REQUEST_RATE,
+    DownloadMode,
+    DownloadResult,
+    FsyncMode,
+    Mem,
+    NumRange,
+    OutputPolicy,
+    OverwritePolicy,
+)
 from .exceptions import MegaNZError
+from .filters import NodeCheck
 from .hooks import DownloadParamsCallback, FileSystemCallback
 from .options import MegaOptions
-from .request_queue import RequestQueue
+from .output import AioFileOutputBackend, OutputBackend, PosixOutputBackend
+from .progress import FileProgress, ProgressCallback, ProgressEvent, ProgressEventType, ProgressTracker, TotalProgress
+from .prompts import PromptBroker
+from .request_queue import RequestQueue, TokenBucket
 
 __all__ = (
+    'API_REQUEST_RATE',
     'DOWNLOAD_MODES',
     'DOWNLOAD_MODE_DEFAULT',
+    'FSYNC_MODES',
+    'FSYNC_MODE_DEFAULT',
+    'OVERWRITE_POLICIES',
     'SITE_PRIMARY',
+    'STORAGE_REQUEST_RATE',
+    'AioFileOutputBackend',
     'DownloadMode',
     'DownloadParams',
     'DownloadParamsCallback',
     'DownloadParamsDump',
     'DownloadResult',
     'File',
+    'FileProgress',
     'FileSystemCallback',
     'FileSystemDump',
     'Folder',
+    'FsyncMode',
     'Mega',
     'MegaNZError',
     'MegaOptions',
     'Mem',
+    'NodeCheck',
     'NumRange',
+    'OutputBackend',
+    'OutputPolicy',
+    'OverwritePolicy',
+    'PosixOutputBackend',
+    'ProgressCallback',
+    'ProgressEvent',
+    'ProgressEventType',
+    'ProgressTracker',
+    'PromptBroker',
     'RequestQueue',
+    'TokenBucket',
+    'TotalProgress',
 )
@@ -8,19 +8,18 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 
 from __future__ import annotations
 
-import datetime
 import json
+import os
 import pathlib
 import random
 import re
 import sys
 import warnings
-from asyncio import Semaphore, create_task, gather, sleep
-from collections.abc import Generator, Sequence
+from asyncio import Lock, create_task, gather, sleep
+from collections.abc import Awaitable, Callable, Sequence
 from inspect import get_annotations
 from typing import Literal, TypeAlias
 
-from aiofile import async_open
 from aiohttp import (
     ClientConnectorError,
     ClientPayloadError,
@@ -32,44 +31,82 @@ from aiohttp import (
 )
 from aiohttp_socks import ProxyConnector
 
-from mega_download.util import UAManager, compose_link_v2, ensure_scheme_https
+from mega_download.util import UAManager, ensure_scheme_https
 
-from .chunkgen import make_chunk_decryptor, make_chunk_generator
+from .buffers import BufferPool
+from .chunkgen import Segment
 from .containers import (
     DownloadParams,
     DownloadParamsDump,
     File,
-    FilePathMapping,
-    FilesMapping,
     FileSystemMapping,
     Folder,
-    IntVector,
+    NodeRowMapping,
     NodeType,
     ParsedUrl,
     SharedKey,
     SharedkeysDict,
     UserInfo,
 )
-from .defs import CONNECT_RETRY_DELAY, SITE_API, SITE_TAG, UINT32_MAX, UTF8, DownloadMode, Mem
+from .context import LinkContext
+from .defs import (
+    API_BATCH_RETRY_CODES,
+    API_BATCH_SIZE_MAX,
+    API_REQUEST_RATE,
+    CONNECT_RETRY_DELAY,
+    DOWNLOAD_CHUNK_SIZE_MAX,
+    DOWNLOAD_SEGMENT_SIZE_MIN,
+    JOURNAL_FILE_EXT,
+    MANIFEST_FILE_NAME,
+    NODE_DECRYPT_BATCH_SIZE,
+    PART_FILE_EXT,
+    PIPELINE_BUFFERS_PER_TRANSFER,
+    SITE_API,
+    SITE_TAG,
+    STORAGE_REQUEST_RATE,
+    UINT32_MAX,
+    UTF8,
+    DownloadMode,
+    Mem,
+    OutputPolicy,
+    OverwritePolicy,
+)
 from .encryption import (
-    base64_to_ints,
     base64_url_decode,
     base64_url_encode,
     decrypt_attr,
-    decrypt_key,
-    encrypt_key,
-    ints_to_base64,
-    make_hashcash_token,
+    decrypt_key_bytes,
+    encrypt_key_bytes,
     pack_sequence,
+    session_id_matches,
     unpack_sequence,
     urand,
+    xor_key_halves,
 )
 from .exceptions import LoginError, MegaErrorCodes, RequestError, ValidationError
-from .filters import Filter, any_filter_matching
+from .filters import Filter, FilterPipeline
+from .hashcash import HashcashSolver
 from .hooks import DownloadParamsCallback, FileSystemCallback
+from .journal import ChunkJournal
+from .listing_cache import FolderListingCache
+from .listing_stream import ListingStreamParser
 from .logging import Log, set_logger
+from .mac_engine import MacEngine
+from .manifest import DownloadManifest, ManifestEntry
+from .metrics import Metrics
+from .node_decryptor import EncryptedNode, NodeDecryptor
+from .node_table import NodeTable
 from .options import MegaOptions
+from .output import OutputBackend, OutputFile, default_output_backend
+from .pipeline import TransferPipeline
+from .process_pool import ProcessPool
+from .progress import ProgressTracker, TransferProgress, log_progress
+from .prompts import PromptBroker
 from .request_queue import RequestQueue
+from .scheduler import JobScheduler
+from .session_cache import SessionCache
+from .transfer import TransferState
+from .url_resolver import BatchUrlResolver
 
 __all__ = ('Mega',)
 
@@ -91,31 +128,53 @@ class Mega:
         self._session: ClientSession | None = None
         self._sequence_num: int = urand()
         self._sid: str = ''
+        self._logged_in = False
+        self._session_expired = False
+        self._login_lock = Lock()
         self._user_nodes: dict[NodeType, str] = {}
-        self._master_key: IntVector = ()
+        self._master_key = b''
         self._shared_keys: SharedkeysDict = {}
-        self._queue_size: int = 0
-        self._queue_size_orig: int = 0
-        self._parsed: ParsedUrl = ParsedUrl.default()
+        self._file_url_resolvers: dict[str, BatchUrlResolver] = {}
         # options
         self._dest_base: pathlib.Path = options['dest_base']
         self._retries: int = options['retries']
         self._max_jobs = options['max_jobs']
+        self._segments: int = options.get('segments', 1)
         self._timeout: ClientTimeout = options['timeout']
         self._nodelay: bool = options['nodelay']
+        self._request_queue = RequestQueue(options.get('api_request_rate', API_REQUEST_RATE), options.get('storage_request_rate', STORAGE_REQUEST_RATE))
         self._noconfirm: bool = options['noconfirm']
+        self._overwrite_policy = options.get('overwrite_policy') or (OverwritePolicy.MISMATCH if self._noconfirm else OverwritePolicy.ASK)
+        self._prompts: PromptBroker = options.get('prompts') or PromptBroker()
         self._proxy: str = options['proxy']
         self._extra_headers: list[tuple[str, str]] = options['extra_headers']
         self._extra_cookies: list[tuple[str, str]] = options['extra_cookies']
-        self._filters: tuple[Filter, ...] = options['filters']
+        self._filters = FilterPipeline(options['filters'])
         self._before_download_hooks: tuple[DownloadParamsCallback, ...] = options['hooks_before_download']
         self._after_scan_hooks: tuple[FileSystemCallback, ...] = options['hooks_after_scan']
         self._download_mode: DownloadMode = options['download_mode']
+        self._output_policy: OutputPolicy = options.get('output_policy', OutputPolicy())
+        self._output_backend: Callable[[], OutputBackend] = options.get('output_backend') or default_output_backend
+        self._session_cache = SessionCache(options['session_cache']) if options.get('session_cache') else None
+        self._listing_cache = FolderListingCache(options['listing_cache']) if options.get('listing_cache') else None
+        self._manifest = DownloadManifest(self._dest_base / MANIFEST_FILE_NAME) if options.get('manifest', False) else None
         # ensure correct args
         assert Log
         assert next(reversed(self._dest_base.parents)).is_dir()
         assert isinstance(self._download_mode, DownloadMode)
         assert self._max_jobs > 0
+        assert self._segments > 0
+        # workers
+        self._metrics = Metrics()
+        self._mac_engine = MacEngine(max(1, min(os.cpu_count() or 1, self._max_jobs * self._segments)), self._metrics)
+        self._buffer_pool = BufferPool(DOWNLOAD_CHUNK_SIZE_MAX, self._max_jobs * self._segments * PIPELINE_BUFFERS_PER_TRANSFER)
+        self._process_pool = ProcessPool()
+        self._hashcash_solver = HashcashSolver(self._process_pool)
+        self._node_decryptor = NodeDecryptor(self._process_pool)
+        self._scheduler = JobScheduler(self._max_jobs)
+        self._max_connections = self._max_jobs * self._segments + 1  # transfers and API requests
+        self._progress = ProgressTracker()
+        self._progress.subscribe(log_progress)
 
     async def __aenter__(self) -> Mega:
         return self
@@ -123,15 +182,16 @@ class Mega:
     async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
         if self._session and not self._session.closed:
             await self._session.close()
-
-    @property
-    def original_url(self):
-        return compose_link_v2(self._parsed.folder_id, self._parsed.file_id, self._parsed.key_b64)
+        await self._progress.close()
+        self._mac_engine.shutdown()
+        self._process_pool.shutdown()
+        if self._manifest:
+            self._manifest.close()
 
     @staticmethod
     def _make_download_params(
         index: int, original_pos: int, direct_file_url: str, output_path: pathlib.Path,
-        file_size: int, iv: IntVector, meta_mac: IntVector, k_decrypted: IntVector,
+        file_size: int, iv: bytes, meta_mac: bytes, k_decrypted: bytes,
     ) -> DownloadParams:
         return DownloadParams(
             index,
@@ -144,14 +204,56 @@ class Mega:
             k_decrypted,
         )
 
-    def _before_download(self, download_params: DownloadParams) -> None:
+    def _num_segments(self, file_size: int) -> int:
+        return min(self._segments, max(1, file_size // DOWNLOAD_SEGMENT_SIZE_MIN))
+
+    def _manifest_key(self, output_path: pathlib.Path) -> str | None:
+        if self._manifest is None or self._download_mode != DownloadMode.FULL or not output_path.is_relative_to(self._dest_base):
+            return None
+        return output_path.relative_to(self._dest_base).as_posix()
+
+    def _is_up_to_date(self, manifest_key: str, manifest_entry: ManifestEntry) -> bool:
+        """Manifest hit, confirmed by a single stat of the file. Entries of files removed or resized on disk are dropped"""
+        if self._manifest.lookup(manifest_key) != manifest_entry:
+            return False
+        try:
+            if (self._dest_base / manifest_key).stat().st_size == manifest_entry.size:
+                return True
+        except OSError:
+            pass
+        Log.debug(f'{manifest_key} was removed or changed on disk, dropping it from manifest...')
+        self._manifest.forget(manifest_key)
+        return False
+
+    def _exclude_up_to_date(self, table: NodeTable, files: NodeRowMapping, proc_queue: set[str]) -> set[str]:
+        up_to_date = set[str]()
+        for qpath in proc_queue:
+            row = files[qpath]
+            entry = ManifestEntry(table.handles[row], table.sizes[row], table.timestamps[row], table.meta_mac_bytes(row).hex(), True)
+            if self._is_up_to_date(qpath, entry):
+                up_to_date.add(qpath)
+        if up_to_date:
+            Log.info(f'{len(up_to_date):d} / {len(proc_queue):d} files are up to date, skipped')
+        return proc_queue - up_to_date
+
+    def _before_download(self, ctx: LinkContext, download_params: DownloadParams) -> None:
         for hook in self._before_download_hooks:
-            hook.execute(self.original_url, download_params)
+            hook.execute(ctx.original_url, download_params)
 
     def _after_scan(self, root_id: str, ftree: FileSystemMapping) -> None:
         for hook in self._after_scan_hooks:
             hook.execute(root_id, ftree)
 
+    @property
+    def metrics(self) -> Metrics:
+        """Counters and latency histograms of this run"""
+        return self._metrics
+
+    @property
+    def progress(self) -> ProgressTracker:
+        """Progress of all transfers, subscribe to it to receive progress events"""
+        return self._progress
+
     def abort(self) -> None:
         Log.warn('Aborting...')
         self._aborted = True
@@ -161,10 +263,10 @@ class Mega:
             raise ValidationError('Called `make_session` with current session active!')
         use_proxy = bool(self._proxy)
         if use_proxy:
-            connector = ProxyConnector.from_url(self._proxy, limit=self._max_jobs)
+            connector = ProxyConnector.from_url(self._proxy, limit=self._max_connections)
         else:
-            connector = TCPConnector(limit=self._max_jobs)
-        session = ClientSession(connector=connector, read_bufsize=Mem.MB, timeout=self._timeout)
+            connector = TCPConnector(limit=self._max_connections)
+        session = ClientSession(connector=connector, read_bufsize=Mem.MB, timeout=self._timeout, trace_configs=[self._metrics.trace_config()])
         new_useragent = UAManager.select_useragent(self._proxy if use_proxy else None)
         Log.trace(f'[{"P" if use_proxy else "NP"}] Selected user-agent \'{new_useragent}\'...')
         session.headers.update({'User-Agent': new_useragent, 'Content-Type': 'application/json'})
@@ -181,11 +283,59 @@ class Mega:
         if self._session is None or self._session.closed:
             self._session = self._make_session()
         if self._nodelay is False:
-            await RequestQueue.until_ready(url)
+            with self._metrics.timed('request_queue_wait'):
+                await self._request_queue.until_ready(url)
         if 'timeout' not in kwargs:
             kwargs.update(timeout=self._timeout)
         return await self._session.request(method, url, **kwargs)
 
+    async def _post_api(self, data_input: list[dict[str, str]], add_params: dict[str, str]) -> ClientResponse:
+        """Sends API commands as a single request, solving hashcash challenge if requested. Returns the response"""
+        if self._session_expired:
+            await self._login()
+        params: dict[str, int | str] = {'id': self._sequence_num} | add_params
+        self._sequence_num = (self._sequence_num + 1) % UINT32_MAX
+
+        if self._sid:
+            params['sid'] = self._sid
+
+        Log.trace(lambda: f'Sending API request: POST, params: {params!s}, input: {data_input!s}')
+        r = await self._wrap_request('POST', SITE_API, params=params, json=data_input)
+
+        hashcash_challenge: str = r.headers.get('X-Hashcash')
+        if hashcash_challenge:
+            with self._metrics.timed('hashcash'):
+                hashcash_token = await self._hashcash_solver.solve(hashcash_challenge)
+            hashcash_headers = {'X-Hashcash': hashcash_token}
+            Log.info(f'Solving xhashcash login challenge..., Body: {hashcash_challenge} -> {hashcash_token}')
+            r = await self._wrap_request('POST', SITE_API, params=params, json=data_input, headers=hashcash_headers)
+            if hashcash_challenge := r.headers.get('X-Hashcash'):
+                raise RequestError(f'Login failed. Mega requested a proof of work with xhashcash: {hashcash_challenge}')
+        return r
+
+    async def _handle_api_error(self, e: Exception, r: ClientResponse | None, try_num: int, tag: str) -> int | None:
+        """
+        Handles failed API request attempt, waits before the next one
+        :returns updated try number or None if request must not be retried
+        """
+        Log.error(f'{tag}: {sys.exc_info()[0]}: {sys.exc_info()[1]}')
+        self._metrics.count('api_errors')
+        if isinstance(e, RequestError) and e.code == MegaErrorCodes.ESID and self._logged_in:
+            self._expire_session()
+            return try_num + 1
+        if isinstance(e, RequestError):
+            if e.code not in (MegaErrorCodes.EINTERNAL, MegaErrorCodes.EAGAIN, MegaErrorCodes.ERATELIMIT, MegaErrorCodes.EKEY):
+                return None
+        if (r is None or r.status != 403) and not isinstance(e, CLIENT_CONNECTOR_ERRORS):
+            try_num += 1
+            Log.error(f'{tag}: error #{try_num:d}...')
+        if r is not None and not r.closed:
+            r.close()
+        if not self._aborted and try_num <= self._retries:
+            self._metrics.count('api_retries')
+            await sleep(random.uniform(*CONNECT_RETRY_DELAY))
+        return try_num
+
     async def query_api(self, data_input: dict[str, str], *, add_params: dict[str, str] | None = None) -> APIResponse:
         def handle_int_resp(int_resp: int) -> int:
             if int_resp == 0:
@@ -201,25 +351,9 @@ class Mega:
         while try_num <= self._retries:
             r: ClientResponse | None = None
             try:
-                params: dict[str, int | str] = {'id': self._sequence_num} | add_params
-                self._sequence_num = (self._sequence_num + 1) % UINT32_MAX
-
-                if self._sid:
-                    params['sid'] = self._sid
-
-                Log.trace(f'Sending API request: POST, params: {params!s}, input: {data_input!s}')
-                r = await self._wrap_request('POST', SITE_API, params=params, json=data_input)
-
-                hashcash_challenge: str = r.headers.get('X-Hashcash')
-                if hashcash_challenge:
-                    hashcash_token = make_hashcash_token(hashcash_challenge)
-                    hashcash_headers = {'X-Hashcash': hashcash_token}
-                    Log.info(f'Solving xhashcash login challenge..., Body: {hashcash_challenge} -> {hashcash_token}')
-                    r = await self._wrap_request('POST', SITE_API, params=params, json=data_input, headers=hashcash_headers)
-                    if hashcash_challenge := r.headers.get('X-Hashcash'):
-                        raise RequestError(f'Login failed. Mega requested a proof of work with xhashcash: {hashcash_challenge}')
-
-                jresp: list[int] | list[str] | int = await r.json()
+                with self._metrics.timed('api_request'):
+                    r = await self._post_api(data_input, add_params)
+                    jresp: list[int] | list[str] | int = await r.json()
 
                 if isinstance(jresp, int):
                     return handle_int_resp(jresp)
@@ -233,44 +367,165 @@ class Mega:
                 else:
                     raise RequestError(f'Unknown response: {jresp!r}')
             except Exception as e:
-                Log.error(f'query_api: {sys.exc_info()[0]}: {sys.exc_info()[1]}')
-                if isinstance(e, RequestError):
-                    if e.code not in (MegaErrorCodes.EINTERNAL, MegaErrorCodes.EAGAIN, MegaErrorCodes.ERATELIMIT, MegaErrorCodes.EKEY):
-                        break
-                if (r is None or r.status != 403) and not isinstance(e, CLIENT_CONNECTOR_ERRORS):
-                    try_num += 1
-                    Log.error(f'query_api: error #{try_num:d}...')
-                if r is not None and not r.closed:
-                    r.close()
+                try_num = await self._handle_api_error(e, r, try_num, 'query_api')
+                if try_num is None:
+                    break
                 if self._aborted:
                     return 0
-                if try_num <= self._retries:
-                    await sleep(random.uniform(*CONNECT_RETRY_DELAY))
+                continue
+
+        Log.error('Unable to connect. Aborting')
+        raise ConnectionError
+
+    async def query_api_batch(
+        self, data_inputs: Sequence[dict[str, str]], *, add_params: dict[str, str] | None = None,
+    ) -> list[APIResponse | RequestError]:
+        """
+        Sends multiple API commands (up to API_BATCH_SIZE_MAX) in a single request.
+        Commands failed with transient errors are resent, other per-command errors are returned in place of command results
+        :param data_inputs: API commands
+        :param add_params: request params, common for all commands
+        :returns commands results in the same order, RequestError for failed commands (including ones still failing when out of retries)
+        """
+        assert 0 < len(data_inputs) <= API_BATCH_SIZE_MAX
+        add_params: dict[str, str] = add_params or {}
+        results: list[APIResponse | RequestError | None] = [None] * len(data_inputs)
+        pending = list(range(len(data_inputs)))
+        last_error: Exception | None = None
+
+        try_num = 0
+        while try_num <= self._retries:
+            r: ClientResponse | None = None
+            try:
+                with self._metrics.timed('api_request'):
+                    r = await self._post_api([data_inputs[i] for i in pending], add_params)
+                    jresp: list[APIResponse] | int = await r.json()
+
+                if isinstance(jresp, int):
+                    # whole request failed
+                    if jresp == MegaErrorCodes.EAGAIN:
+                        raise ConnectionError('Request failed, retrying')
+                    raise RequestError(jresp)
+                elif not isinstance(jresp, list) or len(jresp) != len(pending):
+                    raise RequestError(f'Unknown response: {jresp!r}')
+
+                failed: list[int] = []
+                for idx, element in zip(pending, jresp, strict=True):
+                    if isinstance(element, int) and element in API_BATCH_RETRY_CODES:
+                        failed.append(idx)
+                        results[idx] = RequestError(element)
+                    elif isinstance(element, int) and element != 0:
+                        results[idx] = RequestError(element)
+                    else:
+                        results[idx] = element
+                if not failed:
+                    return results
+                pending = failed
+                raise ConnectionError(f'{len(pending):d} / {len(jresp):d} commands failed, retrying')
+            except Exception as e:
+                last_error = e
+                try_num = await self._handle_api_error(e, r, try_num, 'query_api_batch')
+                if try_num is None or self._aborted:
+                    break
+                continue
+
+        Log.error(f'query_api_batch: {len(pending):d} / {len(data_inputs):d} commands failed, giving up on them')
+        # commands never answered get the error of the last attempt
+        error = last_error if isinstance(last_error, RequestError) else RequestError(f'Unable to connect: {last_error!s}')
+        return [error if result is None else result for result in results]
+
+    async def query_api_listing(
+        self, data_input: dict[str, str], *, add_params: dict[str, str] | None = None,
+        on_nodes: Callable[[list[File | Folder]], Awaitable[None]], on_restart: Callable[[], None],
+    ) -> Folder:
+        """
+        Sends listing command ('f'), parsing response while it is being received.
+        Nodes are handed over in batches as soon as they arrive, whole response is never kept in memory
+        :param data_input: API command
+        :param add_params: request params
+        :param on_nodes: nodes consumer
+        :param on_restart: called before request is retried, nodes handed over so far must be discarded
+        :returns listing object, without nodes
+        """
+        add_params: dict[str, str] = add_params or {}
+
+        try_num = 0
+        while try_num <= self._retries:
+            r: ClientResponse | None = None
+            parser = ListingStreamParser()
+            try:
+                with self._metrics.timed('api_listing'):
+                    r = await self._post_api([data_input], add_params)
+                    async for data in r.content.iter_any():
+                        if nodes := parser.feed(data):
+                            await on_nodes(nodes)
+                    jresp: Folder | list[int] | int = parser.finish()
+
+                if isinstance(jresp, list) and len(jresp) == 1:
+                    jresp = jresp[0]
+                if isinstance(jresp, int):
+                    if jresp == MegaErrorCodes.EAGAIN:
+                        raise ConnectionError('Request failed, retrying')
+                    raise RequestError(jresp)
+                elif not isinstance(jresp, dict):
+                    raise RequestError(f'Unknown response: {jresp!r}')
+                Log.debug(f'Listing received: {parser.nodes_parsed:d} nodes')
+                return jresp
+            except Exception as e:
+                try_num = await self._handle_api_error(e, r, try_num, 'query_api_listing')
+                if parser.nodes_parsed:
+                    on_restart()
+                if try_num is None or self._aborted:
+                    break
                 continue
 
         Log.error('Unable to connect. Aborting')
         raise ConnectionError
 
     async def _login(self) -> None:
+        """Logs in once per instance, reusing cached session if possible. Concurrent callers wait for the first one to finish"""
+        async with self._login_lock:
+            if self._logged_in:
+                return
+            # cleared before login, its own requests must not trigger another login
+            self._session_expired = False
+            if self._session_cache and (session := self._session_cache.load()):
+                Log.info('Reusing cached anonymous session...')
+                self._sid, self._master_key = session.sid, session.master_key
+            else:
+                await self._login_anonymous()
+                if self._session_cache and self._sid:
+                    self._session_cache.save(self._sid, self._master_key)
+            self._logged_in = True
+
+    def _expire_session(self) -> None:
+        """Drops rejected session, next API request will log in again"""
+        if not self._logged_in:
+            return
+        Log.warn('Session was rejected by server, logging in again...')
+        self._logged_in = False
+        self._session_expired = True
+        self._sid = ''
+        if self._session_cache:
+            self._session_cache.remove()
+
+    async def _login_anonymous(self) -> None:
         Log.info('Logging in as anonymous...')
-        master_key = [urand()] * 4
-        password_key = [urand()] * 4
-        self_challenge = [urand()] * 4
+        master_key = pack_sequence([urand()] * 4)
+        password_key = pack_sequence([urand()] * 4)
+        self_challenge = pack_sequence([urand()] * 4)
 
         user: str = await self.query_api({
             'a': 'up',
-            'k': ints_to_base64(encrypt_key(master_key, password_key)),
-            'ts': base64_url_encode(pack_sequence(self_challenge) + pack_sequence(encrypt_key(self_challenge, master_key))),
+            'k': base64_url_encode(encrypt_key_bytes(master_key, password_key)),
+            'ts': base64_url_encode(self_challenge + encrypt_key_bytes(self_challenge, master_key)),
         })
 
         resp: UserInfo = await self.query_api({'a': 'us', 'user': user})
-        master_key_encrypted = base64_to_ints(resp['k'])
-        self._master_key = decrypt_key(master_key_encrypted, password_key)
+        master_key_encrypted = base64_url_decode(resp['k'])
+        self._master_key = decrypt_key_bytes(master_key_encrypted, password_key)
         if b64_tsid := resp.get('tsid'):
-            tsid = base64_url_decode(b64_tsid)
-            key_encrypted = pack_sequence(encrypt_key(unpack_sequence(tsid[:16]), self._master_key))
-            Log.trace(f'Key (encrypted): {key_encrypted}')
-            if key_encrypted == tsid[-16:]:
+            if session_id_matches(b64_tsid, self._master_key):
                 self._sid = b64_tsid
         else:
             b64_csid = resp.get('csid', 'UNK')
@@ -288,76 +543,105 @@ class Mega:
         self._shared_keys = self._init_shared_keys(folder, self._master_key)
         return await self._process_folder_nodes(folder)
 
-    async def _get_nodes_in_shared_folder(self, folder_id: str) -> list[File | Folder]:
-        folder: Folder = await self.query_api({'a': 'f', 'c': 1, 'ca': 1, 'r': 1}, add_params={'n': folder_id})
-        return await self._process_folder_nodes(folder)
-
-    async def _prepare_folder_nodes(self, folder_id: str, shared_key: Sequence[int]) -> list[File | Folder]:
-        nodes: list[File | Folder] = []
-        for file_or_folder in await self._get_nodes_in_shared_folder(folder_id):
-            encrypted_key = base64_to_ints(file_or_folder['k'].split(':')[1])
-            key = decrypt_key(encrypted_key, shared_key)
-            if file_or_folder['t'] == NodeType.FILE:
-                k = (key[0] ^ key[4], key[1] ^ key[5], key[2] ^ key[6], key[3] ^ key[7])
-            elif file_or_folder['t'] == NodeType.FOLDER:
-                k = key
-            else:
-                assert False, f'Unhandled node type {file_or_folder["t"]} found in folder {folder_id}!'
-
-            iv = (*key[4:6], 0, 0)
-            meta_mac = key[6:8]
-
-            attrs = decrypt_attr(base64_url_decode(file_or_folder['a']), k)
-            file_or_folder['attributes'] = attrs
-            file_or_folder['k_decrypted'] = k
-            file_or_folder['iv'] = iv
-            file_or_folder['meta_mac'] = meta_mac
-            file_or_folder['timestamp'] = datetime.datetime.fromtimestamp(file_or_folder['ts'])
-            nodes.append(file_or_folder)
-        return nodes
+    async def _prepare_folder_nodes(self, folder_id: str, shared_key: bytes | Sequence[int]) -> NodeTable:
+        cached = self._listing_cache.load(folder_id, shared_key) if self._listing_cache else None
+        cached_nodes = cached.nodes if cached else {}
+        # listing nodes are not kept, only their table rows
+        table = NodeTable(keep_encrypted=self._listing_cache is not None)
+        rows_to_decrypt: list[int] = []
+        to_decrypt: list[EncryptedNode] = []
+        num_decrypted = 0
+        # with a single worker nodes are decrypted while listing is still being received, otherwise all at once by worker pool
+        decrypt_batch_size = NODE_DECRYPT_BATCH_SIZE if self._node_decryptor.workers <= 1 else 0
+
+        async def process_nodes(nodes_batch: list[File | Folder]) -> None:
+            nonlocal num_decrypted
+            for file_or_folder in nodes_batch:
+                row = table.add(file_or_folder)
+                cached_node = cached_nodes.get(file_or_folder['h'])
+                if cached_node is not None and cached_node.matches(file_or_folder['k'], file_or_folder['a']):
+                    table.set_decrypted(row, cached_node.name, cached_node.key_data)
+                elif file_or_folder['t'] in (NodeType.FILE, NodeType.FOLDER):
+                    rows_to_decrypt.append(row)
+                    to_decrypt.append(EncryptedNode(file_or_folder['t'], file_or_folder['k'], file_or_folder['a']))
+                else:
+                    assert False, f'Unhandled node type {file_or_folder["t"]} found in folder {folder_id}!'
+            if decrypt_batch_size and len(to_decrypt) >= decrypt_batch_size:
+                await self._decrypt_folder_nodes(table, rows_to_decrypt, to_decrypt, shared_key)
+                num_decrypted += len(to_decrypt)
+                rows_to_decrypt.clear()
+                to_decrypt.clear()
+
+        def restart() -> None:
+            nonlocal num_decrypted
+            table.clear()
+            rows_to_decrypt.clear()
+            to_decrypt.clear()
+            num_decrypted = 0
+
+        folder: Folder = await self.query_api_listing(
+            {'a': 'f', 'c': 1, 'ca': 1, 'r': 1}, add_params={'n': folder_id}, on_nodes=process_nodes, on_restart=restart)
+        await self._decrypt_folder_nodes(table, rows_to_decrypt, to_decrypt, shared_key)
+        num_decrypted += len(to_decrypt)
+        table.link()
+        sn = folder.get('sn', '')
+        if self._listing_cache:
+            if cached and cached.sn == sn:
+                Log.debug(f'Folder {folder_id} listing is unchanged since last run (sn {sn})')
+            Log.debug(f'Folder {folder_id}: {len(table) - num_decrypted:d} nodes reused from cache, {num_decrypted:d} decrypted')
+            if num_decrypted or not cached or cached.sn != sn or len(cached_nodes) != len(table):
+                self._listing_cache.save(folder_id, shared_key, sn, table)
+        return table
+
+    async def _decrypt_folder_nodes(
+        self, table: NodeTable, rows: list[int], nodes: list[EncryptedNode], shared_key: bytes | Sequence[int],
+    ) -> None:
+        for row, decrypted_node in zip(rows, await self._node_decryptor.decrypt(nodes, shared_key), strict=True):
+            table.set_decrypted(row, decrypted_node.attributes.get('n', ''), decrypted_node.key_data)
 
     def _process_folder_node(self, file_or_folder: File | Folder) -> File | Folder:
-        Log.trace(f'Node {file_or_folder["p"]}/{file_or_folder["h"]}...')
+        Log.trace(lambda: f'Node {file_or_folder["p"]}/{file_or_folder["h"]}...')
         if file_or_folder['t'] == NodeType.FILE or file_or_folder['t'] == NodeType.FOLDER:
             keys = dict(tuple[str, str](keypart.split(':', 1)) for keypart in file_or_folder['k'].split('/') if ':' in keypart)
             uid: str = file_or_folder['u']
-            key: IntVector | None = None
+            key: bytes | None = None
             # user objects
             if uid in keys:
-                key = decrypt_key(base64_to_ints(keys[uid]), self._master_key)
+                key = decrypt_key_bytes(base64_url_decode(keys[uid]), self._master_key)
             # shared folders
             elif 'su' in file_or_folder and 'sk' in file_or_folder and ':' in file_or_folder['k']:
-                Log.trace(f'Processing shared folder {file_or_folder["p"]}/{file_or_folder["h"]}...')
-                shared_key = decrypt_key(base64_to_ints(file_or_folder['sk']), self._master_key)
-                key = decrypt_key(base64_to_ints(keys[file_or_folder['h']]), shared_key)
+                Log.trace(lambda: f'Processing shared folder {file_or_folder["p"]}/{file_or_folder["h"]}...')
+                shared_key = decrypt_key_bytes(base64_url_decode(file_or_folder['sk']), self._master_key)
+                key = decrypt_key_bytes(base64_url_decode(keys[file_or_folder['h']]), shared_key)
                 if file_or_folder['su'] not in self._shared_keys:
                     self._shared_keys[file_or_folder['su']] = {}
                 self._shared_keys[file_or_folder['su']][file_or_folder['h']] = shared_key
             # shared files
             elif file_or_folder['u'] and file_or_folder['u'] in self._shared_keys:
-                Log.trace(f'Processing shared file {file_or_folder["p"]}/{file_or_folder["h"]}...')
+                Log.trace(lambda: f'Processing shared file {file_or_folder["p"]}/{file_or_folder["h"]}...')
                 for hkey in self._shared_keys[file_or_folder['u']]:
                     shared_key = self._shared_keys[file_or_folder['u']][hkey]
                     if hkey in keys:
-                        key = decrypt_key(base64_to_ints(keys[hkey]), shared_key)
+                        key = decrypt_key_bytes(base64_url_decode(keys[hkey]), shared_key)
                         break
             if file_or_folder['h'] and file_or_folder['h'] in self._shared_keys.get('EXP', ()):
                 shared_key = self._shared_keys['EXP'][file_or_folder['h']]
-                encrypted_key = unpack_sequence(base64_url_decode(file_or_folder['k'].split(':')[-1]))
-                key = decrypt_key(encrypted_key, shared_key)
-                file_or_folder['sk_decrypted'] = shared_key
+                encrypted_key = base64_url_decode(file_or_folder['k'].split(':')[-1])
+                key = decrypt_key_bytes(encrypted_key, shared_key)
+                file_or_folder['sk_decrypted'] = unpack_sequence(shared_key)
             if key is not None:
+                # keys stay bytes up to AES, node dict gets int tuples
                 # file
                 if file_or_folder['t'] == NodeType.FILE:
                     # file_or_folder = cast(File, file_or_folder)
-                    k = (key[0] ^ key[4], key[1] ^ key[5], key[2] ^ key[6], key[3] ^ key[7])
-                    file_or_folder['iv'] = (*key[4:6], 0, 0)
-                    file_or_folder['meta_mac'] = key[6:8]
+                    k = xor_key_halves(key)
+                    file_or_folder['iv'] = (*unpack_sequence(key[16:24]), 0, 0)
+                    file_or_folder['meta_mac'] = unpack_sequence(key[24:32])
                 # folder
                 else:
                     k = key
-                file_or_folder['key_decrypted'] = key
-                file_or_folder['k_decrypted'] = k
+                file_or_folder['key_decrypted'] = unpack_sequence(key)
+                file_or_folder['k_decrypted'] = unpack_sequence(k)
                 attributes_bytes = base64_url_decode(file_or_folder['a'])
                 attributes = decrypt_attr(attributes_bytes, k)
                 file_or_folder['attributes'] = attributes
@@ -382,9 +666,9 @@ class Mega:
                     file_data.direct_file_url,
                     self._dest_base / file_data.output_path,
                     file_data.file_size,
-                    file_data.iv,
-                    file_data.meta_mac,
-                    file_data.k_decrypted,
+                    pack_sequence(file_data.iv[:2]),
+                    pack_sequence(file_data.meta_mac),
+                    pack_sequence(file_data.k_decrypted),
                 ) for file_data in file_datas)
         return download_param_list
 
@@ -398,11 +682,13 @@ class Mega:
         warnings.warn('Entry point \'download_from_file\' is unreliable and should not be used', DeprecationWarning)
 
         async def proc_download_params(dparams: DownloadParams) -> pathlib.Path:
-            self._before_download(dparams)
-            return await self._download(dparams)
+            async with self._scheduler.slot(links_file.as_posix()):
+                self._before_download(ctx, dparams)
+                return await self._download(dparams, ctx)
 
         donwload_param_list = self._parse_file(links_file)
         Log.info(f'Parsed {links_file.name}: found {len(donwload_param_list):d} files')
+        ctx = LinkContext(ParsedUrl.default(), len(donwload_param_list))
 
         tasks = []
         for download_params in donwload_param_list:
@@ -415,93 +701,137 @@ class Mega:
         Log.info(f'Downloaded {len([c for c in results if isinstance(c, pathlib.Path)])} / {len(tasks)} files')
         return results
 
+    async def download_urls(self, urls: Sequence[str]) -> list[tuple[pathlib.Path, ...] | Exception]:
+        """
+        Parse given folder or file URLs and download found files, processing all URLs concurrently.
+        Download urls of files behind file links are resolved together in batched API commands
+        :param urls: mega link urls
+        :return: processed file paths of each url, or error that made url fail
+        """
+        file_ids: list[str] = []
+        for url in urls:
+            try:
+                parsed = self._parse_url(url)
+            except Exception:
+                continue  # reported by its own download
+            if parsed.file_id and not parsed.folder_id:
+                file_ids.append(parsed.file_id)
+        url_resolver = BatchUrlResolver(self._query_file_urls, list(dict.fromkeys(file_ids)))
+        # each file link claims shared resolver once, repeated links get their own one
+        self._file_url_resolvers.update(dict.fromkeys(file_ids, url_resolver))
+        try:
+            results: list[tuple[pathlib.Path, ...] | BaseException] = await gather(*(self.download_url(_) for _ in urls), return_exceptions=True)
+        finally:
+            self._file_url_resolvers.clear()
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        return results
+
     async def download_url(self, url: str) -> tuple[pathlib.Path, ...]:
         """
-        Parse given folder or file URL and download found files
+        Parse given folder or file URL and download found files.
+        Reentrant: multiple urls can be processed concurrently, sharing global download jobs budget
         :param url: mega link url
         :return: processed file paths
         """
-        self._parsed = self._parse_url(url)
-        assert self._parsed.key_b64
-        assert self._parsed.folder_id or self._parsed.file_id
-
-        Log.info(f'Processing {"folder" if self._parsed.folder_id else "file"} {self._parsed.folder_id or self._parsed.file_id}...')
-        if self._parsed.folder_id and self._parsed.file_id:
-            Log.info(f'Pre-selected file {self._parsed.file_id}...')
+        ctx = LinkContext(self._parse_url(url))
+        parsed = ctx.parsed
+        assert parsed.key_b64
+        assert parsed.folder_id or parsed.file_id
+
+        Log.info(f'Processing {"folder" if parsed.folder_id else "file"} {parsed.folder_id or parsed.file_id}...')
+        if parsed.folder_id and parsed.file_id:
+            Log.info(f'Pre-selected file {parsed.file_id}...')
         await self._login()
-        if self._parsed.folder_id:
-            return await self._download_folder()
+        if parsed.folder_id:
+            return await self._download_folder(ctx)
         else:
-            return await self._download_file(),  # noqa: COM818
+            return await self._download_file(ctx),  # noqa: COM818
+
+    async def _query_file_urls(self, file_ids: list[str]) -> list[File | RequestError]:
+        return await self.query_api_batch([{'a': 'g', 'g': 1, 'p': file_id} for file_id in file_ids])
 
-    async def _download_folder_file(self, index: int, file: File, file_path: pathlib.Path) -> pathlib.Path:
+    async def _query_folder_file_urls(self, folder_id: str, handles: list[str]) -> list[File | RequestError]:
+        return await self.query_api_batch([{'a': 'g', 'g': 1, 'n': handle} for handle in handles], add_params={'n': folder_id})
+
+    async def _download_folder_file(
+        self, ctx: LinkContext, index: int, table: NodeTable, row: int, file_path: pathlib.Path, url_resolver: BatchUrlResolver,
+    ) -> pathlib.Path:
         if self._aborted:
             return file_path
-        file_data: File = await self.query_api({'a': 'g', 'g': 1, 'n': file['h']}, add_params={'n': self._parsed.folder_id})
+        file = table.node(row)
+        file_data: File = await url_resolver.resolve(file['h'])
         file_url = file_data['g']
         file_size = file_data['s']
         output_path = self._dest_base / file_path
         orig_pos = file['num_in_queue']
         file_url_https = ensure_scheme_https(file_url)
-        iv = file['iv']
-        meta_mac = file['meta_mac']
-        k_decrypted = file['k_decrypted']
+        iv = table.iv_bytes(row)
+        meta_mac = table.meta_mac_bytes(row)
+        k_decrypted = table.key_bytes(row)
         download_params = self._make_download_params(index, orig_pos, file_url_https, output_path, file_size, iv, meta_mac, k_decrypted)
-        self._before_download(download_params)
-        return await self._download(download_params)
+        self._before_download(ctx, download_params)
+        return await self._download(download_params, ctx, file)
+
+    async def _download_folder(self, ctx: LinkContext) -> tuple[pathlib.Path, ...]:
+        folder_id = ctx.parsed.folder_id
+        table = await self._prepare_folder_nodes(folder_id, base64_url_decode(ctx.parsed.key_b64))
+        Log.trace(f'Folder {folder_id}: {len(table):d} nodes')
 
-    async def _download_folder(self) -> tuple[pathlib.Path, ...]:
-        fk_arr = base64_to_ints(self._parsed.key_b64)
-        fof_nodes: FilesMapping = {node['h']: node for node in await self._prepare_folder_nodes(self._parsed.folder_id, fk_arr)}
-        Log.trace(f'Folder {self._parsed.folder_id} nodes: {fof_nodes!s}')
+        root_row = 0
+        ftree: NodeRowMapping = self._build_file_system(table, [root_row])
+        files: NodeRowMapping = {p: row for p, row in ftree.items() if table.types[row] == NodeType.FILE}
+        Log.info(f'{table.names[root_row]}: found {len(files):d} files...')
 
-        root_id: str = next(iter(fof_nodes))
-        ftree_u: FileSystemMapping = await self._build_file_system(fof_nodes, [root_id])
-        ftree: FileSystemMapping = {p: ftree_u[p] for p in sorted(ftree_u, key=lambda p: ftree_u[p]['ts'])}
-        files: FilePathMapping = {p: f for p, f in ftree.items() if f['t'] == NodeType.FILE}
-        Log.info(f'{fof_nodes[root_id]["attributes"]["n"]}: found {len(files):d} files...')
+        for fidx, row in enumerate(files.values()):
+            table.nums_in_queue[row] = fidx + 1
 
-        for fidx, fpath in enumerate(files):
-            files[fpath]['num_in_queue'] = fidx + 1
+        if self._after_scan_hooks:
+            self._after_scan(table.handles[root_row], {pathlib.PurePosixPath(p): table.node(row) for p, row in ftree.items()})
 
-        self._after_scan(root_id, ftree)
+        ctx.queue_size_orig = len(files)
+        proc_queue: set[str] = await self._filter_folder_files(ctx, table, files)
+        if self._manifest and self._download_mode == DownloadMode.FULL:
+            proc_queue = self._exclude_up_to_date(table, files, proc_queue)
+        ctx.queue_size = len(proc_queue)
+        Log.info(f'Saving {ctx.queue_size:d} / {len(files):d} files...')
 
-        self._queue_size_orig = len(files)
-        proc_queue: set[pathlib.PurePosixPath] = self._filter_folder_files(files)
-        self._queue_size = len(proc_queue)
-        Log.info(f'Saving {self._queue_size:d} / {len(files):d} files...')
+        async def download_folder_file_wrapper(index: int, row: int, file_path: str) -> pathlib.Path:
+            async with self._scheduler.slot(folder_id):
+                return await self._download_folder_file(ctx, index, table, row, pathlib.Path(file_path), url_resolver)
 
-        async def download_folder_file_wrapper(index: int, file: File, file_path: pathlib.Path) -> pathlib.Path:
-            async with semaphore:
-                return await self._download_folder_file(index, file, file_path)
+        async def query_file_urls(handles: list[str]) -> list[File | RequestError]:
+            return await self._query_folder_file_urls(folder_id, handles)
 
-        semaphore = Semaphore(self._max_jobs)
+        # urls are resolved in batches ahead of transfer slots, in the same order files are downloaded
+        url_resolver = BatchUrlResolver(query_file_urls, [table.handles[ftree[path]] for path in ftree if path in proc_queue])
         tasks = []
         idx = 0
-        for path, file_or_folder in ftree.items():
+        for path, row in ftree.items():
             if self._aborted:
                 return ()
             if path not in proc_queue:
-                Log.trace(f'Skipping excluded node {file_or_folder!s} ({path})...')
+                Log.trace(lambda: f'Skipping excluded node {table.handles[row]} ({path})...')
                 continue
-            tasks.append(create_task(download_folder_file_wrapper(idx, file_or_folder, pathlib.Path(path))))
+            tasks.append(create_task(download_folder_file_wrapper(idx, row, path)))
             idx += 1
 
         results: tuple[pathlib.Path | BaseException, ...] = await gather(*tasks)
         Log.info(f'Downloaded {len([c for c in results if isinstance(c, pathlib.Path)])} / {len(tasks)} files')
         return results
 
-    async def _download_file(self) -> pathlib.Path:
-        fk_arr = base64_to_ints(self._parsed.key_b64)
-        k_decrypted = (fk_arr[0] ^ fk_arr[4], fk_arr[1] ^ fk_arr[5], fk_arr[2] ^ fk_arr[6], fk_arr[3] ^ fk_arr[7])
-        iv = (*fk_arr[4:6], 0, 0)
-        meta_mac = fk_arr[6:8]
-        file: File = await self.query_api({'a': 'g', 'g': 1, 'p': self._parsed.file_id})
+    async def _download_file(self, ctx: LinkContext) -> pathlib.Path:
+        file_key = base64_url_decode(ctx.parsed.key_b64)
+        k_decrypted, iv, meta_mac = xor_key_halves(file_key), file_key[16:24], file_key[24:32]
+        url_resolver = self._file_url_resolvers.pop(ctx.parsed.file_id, None) or BatchUrlResolver(self._query_file_urls, [ctx.parsed.file_id])
+        file: File = await url_resolver.resolve(ctx.parsed.file_id)
         file_url = file['g']
         file_size = file['s']
         attributes = decrypt_attr(base64_url_decode(file['at']), k_decrypted)
         file['attributes'] = attributes
         file['num_in_queue'] = 1
+        file['h'] = ctx.parsed.file_id
         file_name: str = attributes['n']
         ftree: FileSystemMapping = {pathlib.PurePosixPath(file_name): file}
 
@@ -513,55 +843,63 @@ class Mega:
         if 'g' not in file:
             raise RequestError('File not accessible anymore')
 
-        self._queue_size_orig = 1
-        self._queue_size = 1
+        ctx.queue_size_orig = 1
+        ctx.queue_size = 1
         output_path = self._dest_base / file_name
         file_url_https = ensure_scheme_https(file_url)
 
-        if ffilter := any_filter_matching(file, self._filters):
+        if ffilter := self._filters.first_matching(file):
             Log.info(f'File {file_name} was filtered out by {ffilter!s}. Skipped!')
             return output_path
 
         download_params = self._make_download_params(0, 1, file_url_https, output_path, file_size, iv, meta_mac, k_decrypted)
-        self._before_download(download_params)
-        return await self._download(download_params)
+        async with self._scheduler.slot(ctx.link_id):
+            self._before_download(ctx, download_params)
+            return await self._download(download_params, ctx, file)
 
-    async def _download(self, params: DownloadParams) -> pathlib.Path:
+    async def _download(self, params: DownloadParams, ctx: LinkContext, node: File | None = None) -> pathlib.Path:
         if self._download_mode == DownloadMode.SKIP:
             return params.output_path
         if self._aborted:
             return params.output_path
         num = params.index + 1
         num_orig = params.original_pos
-        direct_file_url = params.direct_file_url
         output_path = params.output_path
         expected_size = params.file_size
-        iv = params.iv
-        meta_mac = params.meta_mac
-        k_decrypted = params.k_decrypted
 
         touch = self._download_mode == DownloadMode.TOUCH
-
-        if output_path.is_file():
+        ts: int = node.get('ts', 0) if node else 0
+
+        # manifest tells up to date files without reading them, known outdated files are replaced unconditionally (as are overwritten ones)
+        manifest_key = self._manifest_key(output_path) if node else None
+        manifest_entry = ManifestEntry.make(node['h'], expected_size, ts, params.meta_mac) if manifest_key else None
+        replace_existing = False
+        if manifest_key is not None:
+            if self._is_up_to_date(manifest_key, manifest_entry):
+                Log.info(f'{output_path} is up to date')
+                return output_path
+            if self._manifest.lookup(manifest_key) is not None:
+                Log.info(f'{output_path} was changed or is incomplete, replacing...')
+                replace_existing = True
+
+        if output_path.is_file() and not replace_existing:
             existing_size = output_path.stat().st_size
             if not (touch and existing_size == 0):
                 size_match_msg = f'({"COMPLETE" if existing_size == expected_size else "MISMATCH!"})'
                 exists_msg = f'{output_path} already exists, size: {existing_size / Mem.MB:.2f} MB {size_match_msg}'
                 Log.info(exists_msg)
-                if self._noconfirm and existing_size == expected_size:
-                    return output_path
-                ans = 'q'
-                while ans not in 'yYnN01':
-                    ans = 'y' if self._noconfirm else input(f'{exists_msg}. Overwrite? [y/N]\n')
-                    if ans in 'nN0':
-                        Log.warn(f'{output_path.name} was skipped')
-                        return output_path
+                if not await self._confirm_overwrite(exists_msg, existing_size == expected_size):
+                    if existing_size == expected_size and self._overwrite_policy != OverwritePolicy.ASK:
+                        self._record_manifest(manifest_key, manifest_entry)
                     else:
-                        Log.warn(f'Overwriting {output_path.name}...')
+                        Log.warn(f'{output_path.name} was skipped')
+                    return output_path
+                Log.warn(f'Overwriting {output_path.name}...')
+                replace_existing = True
 
         touch_msg = ' <touch>' if touch else ''
         size_msg = '0.00 / ' if touch else ''
-        Log.info(f'[{SITE_TAG}] [{num:d} / {self._queue_size:d}] ([{num_orig:d} / {self._queue_size_orig}])'
+        Log.info(f'[{SITE_TAG}] [{num:d} / {ctx.queue_size:d}] ([{num_orig:d} / {ctx.queue_size_orig}])'
                  f' Saving{touch_msg} {output_path.name} => {output_path} ({size_msg}{expected_size / Mem.MB:.2f} MB)...')
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -570,36 +908,92 @@ class Mega:
             output_path.touch(exist_ok=True)
             return output_path
 
-        chunk_decryptor: Generator[bytes, bytes | None, None] | None = None
+        if not replace_existing and output_path.is_file() and output_path.stat().st_size == expected_size:
+            Log.info(f'{output_path} is already completed, size: {expected_size / Mem.MB:.2f}')
+            self._record_manifest(manifest_key, manifest_entry)
+            return output_path
+
+        part_path = output_path.with_name(f'{output_path.name}{PART_FILE_EXT}')
+        journal = ChunkJournal(part_path.with_name(f'{part_path.name}{JOURNAL_FILE_EXT}'))
+        state = TransferState(params, self._num_segments(expected_size), journal)
+        try:
+            if bytes_resumed := await state.resume(part_path, self._mac_engine):
+                Log.info(f'[{SITE_TAG}] [{num:d} / {ctx.queue_size:d}] {output_path.name}: resuming from'
+                         f' {bytes_resumed / Mem.MB:.2f} / {expected_size / Mem.MB:.2f} MB...')
+            if state.segmented:
+                Log.info(f'[{SITE_TAG}] [{num:d} / {ctx.queue_size:d}] {output_path.name}: using {len(state.segments):d} segments...')
+            output_file = OutputFile(
+                part_path, 'r+b' if bytes_resumed else 'wb', expected_size, self._output_policy, self._output_backend())
+            progress = self._progress.start(output_path.name, expected_size, bytes_resumed)
+            try:
+                with self._metrics.timed('file_transfer'):
+                    async with output_file:
+                        await gather(*(self._download_segment(state, segment, output_file, progress) for segment in state.segments))
+            finally:
+                self._progress.finish(progress)
+                self._metrics.count('bytes_transferred', state.bytes_written - bytes_resumed)
+        finally:
+            journal.close()
+
+        if state.completed:
+            # Trigger integrity check
+            mac_matches = state.check_mac()
+            self._metrics.count('files_completed')
+            if not mac_matches:
+                self._metrics.count('mac_mismatches')
+            part_path.replace(output_path)
+            journal.remove()
+            if ts:
+                os.utime(output_path, (ts, ts))
+            if manifest_entry is not None:
+                self._record_manifest(manifest_key, manifest_entry._replace(complete=mac_matches))
+        elif state.bytes_written == 0:
+            part_path.unlink(missing_ok=True)
+            journal.remove()
+
+        if output_path.is_file():
+            total_size = output_path.stat().st_size
+            Log.info(f'{output_path.name} {"" if total_size == expected_size else "NOT "}completed ({total_size / Mem.MB:.2f} MB)')
+            return output_path
+        if part_path.is_file():
+            Log.error(f'{output_path.name} NOT completed ({state.bytes_written / Mem.MB:.2f} / {expected_size / Mem.MB:.2f} MB),'
+                      f' partial file is kept for resuming')
+            return pathlib.Path()
+
+        Log.error(f'FAILED to download {output_path.name}!')
+        return pathlib.Path()
+
+    def _record_manifest(self, manifest_key: str | None, manifest_entry: ManifestEntry | None) -> None:
+        if manifest_key is not None and manifest_entry is not None:
+            self._manifest.record(manifest_key, manifest_entry)
+
+    async def _download_segment(self, state: TransferState, segment: Segment, output_file: OutputFile, progress: TransferProgress) -> bool:
+        params = state.params
+        output_path = params.output_path
+        expected_size = params.file_size
+
         try_num = 0
         while try_num <= self._retries:
-            if output_path.is_file() and output_path.stat().st_size == expected_size:
-                Log.info(f'{output_path} is already completed, size: {expected_size / Mem.MB:.2f}')
-                break
+            chunk_range = state.missing_chunks(segment)
+            if chunk_range is None:
+                return True
+            first_chunk, last_chunk = state.chunks[chunk_range.start], state.chunks[chunk_range.stop - 1]
+            range_end = last_chunk.offset + last_chunk.size
+            if first_chunk.offset == 0 and range_end == expected_size:
+                headers = None
+            else:
+                headers = {'Range': f'bytes={first_chunk.offset:d}-{range_end - 1:d}'}
+            pipeline = TransferPipeline(state, chunk_range, self._mac_engine, self._buffer_pool, metrics=self._metrics)
             r: ClientResponse | None = None
             try:
-                async with await self._wrap_request('GET', direct_file_url) as r:
+                async with await self._wrap_request('GET', params.direct_file_url, headers=headers) as r:
                     r.raise_for_status()
-                    bytes_written = 0
-                    chunk_generator = make_chunk_generator(expected_size)
-                    chunk_decryptor = make_chunk_decryptor(iv, k_decrypted, meta_mac)
-                    _ = next(chunk_decryptor)  # Init chunk decryptor
-                    async with async_open(output_path, 'wb') as output_file:
-                        for i, chunk in enumerate(chunk_generator):
-                            if i and try_num:
-                                try_num = 0
-                            raw_chunk: bytes = await r.content.readexactly(chunk.size)
-                            decrypted_chunk: bytes = chunk_decryptor.send(raw_chunk)
-                            actual_size = len(decrypted_chunk)
-                            bytes_written += actual_size
-                            if i % 10 == 0 or bytes_written + 1 * Mem.MB >= expected_size:
-                                dwn_progress_str = f'+{actual_size:d} ({bytes_written / Mem.MB:.2f} / {expected_size / Mem.MB:.2f} MB)'
-                                Log.info(f'[{SITE_TAG}] [{num:d} / {self._queue_size:d}] {output_path.name}'
-                                         f' chunk {i + 1:d}: {dwn_progress_str}...')
-                            await output_file.write(decrypted_chunk)
-                break
+                    await pipeline.run(r.content, output_file, progress.on_chunk_done)
             except Exception as e:
+                if pipeline.chunks_written > 1:
+                    try_num = 0
                 Log.error(f'{output_path.name}: {sys.exc_info()[0]}: {sys.exc_info()[1]}')
+                self._metrics.count('transfer_errors')
                 if (r is None or r.status not in (509,)) and not isinstance(e, CLIENT_CONNECTOR_ERRORS):
                     try_num += 1
                     Log.error(f'{output_path.name}: error #{try_num:d}...')
@@ -609,59 +1003,58 @@ class Mega:
                     time_left = r.headers.get('X-MEGA-Time-Left', '555') if r is not None else '555'
                     sleep_time = min(120. + int(time_left), 3600.)
                     Log.warn(f'MEGA transfer quota exceeded (returned {time_left})! Waiting {sleep_time:.2f} seconds...')
+                    self._metrics.count('quota_waits')
+                    self._metrics.count('quota_wait_seconds', sleep_time)
                     await sleep(sleep_time)
+                if self._aborted:
+                    break
                 if try_num <= self._retries:
+                    self._metrics.count('transfer_retries')
                     await sleep(random.uniform(*CONNECT_RETRY_DELAY))
-
-        if chunk_decryptor is not None:
-            try:
-                if touch:
-                    # No guarantee of generator being fully consumed
-                    chunk_decryptor.close()
-                else:
-                    # Finalize decryptor (trigger integrity check)
-                    chunk_decryptor.send(None)
-            except StopIteration:
-                pass
-
-        if output_path.is_file():
-            total_size = output_path.stat().st_size
-            Log.info(f'{output_path.name} {"" if total_size == expected_size else "NOT "}completed ({total_size / Mem.MB:.2f} MB)')
-            return output_path
-
-        Log.error(f'FAILED to download {output_path.name}!')
-        return pathlib.Path()
-
-    def _filter_folder_files(self, ftree: dict[pathlib.PurePosixPath, File]) -> set[pathlib.PurePosixPath]:
-        proc_queue = set[pathlib.PurePosixPath]()
+        return False
+
+    async def _confirm_overwrite(self, exists_msg: str, size_matches: bool) -> bool:
+        """:returns existing file should be overwritten, only asks if overwrite policy says so"""
+        if self._overwrite_policy == OverwritePolicy.ALL:
+            return True
+        if self._overwrite_policy == OverwritePolicy.NONE:
+            return False
+        if self._overwrite_policy == OverwritePolicy.MISMATCH:
+            return not size_matches
+        return await self._prompts.ask(f'{exists_msg}. Overwrite? [y/N]', 'yn10', 'n') in 'y1'
+
+    async def _filter_folder_files(self, ctx: LinkContext, table: NodeTable, files: NodeRowMapping) -> set[str]:
+        proc_queue = set[str]()
         file_idx = 0
         enqueued_idx = 0
-        for qpath, file in ftree.items():
+        filtered_by: list[Filter | None] = []
+        if self._filters and not (ctx.parsed.folder_id and ctx.parsed.file_id):
+            filtered_by = self._filters.evaluate(table, list(files.values()))
+            Log.debug(lambda: f'Filters: {self._filters!s}')
+        for qpath, row in files.items():
             if self._aborted:
                 break
             # is file
             file_idx += 1
-            if self._parsed.folder_id and self._parsed.file_id:
-                file_id = file['h']
-                do_append = file_id == self._parsed.file_id
+            if ctx.parsed.folder_id and ctx.parsed.file_id:
+                file_id = table.handles[row]
+                do_append = file_id == ctx.parsed.file_id
                 if not do_append:
-                    Log.trace(f'[{file_idx:d}] File \'{file_id}\' is not selected for download, skipped...')
+                    Log.trace(lambda: f'[{file_idx:d}] File \'{file_id}\' is not selected for download, skipped...')
                     continue
             elif self._filters:
-                if ffilter := any_filter_matching(file, self._filters):
-                    file_name = file['attributes']['n']
+                if ffilter := filtered_by[file_idx - 1]:
+                    file_name = table.names[row]
                     Log.info(f'[{file_idx:d}] File {file_name} was filtered out by {ffilter!s}. Skipped!')
                     continue
                 do_append = True
             else:
-                file_size = file['s']
-                ans = 'y' if self._noconfirm else 'q'
-                while ans not in 'nNyY10':
-                    ans = input(f'[{file_idx:d}] Download {qpath.name} ({file_size / Mem.MB:.2f} MB)? [Y/n]\n')
-                do_append = ans in 'yY1'
+                file_size = table.sizes[row]
+                question = f'[{file_idx:d}] Download {qpath.rpartition("/")[2]} ({file_size / Mem.MB:.2f} MB)? [Y/n]'
+                do_append = self._noconfirm or await self._prompts.ask(question, 'yn10', 'y') in 'y1'
             if do_append:
                 enqueued_idx += 1
-                Log.info(f'[{enqueued_idx:d}] {qpath.name} enqueued...')
+                Log.info(f'[{enqueued_idx:d}] {qpath.rpartition("/")[2]} enqueued...')
                 proc_queue.add(qpath)
         return proc_queue
 
@@ -714,10 +1107,10 @@ class Mega:
         return ParsedUrl(folder_id=root_folder_id, file_id=file_id, key_b64=shared_key)
 
     @staticmethod
-    def _init_shared_keys(folder: Folder, master_key: Sequence[int]) -> SharedkeysDict:
+    def _init_shared_keys(folder: Folder, master_key: bytes) -> SharedkeysDict:
         shared_key: SharedKey = {}
         for ok_item in folder['ok']:
-            decrypted_shared_key = decrypt_key(base64_to_ints(ok_item['k']), master_key)
+            decrypted_shared_key = decrypt_key_bytes(base64_url_decode(ok_item['k']), master_key)
             shared_key[ok_item['h']] = decrypted_shared_key
         shared_keys: SharedkeysDict = {}
         for s_item in folder['s']:
@@ -728,34 +1121,49 @@ class Mega:
         return shared_keys
 
     @staticmethod
-    async def _build_file_system(node_map: FilesMapping, root_ids: list[str]) -> FileSystemMapping:
-        async def build_path_tree(parent_item_id: str, parent_item_path: pathlib.PurePosixPath) -> None:
-            for child_item in parent_mapping.get(parent_item_id, []):
-                item_name: str = child_item['attributes'].get('n')
-                if item_name:
-                    item_path = parent_item_path / item_name.strip()
-                    path_mapping[item_path] = child_item
-                    if child_item['t'] == NodeType.FOLDER:
-                        await build_path_tree(child_item['h'], item_path)
-
-        path_mapping: FileSystemMapping = {}
-        parent_mapping: dict[str, list[File | Folder]] = {}  # parent_id -> child nodes
-
-        for file_or_folder_node in node_map.values():
-            parent_id = file_or_folder_node['p']
-            if parent_id not in parent_mapping:
-                parent_mapping[parent_id] = []
-            parent_mapping[parent_id].append(file_or_folder_node)
-
-        for root_id in root_ids:
-            root_node = node_map[root_id]
-            root_name = root_node['attributes']['n']
-            root_path = pathlib.PurePosixPath(root_name.strip() if root_name != 'Cloud Drive' else '.')
-            path_mapping[root_path] = root_node
-            await build_path_tree(root_id, root_path)
-
-        sorted_mapping: FileSystemMapping = {k: path_mapping[k] for k in sorted(path_mapping)}
-        return sorted_mapping
+    def _build_file_system(table: NodeTable, root_rows: list[int]) -> NodeRowMapping:
+        """
+        Maps paths of root nodes and all nodes reachable from them to their rows
+        :returns mapping ordered by node timestamp, then by path, same as `pathlib.PurePosixPath` would order them
+        """
+        names, types = table.names, table.types
+        parent_mapping: dict[int, list[int]] = {}  # parent row -> child rows
+        for row, parent_row in enumerate(table.parents):
+            if parent_row not in parent_mapping:
+                parent_mapping[parent_row] = []
+            parent_mapping[parent_row].append(row)
+
+        # paths are normalized strings, path objects are made only where needed. Later nodes with the same path take it over
+        path_mapping: NodeRowMapping = {}
+        for root_row in root_rows:
+            root_name = names[root_row]
+            root_path = str(pathlib.PurePosixPath(root_name.strip() if root_name != 'Cloud Drive' else '.'))
+            path_mapping[root_path] = root_row
+            # depth-first, children in listing order; only a root can be its own ancestor
+            stack: list[tuple[int, str]] = [(row, root_path) for row in reversed(parent_mapping.get(root_row, ())) if row != root_row]
+            while stack:
+                row, parent_path = stack.pop()
+                item_name = names[row]
+                if not item_name:
+                    continue
+                item_name = item_name.strip()
+                if '/' in item_name or item_name in ('', '.') or parent_path == '.' or parent_path.endswith('/'):
+                    # let pathlib normalize
+                    item_path = str(pathlib.PurePosixPath(parent_path, item_name))
+                else:
+                    item_path = f'{parent_path}/{item_name}'
+                path_mapping[item_path] = row
+                if types[row] == NodeType.FOLDER:
+                    stack.extend((child_row, item_path) for child_row in reversed(parent_mapping.get(row, ())) if child_row != root_row)
+
+        # same order as path objects, that is path parts compared one by one. With no absolute paths and no NUL chars in names
+        # it is plain string order once separator is replaced with the lowest char
+        timestamps = table.timestamps
+        if any(path[0] == '/' or '\0' in path for path in path_mapping):
+            ordered = sorted(path_mapping, key=lambda path: (timestamps[path_mapping[path]], list(pathlib.PurePosixPath(path).parts)))
+        else:
+            ordered = sorted(path_mapping, key=lambda path: (timestamps[path_mapping[path]], path.replace('/', '\0') if path != '.' else ''))
+        return {path: path_mapping[path] for path in ordered}
 
 #
 #
@@ -0,0 +1,41 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+__all__ = ('BufferPool',)
+
+
+class BufferPool:
+    """
+    Pool of reusable preallocated chunk buffers. Not thread-safe, must only be used from event loop thread.
+    Pool grows on demand, only up to `max_buffers` released buffers are retained
+    """
+    def __init__(self, buffer_size: int, max_buffers: int) -> None:
+        self._buffer_size = buffer_size
+        self._max_buffers = max_buffers
+        self._free: list[bytearray] = []
+        self.allocations = 0
+        self.acquisitions = 0
+
+    def acquire(self, size: int) -> memoryview:
+        """Returns writable view of exactly `size` bytes"""
+        assert size <= self._buffer_size, f'Requested buffer size {size:d} exceeds pool buffer size {self._buffer_size:d}!'
+        self.acquisitions += 1
+        if self._free:
+            buffer = self._free.pop()
+        else:
+            self.allocations += 1
+            buffer = bytearray(self._buffer_size)
+        return memoryview(buffer)[:size]
+
+    def release(self, view: memoryview) -> None:
+        if len(self._free) < self._max_buffers:
+            self._free.append(view.obj)
+
+#
+#
+#########################################
@@ -6,17 +6,28 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+import threading
 from collections.abc import Generator, Sequence
 from typing import NamedTuple
 
 from Crypto.Cipher import AES
-from Crypto.Util import Counter
 
 from .defs import CHUNK_BLOCK_LEN, DOWNLOAD_CHUNK_SIZE_INIT, DOWNLOAD_CHUNK_SIZE_MAX, EMPTY_IV
-from .encryption import pack_sequence, pad_bytes_end, unpack_sequence
+from .encryption import pack_sequence, unpack_sequence
 from .logging import Log
 
-__all__ = ('make_chunk_decryptor', 'make_chunk_generator')
+__all__ = (
+    'Chunk',
+    'Segment',
+    'check_file_mac',
+    'condense_chunk_macs',
+    'make_chunk_decryptor',
+    'make_chunk_generator',
+    'make_chunk_mac',
+    'make_chunk_segments',
+)
+
+_mac_scratch = threading.local()
 
 
 class Chunk(NamedTuple):
@@ -24,6 +35,23 @@ class Chunk(NamedTuple):
     size: int
 
 
+class Segment(NamedTuple):
+    first_chunk: int  # index of the first segment chunk within the whole file
+    chunks: list[Chunk]
+
+    @property
+    def offset(self) -> int:
+        return self.chunks[0].offset
+
+    @property
+    def end(self) -> int:
+        return self.chunks[-1].offset + self.chunks[-1].size
+
+    @property
+    def size(self) -> int:
+        return self.end - self.offset
+
+
 def make_chunk_generator(chunk_size: int) -> Generator[Chunk]:
     # list of (offset, size), offset to file initial position
     offset = 0
@@ -36,53 +64,106 @@ def make_chunk_generator(chunk_size: int) -> Generator[Chunk]:
     yield Chunk(offset, chunk_size - offset)
 
 
-def make_chunk_decryptor(iv: Sequence[int], k_decrypted: Sequence[int], meta_mac: Sequence[int]) -> Generator[bytes, bytes | None, None]:
+def make_chunk_segments(file_size: int, num_segments: int) -> list[Segment]:
+    """
+    Splits file chunks into up to `num_segments` contiguous byte ranges of roughly equal size.
+    Segment boundaries always match chunk boundaries so chunk MACs stay intact
+    :param file_size: total file size
+    :param num_segments: desired number of segments
+    :returns list of segments, ordered by offset
+    """
+    chunks = list(make_chunk_generator(file_size))
+    segments: list[Segment] = []
+    chunk_idx = 0
+    for seg_num in range(1, max(1, num_segments) + 1):
+        seg_end = file_size * seg_num // num_segments
+        first_idx = chunk_idx
+        while chunk_idx < len(chunks) and (chunk_idx == first_idx or chunks[chunk_idx].offset < seg_end):
+            chunk_idx += 1
+        if chunk_idx > first_idx:
+            segments.append(Segment(first_idx, chunks[first_idx:chunk_idx]))
+    return segments
+
+
+def make_chunk_mac(k_bytes: bytes, iv_bytes: bytes, decrypted_chunk: bytes | memoryview) -> bytes:
+    """
+    Computes MAC of a single decrypted chunk. Chunk MACs are independent of each other.
+    Thread-safe, ciphertext is discarded into thread-local scratch buffer instead of being allocated for every chunk
+    :param k_bytes: packed decryption key
+    :param iv_bytes: packed MAC initialization vector (iv[0], iv[1], iv[0], iv[1])
+    :param decrypted_chunk: chunk of decrypted data
+    :returns chunk MAC (16 bytes), empty chunk produces no MAC
+    """
+    chunk_size = len(decrypted_chunk)
+    if not chunk_size:
+        return b''
+    encryptor = AES.new(k_bytes, AES.MODE_CBC, iv_bytes)
+    mem_view = memoryview(decrypted_chunk)  # avoid copying memory for the entire chunk when slicing
+    # ensure we reserve the last 16 bytes anyway (last 16-N bytes, with N between 1 and 16, including extremes)
+    rest_size = chunk_size - ((chunk_size % CHUNK_BLOCK_LEN) or CHUNK_BLOCK_LEN)
+    if rest_size:
+        if len(getattr(_mac_scratch, 'buffer', b'')) < rest_size:
+            _mac_scratch.buffer = bytearray(max(rest_size, DOWNLOAD_CHUNK_SIZE_MAX))
+        encryptor.encrypt(mem_view[:rest_size], output=memoryview(_mac_scratch.buffer)[:rest_size])
+    # pad last block to 16 bytes
+    last_block = bytes(mem_view[rest_size:]).ljust(CHUNK_BLOCK_LEN, b'\0')
+    return encryptor.encrypt(last_block)
+
+
+def make_chunk_decryptor(
+    iv: bytes, k_decrypted: bytes, *, offset: int = 0,
+) -> Generator[bytes | memoryview, bytes | memoryview | None, None]:
     """
     Decrypts chunks of data received via `send()` and yields the decrypted chunks.
     It decrypts chunks indefinitely until a sentinel value (`None`) is sent.
-    NOTE1: Initialize decryptor by requesting one chunk before interation 'next(chunker)'
-    NOTE2: You MUST send `None` after decrypting last chunk to execute the mac check
-    :param iv: Initialization vector (iv) as a list or tuple of two 32-bit unsigned integers
-    :param k_decrypted: Decryption key as a tuple of four 32-bit unsigned integers
-    :param meta_mac: The expected MAC value of the final file
+    Writable buffers (bytearray, memoryview) are decrypted in place and yielded back, `bytes` produce new object
+    Chunk MACs are not computed here, see `make_chunk_mac`
+    NOTE: Initialize decryptor by requesting one chunk before interation 'next(chunker)'
+    :param iv: CTR nonce, 8 bytes
+    :param k_decrypted: Decryption key, 16 bytes
+    :param offset: Position of the first chunk within the file, must be a multiple of 16
     :returns decrypted chunk of data
     """
+    assert offset % CHUNK_BLOCK_LEN == 0, f'Invalid decryptor offset {offset:d}!'
     try:
-        k_bytes = pack_sequence(k_decrypted)
-        counter = Counter.new(128, initial_value=((iv[0] << 32) + iv[1]) << 64)
-        aes = AES.new(k_bytes, AES.MODE_CTR, counter=counter)
-
-        # mega.nz uses CBC as a MAC mode: with each chunk the computed mac_bytes are used as iv for the next chunk MAC accumulation
-        mac_bytes = EMPTY_IV
-        mac_encryptor = AES.new(k_bytes, AES.MODE_CBC, mac_bytes)
-        iv_bytes = pack_sequence([iv[0], iv[1], iv[0], iv[1]])
+        # CTR counter is a block index, seed it at the first block of the segment
+        aes = AES.new(k_decrypted, AES.MODE_CTR, nonce=iv, initial_value=offset // CHUNK_BLOCK_LEN)
         raw_chunk = yield b''
-        while True:
-            if raw_chunk is None:
-                break
-            decrypted_chunk = aes.decrypt(raw_chunk)
-            raw_chunk = yield decrypted_chunk
-            encryptor = AES.new(k_bytes, AES.MODE_CBC, iv_bytes)
-
-            # take last 16-N bytes from chunk (with N between 1 and 16, including extremes)
-            mem_view = memoryview(decrypted_chunk)  # avoid copying memory for the entire chunk when slicing
-            # ensure we reserve the last 16 bytes anyway, we have to feed them into mac_encryptor
-            modchunk = (len(decrypted_chunk) % CHUNK_BLOCK_LEN) or CHUNK_BLOCK_LEN
-
-            # pad last block to 16 bytes
-            last_block = pad_bytes_end(mem_view[-modchunk:], amount=CHUNK_BLOCK_LEN)
-            rest_of_chunk = mem_view[:-modchunk]
-            _ = encryptor.encrypt(rest_of_chunk)
-            input_to_mac = encryptor.encrypt(last_block)
-            mac_bytes = mac_encryptor.encrypt(input_to_mac)
-
-        file_mac = unpack_sequence(mac_bytes)
-        computed_mac = file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3]
-        if computed_mac != meta_mac:
-            Log.fatal(f'Mismatched mac (res {computed_mac!s} != meta {meta_mac!s})')
+        while raw_chunk is not None:
+            if isinstance(raw_chunk, bytes):
+                raw_chunk = yield aes.decrypt(raw_chunk)
+            else:
+                # writable buffer, decrypt in place
+                aes.decrypt(raw_chunk, output=raw_chunk)
+                raw_chunk = yield raw_chunk
     except GeneratorExit:
         pass
 
+
+def condense_chunk_macs(k_decrypted: bytes, chunk_macs: Sequence[bytes]) -> bytes:
+    """
+    Condenses chunk MACs (ordered by chunk offset) into file MAC
+    :param k_decrypted: Decryption key, 16 bytes
+    :param chunk_macs: MACs of all file chunks
+    :returns file MAC, 8 bytes
+    """
+    # mega.nz uses CBC as a MAC mode: with each chunk the computed mac_bytes are used as iv for the next chunk MAC accumulation
+    mac_encryptor = AES.new(k_decrypted, AES.MODE_CBC, EMPTY_IV)
+    mac_bytes = EMPTY_IV
+    for chunk_mac in chunk_macs:
+        if chunk_mac:
+            mac_bytes = mac_encryptor.encrypt(chunk_mac)
+    file_mac = unpack_sequence(mac_bytes)
+    return pack_sequence((file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3]))
+
+
+def check_file_mac(k_decrypted: bytes, chunk_macs: Sequence[bytes], meta_mac: bytes) -> bool:
+    computed_mac = condense_chunk_macs(k_decrypted, chunk_macs)
+    if computed_mac != meta_mac:
+        Log.fatal(f'Mismatched mac (res {computed_mac.hex()} != meta {meta_mac.hex()})')
+        return False
+    return True
+
 #
 #
 #########################################
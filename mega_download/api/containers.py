@@ -81,6 +81,7 @@ class Folder(Node):
     f: list[File | Folder]  # User folder children (files or folders)
     ok: list[File | Folder]  # Shared folder children (files or folders)
     s: list[File | Folder]  # List of sub nodes
+    sn: str  # Listing sequence number, changes whenever folder contents change
 
     #  Non standard properties
     iv: IntVector
@@ -88,7 +89,7 @@ class Folder(Node):
     sk_decrypted: IntVector
 
 
-SharedKey: TypeAlias = dict[str, IntVector]
+SharedKey: TypeAlias = dict[str, bytes]
 '''Mapping: (recipient) User Id ('u') -> decrypted value of shared key ('sk')'''
 SharedkeysDict: TypeAlias = dict[str, SharedKey]
 '''Mapping: (owner) Shared User Id ('su') -> SharedKey'''
@@ -98,6 +99,8 @@ FileSystemMapping: TypeAlias = dict[pathlib.PurePosixPath, File | Folder]
 '''Mapping: path -> File | Folder'''
 FilePathMapping: TypeAlias = dict[pathlib.PurePosixPath, File]
 '''Mapping: path -> File'''
+NodeRowMapping: TypeAlias = dict[str, int]
+'''Mapping: path (normalized, posix) -> NodeTable row'''
 
 
 class ParsedUrl(NamedTuple):
@@ -116,9 +119,12 @@ class DownloadParams(NamedTuple):
     direct_file_url: str
     output_path: pathlib.Path
     file_size: int
-    iv: IntVector
-    meta_mac: IntVector
-    k_decrypted: IntVector
+    iv: bytes
+    '''8 bytes, CTR nonce (also MAC iv, repeated twice)'''
+    meta_mac: bytes
+    '''8 bytes'''
+    k_decrypted: bytes
+    '''16 bytes, AES key'''
 
 
 DownloadParamsDump: TypeAlias = dict[str, list[DownloadParams] | str]
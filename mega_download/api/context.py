@@ -0,0 +1,39 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+from mega_download.util import compose_link_v2
+
+from .containers import ParsedUrl
+
+__all__ = ('LinkContext',)
+
+
+class LinkContext:
+    """
+    Per-link download state, allows processing multiple links concurrently with a single `Mega` instance
+    """
+    __slots__ = ('parsed', 'queue_size', 'queue_size_orig')
+
+    def __init__(self, parsed: ParsedUrl, queue_size: int = 0) -> None:
+        self.parsed = parsed
+        self.queue_size = queue_size
+        self.queue_size_orig = queue_size
+
+    @property
+    def link_id(self) -> str:
+        return self.parsed.folder_id or self.parsed.file_id
+
+    @property
+    def original_url(self) -> str:
+        return compose_link_v2(self.parsed.folder_id, self.parsed.file_id, self.parsed.key_b64)
+
+#
+#
+#########################################
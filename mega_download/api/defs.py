@@ -9,14 +9,53 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 from enum import Enum, IntEnum
 from typing import NamedTuple
 
-CONNECT_REQUEST_DELAY = 0.3
+API_REQUEST_RATE = 1.5  # requests per second
+API_REQUEST_BURST = 1
+STORAGE_REQUEST_RATE = 4.0
+STORAGE_REQUEST_BURST = 4
 CONNECT_RETRY_DELAY = (4.0, 8.0)
 
+API_BATCH_SIZE_MAX = 50
+API_BATCH_RETRY_CODES = (-1, -3, -4)  # EINTERNAL, EAGAIN, ERATELIMIT
+DOWNLOAD_URL_LOOKAHEAD = API_BATCH_SIZE_MAX
+DOWNLOAD_URL_MAX_AGE = 1800.0  # seconds
+SESSION_CACHE_VERSION = 1
+SESSION_CACHE_MAX_AGE = 86400.0  # seconds
+LISTING_CACHE_VERSION = 2
+MANIFEST_VERSION = 1
+
 CHUNK_BLOCK_LEN = 16
 EMPTY_IV = b'\0' * CHUNK_BLOCK_LEN
 UINT32_MAX = 0xFFFFFFFF
 DOWNLOAD_CHUNK_SIZE_INIT = 0x20000
 DOWNLOAD_CHUNK_SIZE_MAX = 0x100000
+DOWNLOAD_SEGMENT_SIZE_MIN = 0x1000000
+PIPELINE_QUEUE_DEPTH = 4
+PIPELINE_BUFFERS_PER_TRANSFER = PIPELINE_QUEUE_DEPTH * 3 + 3  # read, decrypt, write queues and MAC, plus one per stage
+
+PROCESS_POOL_STOP_SLOTS = 16  # work groups stoppable at once (e.g. concurrent hashcash solves)
+
+HASHCASH_BATCH_SIZE = 16
+
+NODE_DECRYPT_BATCH_SIZE = 0x1000
+NODE_DECRYPT_SHARD_SIZE = 0x10000
+
+FILTER_BATCH_SIZE = 0x400
+
+METRICS_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+'''histogram bucket upper bounds, seconds'''
+METRICS_PROMETHEUS_PREFIX = 'mega_download'
+
+PROGRESS_INTERVAL = 2.0  # seconds between progress updates
+PROGRESS_SPEED_SMOOTHING = 0.3  # weight of the latest interval in throughput
+
+OUTPUT_COALESCE_SIZE = 0x400000
+OUTPUT_FSYNC_INTERVAL = 0x4000000
+
+MANIFEST_FILE_NAME = '.mega_download.manifest'
+
+PART_FILE_EXT = '.part'
+JOURNAL_FILE_EXT = '.journal'
 
 UTF8 = 'utf-8'
 LATIN1 = 'latin-1'
@@ -39,6 +78,41 @@ DOWNLOAD_MODE_DEFAULT = DownloadMode.FULL.value
 """'full'"""
 
 
+class FsyncMode(str, Enum):
+    NEVER = 'never'
+    CLOSE = 'close'
+    PERIODIC = 'periodic'
+
+
+FSYNC_MODES: tuple[str, ...] = tuple(_.value for _ in FsyncMode.__members__.values())
+'''('never','close','periodic')'''
+FSYNC_MODE_DEFAULT = FsyncMode.NEVER.value
+"""'never'"""
+
+
+class OverwritePolicy(str, Enum):
+    ASK = 'ask'
+    ALL = 'all'
+    NONE = 'none'
+    MISMATCH = 'mismatch'
+
+
+OVERWRITE_POLICIES: tuple[str, ...] = tuple(_.value for _ in OverwritePolicy.__members__.values())
+'''('ask','all','none','mismatch')'''
+
+
+class OutputPolicy(NamedTuple):
+    preallocate: bool = True
+    '''reserve full file size on disk before writing'''
+    coalesce_size: int = OUTPUT_COALESCE_SIZE
+    '''combine contiguous chunks into aligned writes of this size, 0 to write chunks as is'''
+    fsync_mode: FsyncMode = FsyncMode.NEVER
+    fsync_interval: int = OUTPUT_FSYNC_INTERVAL
+    '''bytes written between syncs, for periodic fsync mode'''
+    drop_cache: bool = False
+    '''evict written file data from page cache (posix_fadvise), after each sync and on close'''
+
+
 class DownloadResult(IntEnum):
     SUCCESS = 0
     FAIL_NOT_FOUND = 1
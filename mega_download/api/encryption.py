@@ -6,12 +6,14 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
-import base64
+import binascii
+import functools
 import hashlib
 import json
 import random
 import struct
 from collections.abc import Sequence
+from typing import NamedTuple
 
 from Crypto.Cipher import AES
 
@@ -19,20 +21,34 @@ from .containers import Attributes, IntVector
 from .defs import EMPTY_IV, LATIN1, UINT32_MAX, UTF8
 
 __all__ = (
+    'HashcashChallenge',
     'base64_to_ints',
     'base64_url_decode',
     'base64_url_encode',
     'decrypt_attr',
     'decrypt_key',
+    'decrypt_key_bytes',
+    'decrypt_keys_bulk',
     'encrypt_key',
+    'encrypt_key_bytes',
+    'hashcash_nonce_matches',
     'ints_to_base64',
+    'key_to_bytes',
+    'make_hashcash_buffer',
     'make_hashcash_token',
+    'make_hashcash_token_str',
     'pack_sequence',
     'pad_bytes_end',
+    'parse_hashcash_challenge',
+    'session_id_matches',
     'unpack_sequence',
     'urand',
+    'xor_key_halves',
 )
 
+_B64_FROM_URLSAFE = bytes.maketrans(b'-_', b'+/')
+_B64_TO_URLSAFE = bytes.maketrans(b'+/', b'-_')
+
 
 def urand() -> int:
     return random.randint(0, UINT32_MAX)
@@ -46,42 +62,67 @@ def pad_bytes_end(data: bytes | memoryview, *, amount: int) -> bytes:
     return data_bytes
 
 
+@functools.cache
+def _uint32_struct(count: int) -> struct.Struct:
+    return struct.Struct(f'>{count:d}I')
+
+
 def pack_sequence(array: Sequence[int]) -> bytes:
-    return struct.pack(f'>{len(array):d}I', *array)
+    return _uint32_struct(len(array)).pack(*array)
 
 
 def unpack_sequence(data: bytes) -> IntVector:
     assert isinstance(data, bytes)  # required
     data_padded = pad_bytes_end(data, amount=4)  # sizeof(uint32)
-    return struct.unpack(f'>{(len(data_padded) >> 2):d}I', data_padded)
+    return _uint32_struct(len(data_padded) >> 2).unpack(data_padded)
 
 
-def _encrypt_eas_cbc(data: bytes, key: bytes) -> bytes:
-    return AES.new(key, AES.MODE_CBC, EMPTY_IV).encrypt(data)
+def key_to_bytes(key: bytes | Sequence[int]) -> bytes:
+    return key if isinstance(key, bytes) else pack_sequence(key)
 
 
-def _decrypt_aes_cbc(data: bytes, key: bytes) -> bytes:
-    return AES.new(key, AES.MODE_CBC, EMPTY_IV).decrypt(data)
+def xor_key_halves(key: bytes) -> bytes:
+    """File key (32 bytes) -> file AES key (16 bytes)"""
+    return (int.from_bytes(key[:16], 'big') ^ int.from_bytes(key[16:32], 'big')).to_bytes(16, 'big')
 
 
-def _encrypt_aes_cbc_arr(ints: Sequence[int], key: Sequence[int]) -> IntVector:
-    return unpack_sequence(_encrypt_eas_cbc(pack_sequence(ints), pack_sequence(key)))
+def encrypt_key_bytes(data: bytes, key: bytes | Sequence[int]) -> bytes:
+    # every 16-byte block is encrypted independently: CBC with empty IV per block, that is exactly ECB
+    return AES.new(key_to_bytes(key), AES.MODE_ECB).encrypt(data)
 
 
-def _decrypt_aes_cbc_ints(ints: Sequence[int], key: Sequence[int]) -> IntVector:
-    return unpack_sequence(_decrypt_aes_cbc(pack_sequence(ints), pack_sequence(key)))
+def decrypt_key_bytes(data: bytes, key: bytes | Sequence[int]) -> bytes:
+    return AES.new(key_to_bytes(key), AES.MODE_ECB).decrypt(data)
 
 
 def encrypt_key(ints: Sequence[int], key: Sequence[int]) -> IntVector:
-    return sum((_encrypt_aes_cbc_arr(ints[index:index + 4], key) for index in range(0, len(ints), 4)), ())
+    """Int tuples counterpart of `encrypt_key_bytes()`"""
+    return unpack_sequence(encrypt_key_bytes(pack_sequence(ints), key))
 
 
 def decrypt_key(ints: Sequence[int], key: Sequence[int]) -> IntVector:
-    return sum((_decrypt_aes_cbc_ints(ints[index:index + 4], key) for index in range(0, len(ints), 4)), ())
-
-
-def decrypt_attr(attr: bytes, key: Sequence[int]) -> Attributes:
-    attr_bytes = _decrypt_aes_cbc(attr, pack_sequence(key))
+    """Int tuples counterpart of `decrypt_key_bytes()`"""
+    return unpack_sequence(decrypt_key_bytes(pack_sequence(ints), key))
+
+
+def decrypt_keys_bulk(encrypted_keys: Sequence[bytes], key: bytes | Sequence[int]) -> list[bytes]:
+    """
+    Decrypts many keys wrapped with the same key using a single cipher call
+    :param encrypted_keys: wrapped keys, each a multiple of 16 bytes long
+    :param key: wrapping key
+    :returns unwrapped keys in the same order
+    """
+    decrypted = decrypt_key_bytes(b''.join(encrypted_keys), key)
+    keys: list[bytes] = []
+    offset = 0
+    for encrypted_key in encrypted_keys:
+        keys.append(decrypted[offset:offset + len(encrypted_key)])
+        offset += len(encrypted_key)
+    return keys
+
+
+def decrypt_attr(attr: bytes, key: bytes | Sequence[int]) -> Attributes:
+    attr_bytes = AES.new(key_to_bytes(key), AES.MODE_CBC, EMPTY_IV).decrypt(attr)
     try:
         attr_str = attr_bytes.decode(UTF8).rstrip('\0')
     except UnicodeDecodeError:
@@ -107,33 +148,46 @@ def base64_to_ints(string: str) -> IntVector:
 
 
 def base64_url_decode(data: str) -> bytes:
-    data += '=='[(2 - len(data) * 3) % 4:]
-    for search, replace in (('-', '+'), ('_', '/'), (',', '')):
-        data = data.replace(search, replace)
-    return base64.b64decode(data)
+    if ',' in data:
+        data = data.replace(',', '')
+    return _b64decode_urlsafe(data)
 
 
 def base64_url_encode(data: bytes) -> str:
-    data_bytes = base64.b64encode(data)
-    data_str = data_bytes.decode()
-    for search, replace in (('+', '-'), ('/', '_'), ('=', '')):
-        data_str = data_str.replace(search, replace)
-    return data_str
+    return _b64encode_urlsafe(data)
 
 
 def ints_to_base64(array: Sequence[int]) -> str:
     return base64_url_encode(pack_sequence(array))
 
 
+def session_id_matches(b64_tsid: str, master_key: bytes | Sequence[int]) -> bool:
+    """Temporary session id is valid if its first 16 bytes encrypted with master key are equal to its last 16 bytes"""
+    tsid = base64_url_decode(b64_tsid)
+    return len(tsid) >= 32 and encrypt_key_bytes(tsid[:16], master_key) == tsid[-16:]
+
+
 def _b64decode_urlsafe(data_str: str) -> bytes:
-    return base64.urlsafe_b64decode(data_str + '=' * (-len(data_str) % 4))
+    return binascii.a2b_base64((data_str + '=' * (-len(data_str) % 4)).encode().translate(_B64_FROM_URLSAFE))
 
 
 def _b64encode_urlsafe(data_bytes: bytes) -> str:
-    return base64.urlsafe_b64encode(data_bytes).decode(UTF8).rstrip('=')
+    return binascii.b2a_base64(data_bytes, newline=False).translate(_B64_TO_URLSAFE).rstrip(b'=').decode()
 
 
-def make_hashcash_token(challenge: str) -> str:
+class HashcashChallenge(NamedTuple):
+    token_str: str
+    token: bytes
+    easiness: int
+
+    @property
+    def threshold(self) -> int:
+        base = ((self.easiness & ((1 << 6) - 1)) << 1) + 1  # base = ((easiness & 63) << 1) + 1
+        shifts = (self.easiness >> 6) * 7 + 3
+        return base << shifts
+
+
+def parse_hashcash_challenge(challenge: str) -> HashcashChallenge:
     # https://github.com/gpailler/MegaApiClient/issues/248#issuecomment-2692361193
     parts = challenge.split(':', 3)
     version_str, easiness_str, _, token_str = tuple(parts)
@@ -141,27 +195,35 @@ def make_hashcash_token(challenge: str) -> str:
         raise ValueError(f'Hashcash challenge version is {version_str} != 1')
 
     assert easiness_str.isnumeric(), f'Hashcash easiness is not numeric (\'{easiness_str}\')!'
-    easiness = int(easiness_str)
-    base = ((easiness & ((1 << 6) - 1)) << 1) + 1  # base = ((easiness & 63) << 1) + 1
-    shifts = (easiness >> 6) * 7 + 3
-    threshold = base << shifts
-    token = _b64decode_urlsafe(token_str)
-    buffer = bytearray(0x40000 * 0x30 + 0x4)  # 0xC00004
-    for i in range(0x40000):
-        idx = 0x4 + i * 0x30
-        buffer[idx:idx + 0x30] = token
-
-    while True:
-        digest = hashlib.sha256(buffer).digest()
-        view = struct.unpack('>I', digest[:4])[0]  # Big endian
-        if view <= threshold:
-            return f'1:{token_str}:{_b64encode_urlsafe(buffer[:4])}'
-
-        # Increment the first 4 bytes as a little-endian integer
-        for j in range(4):
-            buffer[j] = (buffer[j] + 1) & 0xFF
-            if buffer[j]:
-                break
+    return HashcashChallenge(token_str, _b64decode_urlsafe(token_str), int(easiness_str))
+
+
+def make_hashcash_buffer(token: bytes) -> bytearray:
+    """Nonce (4 bytes) followed by token repeated 0x40000 times, 12 MB total"""
+    buffer = bytearray(0x4)
+    buffer += token * 0x40000  # 0xC00004
+    return buffer
+
+
+def hashcash_nonce_matches(buffer: bytearray, nonce: int, threshold: int) -> bool:
+    # Nonce is stored as a little-endian integer, digest is checked as big endian
+    struct.pack_into('<I', buffer, 0, nonce)
+    return int.from_bytes(hashlib.sha256(buffer).digest()[:4], 'big') <= threshold
+
+
+def make_hashcash_token_str(token_str: str, nonce: int) -> str:
+    return f'1:{token_str}:{_b64encode_urlsafe(struct.pack("<I", nonce))}'
+
+
+def make_hashcash_token(challenge: str) -> str:
+    """Solves hashcash challenge in current thread, blocking. See `HashcashSolver` for parallel solving"""
+    hashcash = parse_hashcash_challenge(challenge)
+    buffer = make_hashcash_buffer(hashcash.token)
+    threshold = hashcash.threshold
+    for nonce in range(UINT32_MAX + 1):
+        if hashcash_nonce_matches(buffer, nonce, threshold):
+            return make_hashcash_token_str(hashcash.token_str, nonce)
+    raise ValueError(f'Hashcash challenge has no solution: {challenge}')
 
 #
 #
@@ -6,12 +6,21 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
-from collections.abc import Iterable
-from typing import Protocol
+from __future__ import annotations
+
+import itertools
+import time
+from collections.abc import Callable, Iterable, Sequence
+from typing import NamedTuple, Protocol, TypeAlias, runtime_checkable
 
 from .containers import File
+from .defs import FILTER_BATCH_SIZE
+from .node_table import NodeTable
+
+__all__ = ('CompilableFilter', 'Filter', 'FilterPipeline', 'FilterStats', 'NodeCheck', 'any_filter_matching')
 
-__all__ = ('Filter', 'any_filter_matching')
+NodeCheck: TypeAlias = Callable[[str, int, int], bool]
+'''Compiled filter: (file name, file size, file number in queue) -> file is filtered out'''
 
 
 class Filter(Protocol):
@@ -19,12 +28,117 @@ class Filter(Protocol):
     def __str__(self) -> str: ...
 
 
+@runtime_checkable
+class CompilableFilter(Protocol):
+    def filters_out(self, file: File) -> bool: ...
+    def compile(self) -> NodeCheck: ...
+    def __str__(self) -> str: ...
+
+
 def any_filter_matching(file: File, filters: Iterable[Filter]) -> Filter | None:
     for ffilter in filters:
         if ffilter.filters_out(file):
             return ffilter
     return None
 
+
+class FilterStats(NamedTuple):
+    ffilter: Filter
+    checked: int  # files checked, only files passing filters applied before are checked
+    hits: int  # files filtered out
+    elapsed: float  # seconds
+
+    def __str__(self) -> str:
+        return f'{self.ffilter!s}: {self.hits:d} / {self.checked:d} filtered out in {self.elapsed * 1000:.1f} ms'
+
+
+class _Stage:
+    __slots__ = ('checked', 'elapsed_ns', 'ffilter', 'hits', 'index', 'node_check')
+
+    def __init__(self, index: int, ffilter: Filter) -> None:
+        self.index = index
+        self.ffilter = ffilter
+        self.node_check: NodeCheck | None = ffilter.compile() if isinstance(ffilter, CompilableFilter) else None
+        self.checked = 0
+        self.hits = 0
+        self.elapsed_ns = 0
+
+    def cost(self) -> tuple[float, int]:
+        # expected time spent per file filtered out, filters which never filtered anything out go last in original order
+        return (self.elapsed_ns / self.hits if self.hits else float('inf')), self.index
+
+    def filters_out(self, file: File) -> bool:
+        if self.node_check is None:
+            return self.ffilter.filters_out(file)
+        return self.node_check(file['attributes']['n'], file['s'], file.get('num_in_queue', 0))
+
+    def split(self, table: NodeTable, rows: list[int]) -> tuple[list[int], list[int]]:
+        """:returns rows passing the filter, rows filtered out"""
+        time_start = time.perf_counter_ns()
+        if self.node_check is None:
+            filtered_out = [self.ffilter.filters_out(table.node(row)) for row in rows]
+        else:
+            node_check, names, sizes, nums_in_queue = self.node_check, table.names, table.sizes, table.nums_in_queue
+            filtered_out = [node_check(names[row], sizes[row], nums_in_queue[row]) for row in rows]
+        self.elapsed_ns += time.perf_counter_ns() - time_start
+        filtered = list(itertools.compress(rows, filtered_out))
+        passed = [row for row, row_filtered_out in zip(rows, filtered_out, strict=True) if not row_filtered_out] if filtered else rows
+        self.checked += len(rows)
+        self.hits += len(filtered)
+        return passed, filtered
+
+
+class FilterPipeline:
+    """
+    Filters combined into a single predicate. Filters providing `compile()` are checked on node table columns directly,
+    others get a file dict. Since any filter excludes a file, the filters are reordered by runtime statistics,
+    so that cheap filters excluding the most files are applied first
+    """
+    def __init__(self, filters: Iterable[Filter], batch_size: int = FILTER_BATCH_SIZE) -> None:
+        self._stages = [_Stage(index, ffilter) for index, ffilter in enumerate(filters)]
+        self._batch_size = batch_size
+
+    def __bool__(self) -> bool:
+        return bool(self._stages)
+
+    def __str__(self) -> str:
+        return ', '.join(str(stats) for stats in self.stats())
+
+    def _reorder(self) -> None:
+        self._stages.sort(key=_Stage.cost)
+
+    def first_matching(self, file: File) -> Filter | None:
+        """:returns filter excluding the file, if any"""
+        for stage in self._stages:
+            time_start = time.perf_counter_ns()
+            filtered_out = stage.filters_out(file)
+            stage.elapsed_ns += time.perf_counter_ns() - time_start
+            stage.checked += 1
+            if filtered_out:
+                stage.hits += 1
+                return stage.ffilter
+        return None
+
+    def evaluate(self, table: NodeTable, rows: Sequence[int]) -> list[Filter | None]:
+        """
+        Applies filters to table rows in batches, each filter to the whole batch at once
+        :returns filter excluding the file, if any, for each row
+        """
+        filtered_by: dict[int, Filter] = {}
+        for offset in range(0, len(rows), self._batch_size):
+            passed = list(rows[offset:offset + self._batch_size])
+            for stage in self._stages:
+                if not passed:
+                    break
+                passed, filtered = stage.split(table, passed)
+                filtered_by.update(dict.fromkeys(filtered, stage.ffilter))
+            self._reorder()
+        return [filtered_by.get(row) for row in rows]
+
+    def stats(self) -> list[FilterStats]:
+        """:returns statistics of each filter, in current order"""
+        return [FilterStats(stage.ffilter, stage.checked, stage.hits, stage.elapsed_ns / 1E9) for stage in self._stages]
+
 #
 #
 #########################################
@@ -0,0 +1,106 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import time
+from asyncio import FIRST_COMPLETED, Future, wait
+from typing import NamedTuple
+
+from .defs import HASHCASH_BATCH_SIZE, UINT32_MAX
+from .encryption import hashcash_nonce_matches, make_hashcash_buffer, make_hashcash_token_str, parse_hashcash_challenge
+from .logging import Log
+from .process_pool import ProcessPool, stop_requested
+
+__all__ = ('HashcashSolveStats', 'HashcashSolver')
+
+# worker process state: buffer of the last token solved, reused by its next batches
+_worker_token = b''
+_worker_buffer: bytearray | None = None
+
+
+def _solve_batch(token: bytes, stop_slot: int, first_nonce: int, count: int, threshold: int) -> tuple[int, int]:
+    """
+    Checks `count` nonces starting with `first_nonce`, in worker process
+    :returns (matching nonce or -1, number of nonces checked)
+    """
+    global _worker_token, _worker_buffer
+    if token != _worker_token:
+        _worker_token, _worker_buffer = token, make_hashcash_buffer(token)
+    for i in range(count):
+        if stop_requested(stop_slot):
+            return -1, i
+        if hashcash_nonce_matches(_worker_buffer, first_nonce + i, threshold):
+            return first_nonce + i, i + 1
+    return -1, count
+
+
+class HashcashSolveStats(NamedTuple):
+    easiness: int
+    nonces: int
+    workers: int
+    elapsed: float  # seconds
+
+    def __str__(self) -> str:
+        return (f'easiness {self.easiness:d}: {self.nonces:d} nonces in {self.elapsed:.2f}s'
+                f' ({self.nonces / max(self.elapsed, 1e-6):.1f}/s, {self.workers:d} workers)')
+
+
+class HashcashSolver:
+    """
+    Solves hashcash challenges in worker processes of a shared pool without blocking the event loop.
+    Nonce space is split into batches handed to workers in order, once a solution is found
+    no more batches are submitted and busy workers stop at their next nonce
+    """
+    def __init__(self, pool: ProcessPool, batch_size: int = HASHCASH_BATCH_SIZE) -> None:
+        self._pool = pool
+        self._workers = pool.workers
+        self._batch_size = batch_size
+        self.history: list[HashcashSolveStats] = []
+
+    async def solve(self, challenge: str) -> str:
+        """
+        :param challenge: X-Hashcash header value sent by MEGA
+        :returns X-Hashcash header value to send back
+        """
+        hashcash = parse_hashcash_challenge(challenge)
+        threshold = hashcash.threshold
+        time_start = time.perf_counter()
+        pending = set[Future[tuple[int, int]]]()
+        next_nonce = 0
+        nonces = 0
+        nonce = -1
+        async with self._pool.stop_slot() as stop_slot:
+            try:
+                while nonce < 0:
+                    # keep every worker busy with one extra batch queued
+                    while len(pending) < self._workers * 2 and next_nonce <= UINT32_MAX:
+                        count = min(self._batch_size, UINT32_MAX + 1 - next_nonce)
+                        pending.add(self._pool.run(_solve_batch, hashcash.token, stop_slot, next_nonce, count, threshold))
+                        next_nonce += count
+                    if not pending:
+                        raise ValueError(f'Hashcash challenge has no solution: {challenge}')
+                    done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch_nonce, batch_nonces = future.result()
+                        nonces += batch_nonces
+                        if batch_nonce >= 0 and (nonce < 0 or batch_nonce < nonce):
+                            nonce = batch_nonce
+            finally:
+                # queued batches are dropped, running ones stop at their next nonce (stop slot is released on exit)
+                for future in pending:
+                    future.cancel()
+
+        stats = HashcashSolveStats(hashcash.easiness, nonces, self._workers, time.perf_counter() - time_start)
+        self.history.append(stats)
+        Log.debug(f'Hashcash solved, {stats!s}')
+        return make_hashcash_token_str(hashcash.token_str, nonce)
+
+#
+#
+#########################################
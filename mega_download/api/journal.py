@@ -0,0 +1,92 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import pathlib
+from collections.abc import Sequence
+from io import TextIOWrapper
+
+from .chunkgen import Chunk
+from .containers import DownloadParams
+from .defs import UTF8
+from .logging import Log
+
+__all__ = ('ChunkJournal',)
+
+JOURNAL_VERSION = 1
+
+
+class ChunkJournal:
+    """
+    Sidecar journal of completed file chunks, allows to resume interrupted downloads.\n
+    Header line identifies the file (size and meta mac), then one line per completed chunk follows:
+    '<chunk index> <chunk offset> <chunk size> <chunk mac hex>'
+    """
+    __slots__ = ('_file', '_path')
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self._path = path
+        self._file: TextIOWrapper | None = None
+
+    @staticmethod
+    def _make_header(params: DownloadParams) -> str:
+        return f'{JOURNAL_VERSION:d} {params.file_size:d} {params.meta_mac.hex().upper()}'
+
+    def load(self, params: DownloadParams, chunks: Sequence[Chunk], data_size: int) -> dict[int, bytes]:
+        """
+        Reads journal entries matching given file
+        :param params: download params of the file
+        :param chunks: all file chunks
+        :param data_size: current size of partially downloaded file, chunks beyond it are discarded.
+                          Preallocated file is never short, chunks within it still have to be verified (see `TransferState.resume`)
+        :returns mapping: chunk index -> chunk mac
+        """
+        chunk_macs: dict[int, bytes] = {}
+        if not self._path.is_file():
+            return chunk_macs
+        with open(self._path, 'rt', encoding=UTF8) as infile:
+            lines = infile.read().splitlines()
+        if not lines or lines[0] != self._make_header(params):
+            Log.warn(f'{self._path.name}: journal does not match the file, discarded')
+            return chunk_macs
+        for line in lines[1:]:
+            try:
+                idx_str, offset_str, size_str, mac_hex = tuple(line.split(' '))
+                chunk_idx, chunk = int(idx_str), Chunk(int(offset_str), int(size_str))
+                chunk_mac = bytes.fromhex(mac_hex)
+            except ValueError:
+                # last line may be incomplete if process was killed
+                continue
+            if chunk_idx < len(chunks) and chunks[chunk_idx] == chunk and chunk.offset + chunk.size <= data_size:
+                chunk_macs[chunk_idx] = chunk_mac
+        return chunk_macs
+
+    def open(self, params: DownloadParams, chunks: Sequence[Chunk], chunk_macs: dict[int, bytes]) -> None:
+        """Rewrites journal leaving only given entries and keeps it open for appending"""
+        assert self._file is None
+        self._file = open(self._path, 'wt', encoding=UTF8, buffering=1)
+        self._file.write(f'{self._make_header(params)}\n')
+        for chunk_idx in sorted(chunk_macs):
+            self.record(chunk_idx, chunks[chunk_idx], chunk_macs[chunk_idx])
+
+    def record(self, chunk_idx: int, chunk: Chunk, chunk_mac: bytes) -> None:
+        self._file.write(f'{chunk_idx:d} {chunk.offset:d} {chunk.size:d} {chunk_mac.hex()}\n')
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        self.close()
+        self._path.unlink(missing_ok=True)
+
+#
+#
+#########################################
@@ -0,0 +1,94 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from .defs import LISTING_CACHE_VERSION, UTF8
+from .encryption import key_to_bytes
+from .logging import Log
+from .node_table import KEY_DATA_SIZE, NodeTable
+
+__all__ = ('CachedListing', 'CachedNode', 'FolderListingCache')
+
+
+class CachedNode(NamedTuple):
+    k: str  # Node key (encrypted), node is reused only if it and encrypted attributes did not change
+    a: str  # Encrypted attributes
+    name: str
+    key_data: bytes  # See `NodeTable.key_data`
+
+    def matches(self, k: str, a: str) -> bool:
+        return self.k == k and self.a == a
+
+
+class CachedListing(NamedTuple):
+    sn: str  # Listing sequence number
+    nodes: dict[str, CachedNode]  # handle -> node
+
+
+class FolderListingCache:
+    """
+    On-disk cache of decrypted folder listings, one file per folder id and folder key.
+    Cached nodes are reused while their encrypted key and attributes stay unchanged, so only new or changed nodes need decrypting
+    """
+    def __init__(self, cache_dir: pathlib.Path) -> None:
+        self._cache_dir = cache_dir
+
+    def _path(self, folder_id: str, shared_key: bytes | Sequence[int]) -> pathlib.Path:
+        # file name must not reveal folder key
+        key_hash = hashlib.sha256(key_to_bytes(shared_key)).hexdigest()[:16]
+        return self._cache_dir / f'{folder_id}_{key_hash}.json'
+
+    def load(self, folder_id: str, shared_key: bytes | Sequence[int]) -> CachedListing | None:
+        path = self._path(folder_id, shared_key)
+        try:
+            with open(path, 'rt', encoding=UTF8) as infile:
+                data = json.load(infile)
+            assert data['version'] == LISTING_CACHE_VERSION
+            nodes = {h: CachedNode(k, a, name, bytes.fromhex(key_data)) for h, (k, a, name, key_data) in data['nodes'].items()}
+            assert all(len(node.key_data) == KEY_DATA_SIZE for node in nodes.values())
+            return CachedListing(str(data['sn']), nodes)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            Log.warn(f'Listing cache {path.name} is invalid ({e.__class__.__name__}), discarding...')
+            path.unlink(missing_ok=True)
+            return None
+
+    def save(self, folder_id: str, shared_key: bytes | Sequence[int], sn: str, table: NodeTable) -> None:
+        """
+        :param table: listing nodes, must keep encrypted keys and attributes
+        """
+        path = self._path(folder_id, shared_key)
+        key_data = table.key_data.hex()
+        data = {
+            'version': LISTING_CACHE_VERSION,
+            'sn': sn,
+            'nodes': {h: (k, a, name, key_data[row * KEY_DATA_SIZE * 2:(row + 1) * KEY_DATA_SIZE * 2])
+                      for row, (h, (k, a), name) in enumerate(zip(table.handles, table.encrypted, table.names, strict=True))},
+        }
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        try:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            # decrypted names and keys, keep them private
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wt', encoding=UTF8) as outfile:
+                json.dump(data, outfile, ensure_ascii=False, separators=(',', ':'))
+            tmp_path.replace(path)
+        except OSError as e:
+            Log.warn(f'Unable to save listing cache {path.name}: {e!s}')
+
+#
+#
+#########################################
@@ -0,0 +1,165 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import codecs
+import json
+from enum import IntEnum
+
+from .defs import UTF8
+
+__all__ = ('ListingStreamParser',)
+
+
+class _State(IntEnum):
+    START = 0  # expecting '['
+    RESULT = 1  # expecting '{'
+    KEY = 2  # expecting object key or '}'
+    COLON = 3
+    VALUE = 4
+    ITEM = 5  # expecting array item or ']'
+    ITEM_SEP = 6  # expecting ',' or ']'
+    FIELD_SEP = 7  # expecting ',' or '}'
+    END = 8  # expecting ']'
+    DONE = 9
+    RAW = 10  # not a listing, parsed as a whole in the end
+
+
+class ListingStreamParser:
+    """
+    Incremental parser of listing command ('f') response: '[{"f":[{node},{node},...],"sn":"...",...}]'.
+    Nodes of the `array_key` array are returned as soon as they are received, so raw response is never kept in memory as a whole.
+    Responses of other form (error codes) are parsed in the end
+    """
+    def __init__(self, array_key: str = 'f') -> None:
+        self._array_key = array_key
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder(UTF8)()
+        self._buffer = ''
+        self._pos = 0
+        self._final = False
+        self._state = _State.START
+        self._key = ''
+        self._fields: dict = {}
+        self.nodes_parsed = 0
+
+    def feed(self, data: bytes) -> list[dict]:
+        """
+        :param data: next part of response body
+        :returns nodes completed by this part
+        """
+        self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(data, final=self._final)
+        self._pos = 0
+        nodes: list[dict] = []
+        self._parse(nodes)
+        self.nodes_parsed += len(nodes)
+        return nodes
+
+    def finish(self) -> dict | list | int:
+        """
+        Must be called once the whole response is received
+        :returns listing object with `array_key` array left empty, or response as is if it isn't a listing
+        """
+        self._final = True
+        self.feed(b'')
+        if self._state == _State.RAW:
+            return json.loads(self._buffer)
+        if self._state != _State.DONE or self._buffer[self._pos:].strip():
+            raise ValueError(f'Listing response is malformed or truncated after {self.nodes_parsed:d} nodes')
+        return self._fields
+
+    def _next_char(self) -> str:
+        """Skips whitespace, returns next char without consuming it or empty string if more data is needed"""
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        self._pos = pos
+        return buffer[pos] if pos < len(buffer) else ''
+
+    def _decode_value(self) -> tuple[bool, object]:
+        """Decodes complete value at current position, returns (False, None) if more data is needed"""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if self._final:
+                raise
+            return False, None
+        if end == len(self._buffer) and not self._final and not isinstance(value, (str, list, dict)):
+            # number or literal may continue in the next part
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _parse(self, nodes: list[dict]) -> None:
+        while self._state not in (_State.DONE, _State.RAW):
+            char = self._next_char()
+            if not char:
+                return
+            state = self._state
+            if state == _State.START or state == _State.RESULT:
+                if char != '[{'[state - _State.START]:
+                    # error code ('-9' or '[-9]'), consumed '[' is restored
+                    self._buffer = '[' * (state - _State.START) + self._buffer[self._pos:]
+                    self._pos = 0
+                    self._state = _State.RAW
+                    return
+                self._pos += 1
+                self._state = _State(state + 1)
+            elif state == _State.KEY:
+                if char == '}':
+                    self._pos += 1
+                    self._state = _State.END
+                    continue
+                complete, key = self._decode_value()
+                if not complete:
+                    return
+                self._key = key
+                self._state = _State.COLON
+            elif state == _State.COLON:
+                self._expect(char, ':')
+                self._state = _State.VALUE
+            elif state == _State.VALUE:
+                if self._key == self._array_key and char == '[':
+                    self._pos += 1
+                    self._fields[self._key] = []
+                    self._state = _State.ITEM
+                    continue
+                complete, value = self._decode_value()
+                if not complete:
+                    return
+                self._fields[self._key] = value
+                self._state = _State.FIELD_SEP
+            elif state == _State.ITEM:
+                if char == ']':
+                    self._pos += 1
+                    self._state = _State.FIELD_SEP
+                    continue
+                complete, node = self._decode_value()
+                if not complete:
+                    return
+                nodes.append(node)
+                self._state = _State.ITEM_SEP
+            elif state == _State.ITEM_SEP:
+                self._expect(char, ',]')
+                self._state = _State.ITEM if char == ',' else _State.FIELD_SEP
+            elif state == _State.FIELD_SEP:
+                self._expect(char, ',}')
+                self._state = _State.KEY if char == ',' else _State.END
+            elif state == _State.END:
+                self._expect(char, ']')
+                self._state = _State.DONE
+
+    def _expect(self, char: str, expected: str) -> None:
+        if char not in expected:
+            raise ValueError(f'Listing response is malformed: expected \'{expected}\', got \'{char}\' after {self.nodes_parsed:d} nodes')
+        self._pos += 1
+
+#
+#
+#########################################
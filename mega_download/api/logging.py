@@ -6,12 +6,30 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
-from typing import Protocol
+from collections.abc import Callable
+from enum import IntEnum
+from typing import Protocol, TypeAlias
 
-__all__ = ('Log', 'Logger', 'set_logger')
+__all__ = ('Log', 'LogLevel', 'LogMessage', 'Logger', 'set_logger')
+
+LogMessage: TypeAlias = str | Callable[[], str]
+'''Message text, or a callable making it. Callable is only called if message is going to be logged'''
+
+
+class LogLevel(IntEnum):
+    TRACE = 0x001
+    DEBUG = 0x002
+    INFO = 0x004
+    WARN = 0x008
+    ERROR = 0x010
+    FATAL = 0x800
 
 
 class Logger(Protocol):
+    """
+    Logger receives message text. Optional `should_log(level: int) -> bool` allows skipping
+    construction of messages which are not going to be logged, optional `flush()` is called before writing to terminal directly
+    """
     @staticmethod
     def log(text: str) -> None: ...
     @staticmethod
@@ -28,36 +46,58 @@ class Logger(Protocol):
     def trace(text: str) -> None: ...
 
 
+def _log_everything(_level: int) -> bool:
+    return True
+
+
+def _text(message: LogMessage) -> str:
+    return message if isinstance(message, str) else message()
+
+
 class Log:
     logger = Logger
+    should_log: Callable[[int], bool] = _log_everything
+
+    @staticmethod
+    def fatal(message: LogMessage) -> None:
+        if Log.should_log(LogLevel.FATAL):
+            Log.logger.fatal(_text(message))
 
     @staticmethod
-    def fatal(text: str) -> None:
-        Log.logger.fatal(text)
+    def error(message: LogMessage) -> None:
+        if Log.should_log(LogLevel.ERROR):
+            Log.logger.error(_text(message))
 
     @staticmethod
-    def error(text: str) -> None:
-        Log.logger.error(text)
+    def warn(message: LogMessage) -> None:
+        if Log.should_log(LogLevel.WARN):
+            Log.logger.warn(_text(message))
 
     @staticmethod
-    def warn(text: str) -> None:
-        Log.logger.warn(text)
+    def info(message: LogMessage) -> None:
+        if Log.should_log(LogLevel.INFO):
+            Log.logger.info(_text(message))
 
     @staticmethod
-    def info(text: str) -> None:
-        Log.logger.info(text)
+    def debug(message: LogMessage) -> None:
+        if Log.should_log(LogLevel.DEBUG):
+            Log.logger.debug(_text(message))
 
     @staticmethod
-    def debug(text: str) -> None:
-        Log.logger.debug(text)
+    def trace(message: LogMessage) -> None:
+        if Log.should_log(LogLevel.TRACE):
+            Log.logger.trace(_text(message))
 
     @staticmethod
-    def trace(text: str) -> None:
-        Log.logger.trace(text)
+    def flush() -> None:
+        """Waits for logger to output everything logged so far, if logger buffers its output"""
+        if flush := getattr(Log.logger, 'flush', None):
+            flush()
 
 
 def set_logger(logger: Logger) -> None:
     Log.logger = logger
+    Log.should_log = getattr(logger, 'should_log', None) or _log_everything
 
 #
 #
@@ -0,0 +1,96 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import time
+from asyncio import Future, get_running_loop
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+from .chunkgen import make_chunk_mac
+from .metrics import Metrics
+
+__all__ = ('ChunkMacQueue', 'MacEngine')
+
+T = TypeVar('T')
+
+
+class MacEngine:
+    """
+    Computes chunk MACs on a worker thread pool, off the event loop.
+    Chunk MACs are independent of each other so chunks of any number of files can be processed in parallel.
+    Workers are also used for chunk decryption
+    """
+    def __init__(self, max_workers: int, metrics: Metrics | None = None) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='MacEngine')
+        self._metrics = metrics
+        self.workers = max_workers
+
+    def run(self, func: Callable[..., T], *args) -> Future[T]:
+        """Runs arbitrary CPU-bound work (e.g. chunk decryption) on the engine workers"""
+        return get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def submit(self, k_bytes: bytes, iv_bytes: bytes, decrypted_chunk: bytes | memoryview) -> Future[bytes]:
+        return self.run(make_chunk_mac if self._metrics is None else self._make_chunk_mac_timed, k_bytes, iv_bytes, decrypted_chunk)
+
+    def _make_chunk_mac_timed(self, k_bytes: bytes, iv_bytes: bytes, decrypted_chunk: bytes | memoryview) -> bytes:
+        time_start = time.perf_counter()
+        chunk_mac = make_chunk_mac(k_bytes, iv_bytes, decrypted_chunk)
+        self._metrics.observe('chunk_mac', time.perf_counter() - time_start)
+        return chunk_mac
+
+    def make_queue(self, iv: bytes, k_decrypted: bytes) -> ChunkMacQueue:
+        """:param iv: CTR nonce (8 bytes), MAC iv is the nonce repeated twice"""
+        return ChunkMacQueue(self, k_decrypted, iv + iv)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ChunkMacQueue:
+    """
+    Ordered queue of pending chunk MAC computations of a single file (or file segment)
+    """
+    __slots__ = ('_engine', '_iv_bytes', '_k_bytes', '_pending')
+
+    def __init__(self, engine: MacEngine, k_bytes: bytes, iv_bytes: bytes) -> None:
+        self._engine = engine
+        self._k_bytes = k_bytes
+        self._iv_bytes = iv_bytes
+        self._pending = deque[tuple[int, Future[bytes]]]()
+
+    def put(self, chunk_idx: int, decrypted_chunk: bytes | memoryview) -> Future[bytes]:
+        future = self._engine.submit(self._k_bytes, self._iv_bytes, decrypted_chunk)
+        self._pending.append((chunk_idx, future))
+        return future
+
+    async def pop_ready(self, max_pending: int) -> list[tuple[int, bytes]]:
+        """
+        Returns computed MACs, stops at first MAC still being computed to preserve chunks order.
+        Waits for the oldest MACs if more than `max_pending` chunks are still queued (keeps memory usage bounded)
+        """
+        ready: list[tuple[int, bytes]] = []
+        while self._pending and (self._pending[0][1].done() or len(self._pending) > max_pending):
+            chunk_idx, future = self._pending.popleft()
+            ready.append((chunk_idx, await future))
+        return ready
+
+    async def pop_all(self) -> list[tuple[int, bytes]]:
+        """Waits for all pending MACs and returns them in order"""
+        ready: list[tuple[int, bytes]] = []
+        while self._pending:
+            chunk_idx, future = self._pending.popleft()
+            ready.append((chunk_idx, await future))
+        return ready
+
+#
+#
+#########################################
@@ -0,0 +1,84 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import pathlib
+import sqlite3
+from typing import NamedTuple
+
+from .defs import MANIFEST_VERSION
+from .logging import Log
+
+__all__ = ('DownloadManifest', 'ManifestEntry')
+
+
+class ManifestEntry(NamedTuple):
+    handle: str  # Node id
+    size: int
+    ts: int  # Node timestamp
+    meta_mac: str  # hex
+    complete: bool  # Fully written and not known to be corrupted
+
+    @staticmethod
+    def make(handle: str, size: int, ts: int, meta_mac: bytes, complete: bool = True) -> ManifestEntry:
+        return ManifestEntry(handle, size, ts, meta_mac.hex(), complete)
+
+
+class DownloadManifest:
+    """
+    SQLite database of files written to destination folder, keyed by file path relative to it.
+    Lets repeated runs tell up to date files from new or changed ones without reading the files themselves
+    """
+    def __init__(self, path: pathlib.Path) -> None:
+        self._path = path
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self._path)
+            # no WAL: destination may be a network filesystem
+            db.execute('PRAGMA synchronous=NORMAL')
+            if db.execute('PRAGMA user_version').fetchone()[0] != MANIFEST_VERSION:
+                Log.debug(f'Manifest {self._path.name}: initializing version {MANIFEST_VERSION:d}...')
+                db.executescript(
+                    'DROP TABLE IF EXISTS files;'
+                    'CREATE TABLE files (path TEXT PRIMARY KEY, handle TEXT NOT NULL, size INTEGER NOT NULL, ts INTEGER NOT NULL,'
+                    ' meta_mac TEXT NOT NULL, complete INTEGER NOT NULL) WITHOUT ROWID;'
+                    f'PRAGMA user_version={MANIFEST_VERSION:d};',
+                )
+            self._db = db
+        return self._db
+
+    def lookup(self, path: str) -> ManifestEntry | None:
+        """
+        :param path: file path relative to destination folder, in posix form
+        :returns recorded entry, if any
+        """
+        row = self._connect().execute('SELECT handle, size, ts, meta_mac, complete FROM files WHERE path=?', (path,)).fetchone()
+        return ManifestEntry(row[0], row[1], row[2], row[3], bool(row[4])) if row else None
+
+    def record(self, path: str, entry: ManifestEntry) -> None:
+        db = self._connect()
+        with db:
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', (path, *entry[:4], int(entry.complete)))
+
+    def forget(self, path: str) -> None:
+        db = self._connect()
+        with db:
+            db.execute('DELETE FROM files WHERE path=?', (path,))
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+#
+#
+#########################################
@@ -0,0 +1,184 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+import time
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from threading import Lock
+from types import SimpleNamespace
+from typing import TypeAlias
+
+from aiohttp import ClientSession, TraceConfig
+
+from .defs import METRICS_LATENCY_BUCKETS, METRICS_PROMETHEUS_PREFIX, UTF8
+
+__all__ = ('Histogram', 'Metrics')
+
+_TraceHook: TypeAlias = Callable[[ClientSession, SimpleNamespace, object], Awaitable[None]]
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, see `METRICS_LATENCY_BUCKETS`"""
+    __slots__ = ('bounds', 'buckets', 'count', 'max', 'sum')
+
+    def __init__(self, bounds: tuple[float, ...] = METRICS_LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """:returns upper bound of the bucket containing q-quantile (max for the last bucket)"""
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.bounds, self.buckets, strict=False):
+            seen += bucket_count
+            if seen >= rank and seen > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms of every stage of a run: request queue waits, API requests, hashcash,
+    connection setup (via aiohttp tracing, see `trace_config()`), chunk read / decrypt / MAC / write and whole file downloads.
+    Stages may be observed from worker threads
+    """
+    def __init__(self) -> None:
+        self.counters: dict[str, float] = {}
+        self.stages: dict[str, Histogram] = {}
+        self.started = time.time()
+        self._lock = Lock()
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if (histogram := self.stages.get(stage)) is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """Observes time spent in the block, including awaits"""
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - time_start)
+
+    def trace_config(self) -> TraceConfig:
+        """
+        Makes aiohttp trace config observing connection pool waits, DNS resolution, connection setup (TCP and TLS handshakes)
+        and time to first byte (response headers received)
+        """
+        def started(key: str) -> _TraceHook:
+            async def on_start(_session: ClientSession, ctx: SimpleNamespace, _params: object) -> None:
+                setattr(ctx, key, time.perf_counter())
+            return on_start
+
+        def ended(key: str, stage: str) -> _TraceHook:
+            async def on_end(_session: ClientSession, ctx: SimpleNamespace, _params: object) -> None:
+                if (time_start := getattr(ctx, key, None)) is not None:
+                    self.observe(stage, time.perf_counter() - time_start)
+            return on_end
+
+        def counted(name: str) -> _TraceHook:
+            async def on_event(_session: ClientSession, _ctx: SimpleNamespace, _params: object) -> None:
+                self.count(name)
+            return on_event
+
+        trace_config = TraceConfig()
+        trace_config.on_connection_queued_start.append(started('queued'))
+        trace_config.on_connection_queued_end.append(ended('queued', 'connection_queued'))
+        trace_config.on_dns_resolvehost_start.append(started('dns'))
+        trace_config.on_dns_resolvehost_end.append(ended('dns', 'dns_resolve'))
+        trace_config.on_dns_cache_hit.append(counted('dns_cache_hits'))
+        trace_config.on_connection_create_start.append(started('connect'))
+        trace_config.on_connection_create_end.append(ended('connect', 'connect'))
+        trace_config.on_request_start.append(started('request'))
+        trace_config.on_request_start.append(counted('http_requests'))
+        trace_config.on_request_end.append(ended('request', 'time_to_first_byte'))
+        trace_config.on_request_exception.append(counted('http_errors'))
+        return trace_config
+
+    def summary(self) -> dict[str, object]:
+        with self._lock:
+            return {
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'counters': dict(sorted(self.counters.items())),
+                'stages': {stage: histogram.summary() for stage, histogram in sorted(self.stages.items())},
+            }
+
+    def write_json(self, path: pathlib.Path) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=1))
+
+    def write_prometheus(self, path: pathlib.Path) -> None:
+        """Writes metrics in Prometheus text format, file is replaced atomically as node exporter textfile collector requires"""
+        prefix = METRICS_PROMETHEUS_PREFIX
+        lines = [
+            f'# HELP {prefix}_events_total Events counted during the run',
+            f'# TYPE {prefix}_events_total counter',
+        ]
+        with self._lock:
+            lines.extend(f'{prefix}_events_total{{event="{name}"}} {value!r}' for name, value in sorted(self.counters.items()))
+            lines.extend((
+                f'# HELP {prefix}_stage_seconds Latency of run stages',
+                f'# TYPE {prefix}_stage_seconds histogram',
+            ))
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*histogram.bounds, '+Inf'), histogram.buckets, strict=True):
+                    cumulative += bucket_count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative:d}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count:d}')
+        lines.extend((
+            f'# HELP {prefix}_run_started_seconds Run start time, seconds since epoch',
+            f'# TYPE {prefix}_run_started_seconds gauge',
+            f'{prefix}_run_started_seconds {self.started:f}',
+        ))
+        _write_atomic(path, '\n'.join((*lines, '')))
+
+
+def _write_atomic(path: pathlib.Path, text: str) -> None:
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    tmp_path.write_text(text, encoding=UTF8)
+    os.replace(tmp_path, path)
+
+#
+#
+#########################################
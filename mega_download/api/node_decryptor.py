@@ -0,0 +1,88 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+from asyncio import gather, sleep
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from .containers import Attributes, NodeType
+from .defs import NODE_DECRYPT_BATCH_SIZE, NODE_DECRYPT_SHARD_SIZE
+from .encryption import base64_url_decode, decrypt_attr, decrypt_keys_bulk, xor_key_halves
+from .node_table import KEY_DATA_SIZE
+from .process_pool import ProcessPool
+
+__all__ = ('DecryptedNode', 'EncryptedNode', 'NodeDecryptor', 'decrypt_nodes')
+
+
+class EncryptedNode(NamedTuple):
+    t: NodeType
+    k: str  # Node key ('<parent id>:<wrapped key>')
+    a: str  # Encrypted attributes
+
+
+class DecryptedNode(NamedTuple):
+    attributes: Attributes
+    key_data: bytes  # AES key, then iv and meta mac for files (see `NodeTable.key_data`)
+
+
+def decrypt_nodes(nodes: Sequence[EncryptedNode], shared_key: bytes | Sequence[int]) -> list[DecryptedNode]:
+    """
+    Decrypts nodes sharing the same key. All node keys are unwrapped at once, attributes are decrypted node by node
+    :param nodes: file and folder nodes only
+    :param shared_key: folder key
+    :returns decrypted nodes in the same order
+    """
+    keys = decrypt_keys_bulk([base64_url_decode(node.k.split(':')[1]) for node in nodes], shared_key)
+    decrypted: list[DecryptedNode] = []
+    for node, key_bytes in zip(nodes, keys, strict=True):
+        k_bytes = xor_key_halves(key_bytes) if node.t == NodeType.FILE else key_bytes
+        attrs = decrypt_attr(base64_url_decode(node.a), k_bytes)
+        key_data = k_bytes + key_bytes[16:] if node.t == NodeType.FILE else k_bytes.ljust(KEY_DATA_SIZE, b'\0')
+        decrypted.append(DecryptedNode(attrs, key_data))
+    return decrypted
+
+
+class NodeDecryptor:
+    """
+    Bulk decryption of folder listing nodes.
+    Small listings are decrypted in place in batches of `batch_size` nodes, yielding to the event loop in between,
+    larger ones are split into shards of `shard_size` nodes decrypted by a shared process pool (if given)
+    """
+    def __init__(
+        self, pool: ProcessPool | None = None, batch_size: int = NODE_DECRYPT_BATCH_SIZE, shard_size: int = NODE_DECRYPT_SHARD_SIZE,
+    ) -> None:
+        self._pool = pool
+        self.workers = pool.workers if pool else 1
+        self._batch_size = batch_size
+        self._shard_size = shard_size
+
+    async def decrypt(self, nodes: Sequence[EncryptedNode], shared_key: bytes | Sequence[int]) -> list[DecryptedNode]:
+        """
+        :param nodes: file and folder nodes only
+        :param shared_key: folder key
+        :returns decrypted nodes in the same order
+        """
+        if self.workers > 1 and len(nodes) > self._shard_size:
+            return await self._decrypt_sharded(nodes, shared_key)
+        decrypted: list[DecryptedNode] = []
+        for offset in range(0, len(nodes), self._batch_size):
+            if offset:
+                await sleep(0)
+            decrypted.extend(decrypt_nodes(nodes[offset:offset + self._batch_size], shared_key))
+        return decrypted
+
+    async def _decrypt_sharded(self, nodes: Sequence[EncryptedNode], shared_key: bytes | Sequence[int]) -> list[DecryptedNode]:
+        shards = [nodes[offset:offset + self._shard_size] for offset in range(0, len(nodes), self._shard_size)]
+        results = await gather(*(self._pool.run(decrypt_nodes, shard, shared_key) for shard in shards))
+        return [node for shard_result in results for node in shard_result]
+
+#
+#
+#########################################
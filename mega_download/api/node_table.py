@@ -0,0 +1,117 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import datetime
+import sys
+from array import array
+
+from .containers import File, Folder, NodeType
+from .encryption import unpack_sequence
+
+__all__ = ('KEY_DATA_SIZE', 'NodeTable')
+
+KEY_DATA_SIZE = 32
+'''Per node key data: AES key (16 bytes), then for files iv (8 bytes) and meta mac (8 bytes)'''
+
+
+class NodeTable:
+    """
+    Compact column store of folder listing nodes, one row per node in listing order.
+    Handles are interned, numbers are kept in typed arrays, parent links are row indexes (-1 if parent is not in the listing)
+    and all keys share a single buffer. Node dicts are only made on demand, see `node()`
+    """
+    __slots__ = ('_parent_handles', '_rows', 'encrypted', 'handles', 'key_data', 'names', 'nums_in_queue', 'parents', 'sizes',
+                 'timestamps', 'types')
+
+    def __init__(self, keep_encrypted: bool = False) -> None:
+        self.handles: list[str] = []
+        self.parents = array('l')
+        self.types = array('b')
+        self.sizes = array('q')
+        self.timestamps = array('q')
+        self.nums_in_queue = array('l')
+        self.names: list[str] = []
+        self.key_data = bytearray()
+        self.encrypted: list[tuple[str, str]] | None = [] if keep_encrypted else None
+        '''Encrypted (key, attributes) of every node, kept for listing cache only'''
+        self._rows: dict[str, int] = {}
+        self._parent_handles: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def clear(self) -> None:
+        self.__init__(self.encrypted is not None)
+
+    def add(self, node: File | Folder) -> int:
+        """
+        Adds listing node, its name and keys are unknown until `set_decrypted()` is called
+        :returns row index
+        """
+        row = len(self.handles)
+        handle = sys.intern(node['h'])
+        self.handles.append(handle)
+        self._rows[handle] = row
+        self._parent_handles.append(sys.intern(node['p']))
+        self.types.append(node['t'])
+        self.sizes.append(node.get('s', 0))
+        self.timestamps.append(node['ts'])
+        self.nums_in_queue.append(0)
+        self.names.append('')
+        self.key_data.extend(bytes(KEY_DATA_SIZE))
+        if self.encrypted is not None:
+            self.encrypted.append((node['k'], node['a']))
+        return row
+
+    def set_decrypted(self, row: int, name: str, key_data: bytes) -> None:
+        self.names[row] = name
+        self.key_data[row * KEY_DATA_SIZE:(row + 1) * KEY_DATA_SIZE] = key_data
+
+    def link(self) -> None:
+        """Resolves parent handles into row indexes, must be called once all nodes are added"""
+        self.parents = array('l', [self._rows.get(parent_handle, -1) for parent_handle in self._parent_handles])
+        self._parent_handles = []
+
+    def row(self, handle: str) -> int:
+        return self._rows[handle]
+
+    def key_bytes(self, row: int) -> bytes:
+        """AES key of node (for files, already folded from the full file key)"""
+        return bytes(self.key_data[row * KEY_DATA_SIZE:row * KEY_DATA_SIZE + 16])
+
+    def iv_bytes(self, row: int) -> bytes:
+        return bytes(self.key_data[row * KEY_DATA_SIZE + 16:row * KEY_DATA_SIZE + 24])
+
+    def meta_mac_bytes(self, row: int) -> bytes:
+        return bytes(self.key_data[row * KEY_DATA_SIZE + 24:(row + 1) * KEY_DATA_SIZE])
+
+    def node(self, row: int) -> File | Folder:
+        """Makes node dict of a row, as it would be made from listing node. Keys are int tuples, as in every public node dict"""
+        key_ints = unpack_sequence(bytes(self.key_data[row * KEY_DATA_SIZE:(row + 1) * KEY_DATA_SIZE]))
+        parent = self.parents[row] if self._parent_handles == [] else -1
+        node = File(
+            h=self.handles[row],
+            p=self.handles[parent] if parent >= 0 else '',
+            t=NodeType(self.types[row]),
+            s=self.sizes[row],
+            ts=self.timestamps[row],
+            attributes={'n': self.names[row]},
+            k_decrypted=key_ints[:4],
+            timestamp=datetime.datetime.fromtimestamp(self.timestamps[row]),
+            num_in_queue=self.nums_in_queue[row],
+        )
+        if node['t'] == NodeType.FILE:
+            node['iv'] = (*key_ints[4:6], 0, 0)
+            node['meta_mac'] = key_ints[6:8]
+        return node
+
+#
+#
+#########################################
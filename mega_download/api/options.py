@@ -7,24 +7,39 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 
 import pathlib
+import sys
+from collections.abc import Callable
 from typing import TypedDict
 
 from aiohttp import ClientTimeout
 
-from .defs import DownloadMode
+from .defs import DownloadMode, OutputPolicy, OverwritePolicy
 from .filters import Filter
 from .hooks import DownloadParamsCallback, FileSystemCallback
 from .logging import Logger
+from .output import OutputBackend
+from .prompts import PromptBroker
+
+if sys.version_info >= (3, 11):
+    from typing import NotRequired
+else:
+    from typing_extensions import NotRequired
 
 
 class MegaOptions(TypedDict):
+    # NotRequired keys were added later, options made for older versions omit them and get defaults
     # for local
     dest_base: pathlib.Path
     retries: int
     max_jobs: int
+    segments: NotRequired[int]
     timeout: ClientTimeout
     nodelay: bool
+    api_request_rate: NotRequired[float]
+    storage_request_rate: NotRequired[float]
     noconfirm: bool
+    overwrite_policy: NotRequired[OverwritePolicy | None]
+    prompts: NotRequired[PromptBroker | None]
     proxy: str
     extra_headers: list[tuple[str, str]]
     extra_cookies: list[tuple[str, str]]
@@ -32,6 +47,11 @@ class MegaOptions(TypedDict):
     hooks_before_download: tuple[DownloadParamsCallback]
     hooks_after_scan: tuple[FileSystemCallback]
     download_mode: DownloadMode
+    output_policy: NotRequired[OutputPolicy]
+    output_backend: NotRequired[Callable[[], OutputBackend] | None]
+    session_cache: NotRequired[pathlib.Path | None]
+    listing_cache: NotRequired[pathlib.Path | None]
+    manifest: NotRequired[bool]
     # for global
     logger: Logger
 
@@ -0,0 +1,211 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import os
+import pathlib
+from asyncio import Lock, get_running_loop
+from collections.abc import Callable
+from typing import Literal, Protocol
+
+from aiofile import AIOFile
+
+from .defs import FsyncMode, OutputPolicy
+from .logging import Log
+
+__all__ = ('AioFileOutputBackend', 'CoalescingWriter', 'OutputBackend', 'OutputFile', 'PosixOutputBackend', 'default_output_backend')
+
+OutputMode = Literal['wb', 'r+b']
+
+HAS_PWRITE = hasattr(os, 'pwrite')
+HAS_FALLOCATE = hasattr(os, 'posix_fallocate')
+HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+class OutputBackend(Protocol):
+    async def open(self, path: pathlib.Path, mode: OutputMode) -> None: ...
+    async def preallocate(self, size: int) -> None: ...
+    async def write(self, data: bytes | memoryview, offset: int) -> None: ...
+    async def sync(self) -> None: ...
+    async def drop_cache(self) -> None: ...
+    async def close(self) -> None: ...
+
+
+class PosixOutputBackend:
+    """
+    Output backend using positional os.pwrite() in executor, accepts any buffer objects.
+    Supports preallocation (posix_fallocate) and page cache dropping (posix_fadvise) where available
+    """
+    def __init__(self) -> None:
+        self._fd = -1
+
+    @staticmethod
+    async def _run(func: Callable, *args) -> None:
+        await get_running_loop().run_in_executor(None, func, *args)
+
+    async def open(self, path: pathlib.Path, mode: OutputMode) -> None:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC if mode == 'wb' else os.O_RDWR
+        self._fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o666)
+
+    async def preallocate(self, size: int) -> None:
+        if HAS_FALLOCATE:
+            try:
+                await self._run(os.posix_fallocate, self._fd, 0, size)
+                return
+            except OSError:
+                # not supported by file system
+                pass
+        await self._run(os.ftruncate, self._fd, size)
+
+    @staticmethod
+    def _pwrite_all(fd: int, data: bytes | memoryview, offset: int) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    async def write(self, data: bytes | memoryview, offset: int) -> None:
+        await self._run(self._pwrite_all, self._fd, data, offset)
+
+    async def sync(self) -> None:
+        await self._run(getattr(os, 'fdatasync', os.fsync), self._fd)
+
+    async def drop_cache(self) -> None:
+        if HAS_FADVISE:
+            await self._run(os.posix_fadvise, self._fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    async def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class AioFileOutputBackend:
+    """
+    Output backend using aiofile, portable. Requires `bytes` so buffers are copied. Page cache dropping is not supported
+    """
+    def __init__(self) -> None:
+        self._file: AIOFile | None = None
+
+    async def open(self, path: pathlib.Path, mode: OutputMode) -> None:
+        self._file = AIOFile(path, mode)
+        await self._file.open()
+
+    async def preallocate(self, size: int) -> None:
+        await get_running_loop().run_in_executor(None, os.ftruncate, self._file.fileno(), size)
+
+    async def write(self, data: bytes | memoryview, offset: int) -> None:
+        await self._file.write(data if isinstance(data, bytes) else bytes(data), offset)
+
+    async def sync(self) -> None:
+        await self._file.fsync()
+
+    async def drop_cache(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+
+def default_output_backend() -> OutputBackend:
+    return PosixOutputBackend() if HAS_PWRITE else AioFileOutputBackend()
+
+
+class OutputFile:
+    """
+    Output file supporting positional writes in any order, applies output policy (preallocation, fsync and page cache dropping)
+    """
+    def __init__(self, path: pathlib.Path, mode: OutputMode, size: int, policy: OutputPolicy, backend: OutputBackend) -> None:
+        self._path = path
+        self._mode = mode
+        self._size = size
+        self._policy = policy
+        self._backend = backend
+        self._unsynced = 0
+        self._sync_lock = Lock()
+
+    @property
+    def policy(self) -> OutputPolicy:
+        return self._policy
+
+    async def __aenter__(self) -> OutputFile:
+        await self._backend.open(self._path, self._mode)
+        if self._mode == 'wb' and self._policy.preallocate and self._size > 0:
+            try:
+                await self._backend.preallocate(self._size)
+            except OSError as e:
+                Log.warn(f'{self._path.name}: unable to preallocate {self._size:d} bytes: {e!s}')
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            # dirty pages are not evicted, so dropping cache requires sync regardless of fsync mode
+            if self._policy.fsync_mode != FsyncMode.NEVER or self._policy.drop_cache:
+                await self._backend.sync()
+            if self._policy.drop_cache:
+                await self._backend.drop_cache()
+        finally:
+            await self._backend.close()
+
+    async def write(self, data: bytes | memoryview, offset: int) -> None:
+        await self._backend.write(data, offset)
+        if self._policy.fsync_mode == FsyncMode.PERIODIC:
+            self._unsynced += len(data)
+            if self._unsynced >= self._policy.fsync_interval and not self._sync_lock.locked():
+                async with self._sync_lock:
+                    self._unsynced = 0
+                    await self._backend.sync()
+                    if self._policy.drop_cache:
+                        # synced pages are clean now and can be evicted
+                        await self._backend.drop_cache()
+
+
+class CoalescingWriter:
+    """
+    Coalesces contiguous writes of a single chunk run into large writes aligned to `coalesce_size` file boundaries.
+    Tracks how far the data was actually written (`flushed_end`)
+    """
+    def __init__(self, output_file: OutputFile, start_offset: int) -> None:
+        self._output_file = output_file
+        self._coalesce_size = output_file.policy.coalesce_size
+        self._staging = bytearray(self._coalesce_size)
+        self._staging_offset = start_offset
+        self._staged = 0
+        self.flushed_end = start_offset
+
+    async def write(self, data: bytes | memoryview, offset: int) -> None:
+        assert offset == self._staging_offset + self._staged, f'Non-contiguous write at {offset:d}!'
+        if not self._coalesce_size:
+            await self._output_file.write(data, offset)
+            self._staging_offset = self.flushed_end = offset + len(data)
+            return
+        view = memoryview(data)
+        while view:
+            # flush at aligned boundaries, so the first and the last writes may be shorter
+            boundary = (self._staging_offset // self._coalesce_size + 1) * self._coalesce_size
+            to_stage = min(len(view), boundary - self._staging_offset - self._staged)
+            self._staging[self._staged:self._staged + to_stage] = view[:to_stage]
+            self._staged += to_stage
+            view = view[to_stage:]
+            if self._staging_offset + self._staged == boundary:
+                await self.flush()
+
+    async def flush(self) -> None:
+        if self._staged:
+            await self._output_file.write(memoryview(self._staging)[:self._staged], self._staging_offset)
+            self._staging_offset += self._staged
+            self._staged = 0
+            self.flushed_end = self._staging_offset
+
+#
+#
+#########################################
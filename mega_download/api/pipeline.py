@@ -0,0 +1,141 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+from asyncio import FIRST_EXCEPTION, IncompleteReadError, Queue, create_task, wait
+from collections import deque
+from collections.abc import Callable
+
+from aiohttp import StreamReader
+
+from .buffers import BufferPool
+from .chunkgen import make_chunk_decryptor
+from .defs import PIPELINE_QUEUE_DEPTH
+from .mac_engine import MacEngine
+from .metrics import Metrics
+from .output import CoalescingWriter, OutputFile
+from .transfer import TransferState
+
+__all__ = ('TransferPipeline',)
+
+_STOP = None
+
+
+class TransferPipeline:
+    """
+    Transfers contiguous run of file chunks as three stages joined by bounded queues:\n
+    read (network) -> decrypt (worker pool) -> write (output file) and MAC (worker pool, see `MacEngine`).
+    Stages overlap with each other while memory held by a single transfer stays bounded by queues depth.
+    Every chunk lives in a single pooled buffer: read into, decrypted in place, written and MAC'ed from, then released.
+    Writes are coalesced (see `CoalescingWriter`), chunk is only considered done once it is both MAC'ed and written to file
+    """
+    def __init__(
+        self, state: TransferState, chunk_range: range, engine: MacEngine, pool: BufferPool, *, depth: int = PIPELINE_QUEUE_DEPTH,
+        metrics: Metrics | None = None,
+    ) -> None:
+        self._state = state
+        self._chunk_range = chunk_range
+        self._engine = engine
+        self._pool = pool
+        self._depth = depth
+        self._decrypt_queue = Queue[tuple[int, memoryview] | None](depth)
+        self._write_queue = Queue[tuple[int, memoryview] | None](depth)
+        self._mac_queue = engine.make_queue(state.params.iv, state.params.k_decrypted)
+        self._macs_ready = deque[tuple[int, bytes]]()
+        self._metrics = metrics or Metrics()
+        self.chunks_written = 0
+
+    async def run(self, content: StreamReader, output_file: OutputFile, on_chunk_done: Callable[[int, int], None]) -> None:
+        """
+        Runs all stages until chunk run is fully transferred or any stage fails
+        :param content: response stream positioned at the first chunk
+        :param output_file: output file opened for positional writes
+        :param on_chunk_done: callback(chunk_index, bytes_written_total), called for each chunk with ready MAC
+        """
+        writer = CoalescingWriter(output_file, self._state.chunks[self._chunk_range.start].offset)
+        tasks = [
+            create_task(self._read(content)),
+            create_task(self._decrypt()),
+            create_task(self._write(writer, on_chunk_done)),
+        ]
+        try:
+            done, pending = await wait(tasks, return_when=FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await wait(pending)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # chunks which made it to disk are still valid
+            self._macs_ready.extend(await self._mac_queue.pop_all())
+            try:
+                await writer.flush()
+            finally:
+                self._chunks_done(writer.flushed_end, on_chunk_done)
+
+    def _chunks_done(self, flushed_end: int, on_chunk_done: Callable[[int, int], None]) -> None:
+        chunks = self._state.chunks
+        while self._macs_ready and chunks[self._macs_ready[0][0]].offset + chunks[self._macs_ready[0][0]].size <= flushed_end:
+            chunk_idx, chunk_mac = self._macs_ready.popleft()
+            on_chunk_done(chunk_idx, self._state.chunk_done(chunk_idx, chunk_mac))
+
+    async def _read(self, content: StreamReader) -> None:
+        for chunk_idx in self._chunk_range:
+            buffer = self._pool.acquire(self._state.chunks[chunk_idx].size)
+            with self._metrics.timed('chunk_read'):
+                await _read_into(content, buffer)
+            await self._decrypt_queue.put((chunk_idx, buffer))
+        await self._decrypt_queue.put(_STOP)
+
+    async def _decrypt(self) -> None:
+        chunk_decryptor = make_chunk_decryptor(
+            self._state.params.iv, self._state.params.k_decrypted, offset=self._state.chunks[self._chunk_range.start].offset)
+        _ = next(chunk_decryptor)  # Init chunk decryptor
+        while (item := await self._decrypt_queue.get()) is not _STOP:
+            chunk_idx, buffer = item
+            with self._metrics.timed('chunk_decrypt'):
+                if self._engine.workers > 1:
+                    # decryptor is only ever used by one worker at a time, chunks are decrypted in order
+                    await self._engine.run(chunk_decryptor.send, buffer)
+                else:
+                    # no cores to spare, thread hop would only add overhead
+                    chunk_decryptor.send(buffer)
+            await self._write_queue.put((chunk_idx, buffer))
+        await self._write_queue.put(_STOP)
+
+    async def _write(self, writer: CoalescingWriter, on_chunk_done: Callable[[int, int], None]) -> None:
+        while (item := await self._write_queue.get()) is not _STOP:
+            chunk_idx, buffer = item
+            with self._metrics.timed('chunk_write'):
+                await writer.write(buffer, self._state.chunks[chunk_idx].offset)
+            self.chunks_written += 1
+            # chunk MAC is computed in background
+            self._mac_queue.put(chunk_idx, buffer).add_done_callback(lambda _, b=buffer: self._pool.release(b))
+            self._macs_ready.extend(await self._mac_queue.pop_ready(self._depth))
+            self._chunks_done(writer.flushed_end, on_chunk_done)
+
+
+async def _read_into(content: StreamReader, buffer: memoryview) -> None:
+    """Fills the buffer with the data from response stream, copying once from stream internal buffer"""
+    size = len(buffer)
+    filled = 0
+    while filled < size:
+        data = await content.read(size - filled)
+        if not data:
+            raise IncompleteReadError(bytes(buffer[:filled]), size)
+        buffer[filled:filled + len(data)] = data
+        filled += len(data)
+
+#
+#
+#########################################
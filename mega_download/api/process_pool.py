@@ -0,0 +1,85 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+from asyncio import Future, Queue, get_running_loop
+from collections.abc import AsyncIterator, Callable, MutableSequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import TypeVar
+
+from .defs import PROCESS_POOL_STOP_SLOTS
+
+__all__ = ('ProcessPool', 'stop_requested')
+
+T = TypeVar('T')
+
+# worker process state, see _init_worker()
+_worker_stop_flags: MutableSequence[int] | None = None
+
+
+def _init_worker(stop_flags: MutableSequence[int]) -> None:
+    global _worker_stop_flags
+    _worker_stop_flags = stop_flags
+
+
+def stop_requested(slot: int) -> bool:
+    """Worker side: :returns True if work running under this stop slot should stop, see `ProcessPool.stop_slot()`"""
+    return _worker_stop_flags[slot] != 0
+
+
+class ProcessPool:
+    """
+    Worker process pool shared by CPU-bound work (hashcash solving, bulk node decryption), started on first use.
+    Workers are started with 'forkserver' (or 'spawn' where unavailable) method, never forked from this threaded process.
+    Workers share an array of stop flags, long-running work can be stopped through its stop slot (see `stop_slot()`)
+    """
+    def __init__(self, max_workers: int = 0, stop_slots: int = PROCESS_POOL_STOP_SLOTS) -> None:
+        self.workers = max_workers or os.cpu_count() or 1
+        self._stop_slots = stop_slots
+        self._mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        self._stop_flags = self._mp_context.RawArray('b', stop_slots)
+        self._free_slots: Queue[int] | None = None
+        self._executor: ProcessPoolExecutor | None = None
+
+    def run(self, func: Callable[..., T], *args) -> Future[T]:
+        """Runs `func` in a worker process, `func` and `args` must be picklable"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=self._mp_context, initializer=_init_worker, initargs=(self._stop_flags,))
+        return get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @asynccontextmanager
+    async def stop_slot(self) -> AsyncIterator[int]:
+        """
+        Reserves stop slot for a group of work items, stop is requested on exit.
+        Workers check it with `stop_requested(slot)`
+        """
+        if self._free_slots is None:
+            self._free_slots = Queue[int]()
+            for slot in range(self._stop_slots):
+                self._free_slots.put_nowait(slot)
+        slot = await self._free_slots.get()
+        self._stop_flags[slot] = 0
+        try:
+            yield slot
+        finally:
+            self._stop_flags[slot] = 1
+            self._free_slots.put_nowait(slot)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+#
+#
+#########################################
@@ -0,0 +1,217 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import functools
+import time
+from asyncio import CancelledError, Task, get_running_loop, sleep
+from collections.abc import Callable
+from enum import IntEnum
+from typing import NamedTuple, TypeAlias
+
+from mega_download.util import format_time
+
+from .defs import PROGRESS_INTERVAL, PROGRESS_SPEED_SMOOTHING, SITE_TAG, Mem
+from .logging import Log
+
+__all__ = (
+    'FileProgress',
+    'ProgressCallback',
+    'ProgressEvent',
+    'ProgressEventType',
+    'ProgressTracker',
+    'TotalProgress',
+    'TransferProgress',
+    'log_progress',
+)
+
+
+def _eta(remaining: int, speed: float) -> float | None:
+    return remaining / speed if speed > 0.0 else None
+
+
+class ProgressEventType(IntEnum):
+    STARTED = 0
+    UPDATED = 1
+    FINISHED = 2
+
+
+class FileProgress(NamedTuple):
+    name: str
+    size: int
+    done: int
+    speed: float
+    '''bytes per second, smoothed'''
+
+    @property
+    def eta(self) -> float | None:
+        """:returns seconds left, None if unknown"""
+        return _eta(self.size - self.done, self.speed)
+
+
+class TotalProgress(NamedTuple):
+    files: tuple[FileProgress, ...]
+    '''active transfers'''
+    files_finished: int
+    size: int
+    '''bytes, all files transferred so far and active ones'''
+    done: int
+    speed: float
+    '''bytes per second, smoothed'''
+
+    @property
+    def remaining(self) -> int:
+        return self.size - self.done
+
+    @property
+    def eta(self) -> float | None:
+        """:returns seconds left for active transfers, None if unknown"""
+        return _eta(self.remaining, self.speed)
+
+
+class ProgressEvent(NamedTuple):
+    type: ProgressEventType
+    file: FileProgress | None
+    '''file started or finished, None for periodic updates'''
+    total: TotalProgress
+
+
+ProgressCallback: TypeAlias = Callable[[ProgressEvent], None]
+
+
+class TransferProgress:
+    """Progress of a single file, updated by the transfer itself. Updating is a single attribute store"""
+    __slots__ = ('done', 'last_done', 'name', 'size', 'speed')
+
+    def __init__(self, name: str, size: int, done: int) -> None:
+        self.name = name
+        self.size = size
+        self.done = done
+        self.last_done = done
+        self.speed = 0.0
+
+    def on_chunk_done(self, _chunk_idx: int, bytes_written: int) -> None:
+        self.done = bytes_written
+
+    def snapshot(self) -> FileProgress:
+        return FileProgress(self.name, self.size, self.done, self.speed)
+
+
+class ProgressTracker:
+    """
+    Aggregates progress of all active transfers. Transfers only store byte counts,
+    throughput is computed and subscribers are notified at a fixed low frequency, while any transfer is active
+    """
+    def __init__(self, interval: float = PROGRESS_INTERVAL) -> None:
+        self._interval = interval
+        self._transfers: list[TransferProgress] = []
+        self._subscribers: list[ProgressCallback] = []
+        self._files_finished = 0
+        self._size_finished = 0
+        self._done_finished = 0
+        self._transferred = 0  # bytes transferred by finished transfers since last update
+        self._speed = 0.0
+        self._ticker: Task | None = None
+
+    def subscribe(self, callback: ProgressCallback) -> Callable[[], None]:
+        """:returns callable cancelling the subscription"""
+        self._subscribers.append(callback)
+        return functools.partial(self._subscribers.remove, callback)
+
+    def start(self, name: str, size: int, done: int = 0) -> TransferProgress:
+        """
+        Registers new transfer
+        :param done: bytes already present (resumed)
+        :returns progress object to report written bytes to
+        """
+        transfer = TransferProgress(name, size, done)
+        self._transfers.append(transfer)
+        if self._ticker is None:
+            self._ticker = get_running_loop().create_task(self._run())
+        self._notify(ProgressEventType.STARTED, transfer.snapshot())
+        return transfer
+
+    def finish(self, transfer: TransferProgress) -> None:
+        self._transfers.remove(transfer)
+        self._files_finished += 1
+        self._size_finished += transfer.size
+        self._done_finished += transfer.done
+        self._transferred += transfer.done - transfer.last_done
+        self._notify(ProgressEventType.FINISHED, transfer.snapshot())
+
+    def total(self) -> TotalProgress:
+        return TotalProgress(
+            tuple(transfer.snapshot() for transfer in self._transfers),
+            self._files_finished,
+            self._size_finished + sum(transfer.size for transfer in self._transfers),
+            self._done_finished + sum(transfer.done for transfer in self._transfers),
+            self._speed,
+        )
+
+    async def close(self) -> None:
+        if self._ticker is not None:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except CancelledError:
+                pass
+            self._ticker = None
+
+    def _notify(self, event_type: ProgressEventType, file: FileProgress | None) -> None:
+        if self._subscribers:
+            event = ProgressEvent(event_type, file, self.total())
+            for callback in self._subscribers:
+                callback(event)
+
+    def _update_speeds(self, elapsed: float) -> None:
+        transferred = self._transferred
+        self._transferred = 0
+        for transfer in self._transfers:
+            delta = transfer.done - transfer.last_done
+            transfer.last_done = transfer.done
+            transferred += delta
+            transfer.speed = self._smooth(transfer.speed, delta / elapsed)
+        self._speed = self._smooth(self._speed, transferred / elapsed)
+
+    @staticmethod
+    def _smooth(speed: float, speed_now: float) -> float:
+        return speed_now if speed == 0.0 else speed + (speed_now - speed) * PROGRESS_SPEED_SMOOTHING
+
+    async def _run(self) -> None:
+        try:
+            last_update = time.monotonic()
+            while self._transfers:
+                await sleep(self._interval)
+                now = time.monotonic()
+                self._update_speeds(now - last_update)
+                last_update = now
+                if self._transfers:
+                    self._notify(ProgressEventType.UPDATED, None)
+        finally:
+            self._ticker = None
+            self._speed = 0.0
+
+
+def log_progress(event: ProgressEvent) -> None:
+    """Renders periodic updates as a single log message"""
+    if event.type != ProgressEventType.UPDATED:
+        return
+    total = event.total
+    eta_str = format_time(int(total.eta)) if total.eta is not None else '--:--:--'
+    total_str = f'{total.done / Mem.MB:.2f} / {total.size / Mem.MB:.2f} MB, {total.speed / Mem.MB:.2f} MB/s, ETA {eta_str}'
+    lines = [f'[{SITE_TAG}] {len(total.files):d} active, {total.files_finished:d} finished: {total_str}']
+    for file in total.files:
+        eta_str = format_time(int(file.eta)) if file.eta is not None else '--:--:--'
+        percent = file.done * 100 / file.size if file.size else 100.0
+        lines.append(f'  {file.name}: {percent:.1f}% of {file.size / Mem.MB:.2f} MB, {file.speed / Mem.MB:.2f} MB/s, ETA {eta_str}')
+    Log.info('\n'.join(lines))
+
+#
+#
+#########################################
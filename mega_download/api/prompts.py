@@ -0,0 +1,129 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import codecs
+import os
+import sys
+from asyncio import Event, Future, Lock, get_running_loop
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TextIO
+
+from .defs import UTF8
+from .logging import Log
+
+__all__ = ('PromptBroker',)
+
+
+class PromptBroker:
+    """
+    Asks questions on the terminal without blocking the event loop.
+    Questions from concurrent tasks are serialized, answers are read from stdin by the loop's reader
+    (or by a worker thread if the loop cannot watch stdin), so transfers keep running while a question waits for an answer
+    """
+    def __init__(self, stdin: TextIO | None = None, stdout: TextIO | None = None) -> None:
+        self._stdin = stdin or sys.stdin
+        self._stdout = stdout or sys.stdout
+        self._lock = Lock()
+        self._pending = 0
+        self._idle = Event()
+        self._idle.set()
+        self._terminal_free = Event()
+        self._terminal_free.set()
+        self._decoder = codecs.getincrementaldecoder(UTF8)(errors='replace')
+        self._buffer = ''
+
+    @property
+    def prompting(self) -> bool:
+        """True while any question is waiting to be asked or answered"""
+        return self._pending > 0
+
+    async def wait_idle(self) -> None:
+        await self._idle.wait()
+
+    @contextmanager
+    def holding_terminal(self) -> Iterator[None]:
+        """Questions are not asked while terminal is held by someone else (i.e. is in raw mode)"""
+        self._terminal_free.clear()
+        try:
+            yield
+        finally:
+            self._terminal_free.set()
+
+    async def ask(self, question: str, answers: str, default: str) -> str:
+        """
+        Asks a question, repeating it until an acceptable answer is given
+        :param question: question text
+        :param answers: acceptable answers, one character each, case insensitive
+        :param default: answer for empty input or end of input
+        :returns answer, lowercase
+        """
+        self._pending += 1
+        self._idle.clear()
+        try:
+            async with self._lock:
+                await self._terminal_free.wait()
+                while True:
+                    line = await self._read_line(f'{question}\n')
+                    if line is None:
+                        return default
+                    answer = line.strip().lower() or default
+                    if len(answer) == 1 and answer in answers.lower():
+                        return answer
+        finally:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.set()
+
+    def _take_line(self) -> str | None:
+        for idx, ch in enumerate(self._buffer):
+            if ch in '\r\n':
+                # '\r\n' is a single line end
+                line_end = 2 if self._buffer[idx:idx + 2] == '\r\n' else 1
+                line, self._buffer = self._buffer[:idx], self._buffer[idx + line_end:]
+                return line
+        return None
+
+    async def _read_line(self, prompt: str) -> str | None:
+        """:returns line without line end, None if input is exhausted"""
+        Log.flush()
+        self._stdout.write(prompt)
+        self._stdout.flush()
+        if (line := self._take_line()) is not None:
+            return line
+
+        loop = get_running_loop()
+        try:
+            fd = self._stdin.fileno()
+            line_ready: Future[str | None] = loop.create_future()
+
+            def on_readable() -> None:
+                data = os.read(fd, 0x1000)
+                self._buffer += self._decoder.decode(data, final=not data)
+                if line_ready.done():
+                    return
+                if (read_line := self._take_line()) is not None:
+                    line_ready.set_result(read_line)
+                elif not data:
+                    line_ready.set_result(self._buffer.rstrip() or None)
+                    self._buffer = ''
+            loop.add_reader(fd, on_readable)
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            # no readers for stdin (Windows, redirected streams without descriptor)
+            read_line = await loop.run_in_executor(None, self._stdin.readline)
+            return read_line.rstrip('\r\n') if read_line else None
+        try:
+            return await line_ready
+        finally:
+            loop.remove_reader(fd)
+
+#
+#
+#########################################
@@ -6,42 +6,82 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
-import asyncio
-import random
+from __future__ import annotations
+
+from asyncio import Future, TimerHandle, get_running_loop
 from collections import deque
 
-from .defs import CONNECT_REQUEST_DELAY
+from .defs import API_REQUEST_BURST, API_REQUEST_RATE, SITE_API, STORAGE_REQUEST_BURST, STORAGE_REQUEST_RATE
+
+__all__ = ('RequestQueue', 'TokenBucket')
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Waiters are served in FIFO order and woken by a timer set to the next token refill
+    """
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        assert rate > 0.0 and burst > 0
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = -1.0
+        self._waiters = deque[Future[None]]()
+        self._timer: TimerHandle | None = None
+
+    def _refill(self, now: float) -> None:
+        if self._updated >= 0.0:
+            self._tokens = min(float(self._burst), self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it"""
+        loop = get_running_loop()
+        self._refill(loop.time())
+        if not self._waiters and self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self._schedule()
+        await waiter
+
+    def _schedule(self) -> None:
+        if self._timer is None and self._waiters:
+            loop = get_running_loop()
+            self._timer = loop.call_at(loop.time() + max(0.0, (1.0 - self._tokens) / self._rate), self._wake)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._refill(get_running_loop().time())
+        while self._waiters and self._tokens >= 1.0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():  # cancelled
+                waiter.set_result(None)
+                self._tokens -= 1.0
+        self._schedule()
 
 
 class RequestQueue:
     """
-    Request delayed queue wrapper
+    Request rate limiter, API endpoint and storage hosts have their own separate rates.
+    Rate is given in requests per second, 0 means unlimited
     """
-    _queue = deque[str]()
-    _ready = True
-    _lock = asyncio.Lock()
-
-    @staticmethod
-    def _reset() -> None:
-        RequestQueue._ready = True
-        RequestQueue._queue.clear()
-
-    @staticmethod
-    async def _set_ready() -> None:
-        await asyncio.sleep(random.uniform(CONNECT_REQUEST_DELAY, CONNECT_REQUEST_DELAY + 0.75))
-        RequestQueue._ready = True
-
-    @staticmethod
-    async def until_ready(url: str) -> None:
-        """Pauses request until base delay passes (since last request)"""
-        async with RequestQueue._lock:
-            RequestQueue._queue.append(url)
-        while RequestQueue._ready is False or RequestQueue._queue[0] != url:
-            await asyncio.sleep(0.2)
-        async with RequestQueue._lock:
-            RequestQueue._queue.popleft()
-            RequestQueue._ready = False
-            asyncio.get_running_loop().create_task(RequestQueue._set_ready())
+    def __init__(
+        self,
+        api_rate: float = API_REQUEST_RATE,
+        storage_rate: float = STORAGE_REQUEST_RATE, *,
+        api_burst: int = API_REQUEST_BURST,
+        storage_burst: int = STORAGE_REQUEST_BURST,
+    ) -> None:
+        self._api_bucket = TokenBucket(api_rate, api_burst) if api_rate else None
+        self._storage_bucket = TokenBucket(storage_rate, storage_burst) if storage_rate else None
+
+    async def until_ready(self, url: str) -> None:
+        """Pauses request until endpoint rate allows it"""
+        bucket = self._api_bucket if url.startswith(SITE_API) else self._storage_bucket
+        if bucket is not None:
+            await bucket.acquire()
 
 #
 #
@@ -0,0 +1,85 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+from asyncio import Future, get_running_loop
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+__all__ = ('JobScheduler',)
+
+
+class JobScheduler:
+    """
+    Global download jobs budget shared by all links being processed.
+    When all slots are taken waiting jobs are queued per link and freed slots are handed to links in round-robin order,
+    so a link with thousands of files can not starve the others
+    """
+    def __init__(self, max_jobs: int) -> None:
+        assert max_jobs > 0
+        self._free = max_jobs
+        self._waiters = OrderedDict[str, deque[Future[None]]]()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(_) for _ in self._waiters.values())
+
+    @asynccontextmanager
+    async def slot(self, link_id: str) -> AsyncIterator[None]:
+        """
+        Holds a job slot for the duration of the context
+        :param link_id: id of the link the job belongs to
+        """
+        await self._acquire(link_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, link_id: str) -> None:
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        waiter = get_running_loop().create_future()
+        self._waiters.setdefault(link_id, deque()).append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # slot was already handed over
+                self._release()
+            else:
+                self._discard(link_id, waiter)
+            raise
+
+    def _discard(self, link_id: str, waiter: Future[None]) -> None:
+        link_waiters = self._waiters.get(link_id)
+        if link_waiters is not None and waiter in link_waiters:
+            link_waiters.remove(waiter)
+            if not link_waiters:
+                del self._waiters[link_id]
+
+    def _release(self) -> None:
+        while self._waiters:
+            # next link in turn, moved to the end of the queue after being served
+            link_id, link_waiters = next(iter(self._waiters.items()))
+            waiter = link_waiters.popleft()
+            if link_waiters:
+                self._waiters.move_to_end(link_id)
+            else:
+                del self._waiters[link_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+#
+#
+#########################################
@@ -0,0 +1,79 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+import time
+from typing import NamedTuple
+
+from .defs import SESSION_CACHE_MAX_AGE, SESSION_CACHE_VERSION, UTF8
+from .encryption import base64_url_decode, base64_url_encode, session_id_matches
+from .logging import Log
+
+__all__ = ('CachedSession', 'SessionCache')
+
+
+class CachedSession(NamedTuple):
+    sid: str
+    master_key: bytes
+    created: float  # unix time
+
+
+class SessionCache:
+    """
+    On-disk cache of anonymous session (session id and master key), lets repeated runs skip login.
+    Sessions older than `max_age` seconds or not matching their master key are discarded
+    """
+    def __init__(self, path: pathlib.Path, max_age: float = SESSION_CACHE_MAX_AGE) -> None:
+        self._path = path
+        self._max_age = max_age
+
+    def load(self) -> CachedSession | None:
+        try:
+            with open(self._path, 'rt', encoding=UTF8) as infile:
+                data = json.load(infile)
+            assert data['version'] == SESSION_CACHE_VERSION
+            session = CachedSession(str(data['sid']), base64_url_decode(data['master_key']), float(data['created']))
+            assert len(session.master_key) == 16
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            Log.warn(f'Session cache {self._path.name} is invalid ({e.__class__.__name__}), discarding...')
+            self.remove()
+            return None
+        if not 0.0 <= time.time() - session.created <= self._max_age:
+            Log.debug(f'Session cache {self._path.name} is expired, discarding...')
+            self.remove()
+            return None
+        if not session_id_matches(session.sid, session.master_key):
+            Log.warn(f'Session cache {self._path.name} does not match its master key, discarding...')
+            self.remove()
+            return None
+        return session
+
+    def save(self, sid: str, master_key: bytes) -> None:
+        data = {'version': SESSION_CACHE_VERSION, 'sid': sid, 'master_key': base64_url_encode(master_key), 'created': time.time()}
+        tmp_path = self._path.with_name(f'{self._path.name}.tmp')
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # session grants access to the account, keep it private
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wt', encoding=UTF8) as outfile:
+                json.dump(data, outfile)
+            tmp_path.replace(self._path)
+        except OSError as e:
+            Log.warn(f'Unable to save session cache {self._path.name}: {e!s}')
+
+    def remove(self) -> None:
+        self._path.unlink(missing_ok=True)
+
+#
+#
+#########################################
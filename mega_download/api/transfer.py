@@ -0,0 +1,100 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+import pathlib
+from asyncio import gather
+
+from .chunkgen import Chunk, Segment, check_file_mac, make_chunk_mac, make_chunk_segments
+from .containers import DownloadParams
+from .journal import ChunkJournal
+from .logging import Log
+from .mac_engine import MacEngine
+
+__all__ = ('TransferState',)
+
+
+class TransferState:
+    """
+    Shared state of a single file transfer, possibly split into multiple segments
+    """
+    __slots__ = ('bytes_written', 'chunk_macs', 'chunks', 'journal', 'params', 'segments')
+
+    def __init__(self, params: DownloadParams, num_segments: int, journal: ChunkJournal) -> None:
+        self.params = params
+        self.journal = journal
+        self.segments: list[Segment] = make_chunk_segments(params.file_size, num_segments)
+        self.chunks: list[Chunk] = [c for s in self.segments for c in s.chunks]
+        self.chunk_macs: list[bytes | None] = [None] * len(self.chunks)
+        self.bytes_written = 0
+
+    @property
+    def segmented(self) -> bool:
+        return len(self.segments) > 1
+
+    @property
+    def completed(self) -> bool:
+        return all(_ is not None for _ in self.chunk_macs)
+
+    async def resume(self, part_path: pathlib.Path, engine: MacEngine) -> int:
+        """
+        Restores completed chunks from journal. Journal entries are not ordered against data writes reaching the disk
+        and partial file is preallocated, so every journaled chunk is re-verified against partial file data (on engine workers)
+        :param part_path: partially downloaded file
+        :param engine: workers to read and MAC journaled chunks on
+        :returns number of bytes restored
+        """
+        chunk_macs = self.journal.load(self.params, self.chunks, part_path.stat().st_size if part_path.is_file() else 0)
+        if chunk_macs:
+            chunk_idxs = sorted(chunk_macs)
+            groups = [chunk_idxs[_::engine.workers] for _ in range(min(engine.workers, len(chunk_idxs)))]
+            verified = await gather(*(engine.run(self._verify_chunks, part_path, {i: chunk_macs[i] for i in g}) for g in groups))
+            num_journaled = len(chunk_macs)
+            chunk_macs = {i: m for group_macs in verified for i, m in group_macs.items()}
+            if len(chunk_macs) < num_journaled:
+                Log.warn(f'{part_path.name}: {num_journaled - len(chunk_macs):d} / {num_journaled:d} journaled chunks'
+                         f' do not match partial file data, discarded')
+        for chunk_idx, chunk_mac in chunk_macs.items():
+            self.chunk_macs[chunk_idx] = chunk_mac
+            self.bytes_written += self.chunks[chunk_idx].size
+        self.journal.open(self.params, self.chunks, chunk_macs)
+        return self.bytes_written
+
+    def _verify_chunks(self, part_path: pathlib.Path, chunk_macs: dict[int, bytes]) -> dict[int, bytes]:
+        """:returns journaled chunks matching partial file data, blocking"""
+        k_bytes, iv_bytes = self.params.k_decrypted, self.params.iv + self.params.iv
+        verified: dict[int, bytes] = {}
+        with open(part_path, 'rb') as infile:
+            for chunk_idx, chunk_mac in chunk_macs.items():
+                chunk = self.chunks[chunk_idx]
+                infile.seek(chunk.offset)
+                if make_chunk_mac(k_bytes, iv_bytes, infile.read(chunk.size)) == chunk_mac:
+                    verified[chunk_idx] = chunk_mac
+        return verified
+
+    def missing_chunks(self, segment: Segment) -> range | None:
+        """Returns first contiguous run of missing segment chunks (as absolute chunk indexes)"""
+        seg_range = range(segment.first_chunk, segment.first_chunk + len(segment.chunks))
+        first_idx = next((_ for _ in seg_range if self.chunk_macs[_] is None), None)
+        if first_idx is None:
+            return None
+        last_idx = next((_ for _ in range(first_idx, seg_range.stop) if self.chunk_macs[_] is not None), seg_range.stop)
+        return range(first_idx, last_idx)
+
+    def chunk_done(self, chunk_idx: int, chunk_mac: bytes) -> int:
+        self.chunk_macs[chunk_idx] = chunk_mac
+        self.journal.record(chunk_idx, self.chunks[chunk_idx], chunk_mac)
+        self.bytes_written += self.chunks[chunk_idx].size
+        return self.bytes_written
+
+    def check_mac(self) -> bool:
+        assert self.completed
+        return check_file_mac(self.params.k_decrypted, self.chunk_macs, self.params.meta_mac)
+
+#
+#
+#########################################
@@ -0,0 +1,142 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+from asyncio import Future, Task, create_task, get_running_loop
+from collections.abc import Awaitable, Callable, Sequence
+
+from .containers import File
+from .defs import API_BATCH_SIZE_MAX, DOWNLOAD_URL_LOOKAHEAD, DOWNLOAD_URL_MAX_AGE
+from .exceptions import RequestError
+
+__all__ = ('BatchUrlResolver', 'UrlBatchQuery')
+
+UrlBatchQuery = Callable[[list[str]], Awaitable[list[File | RequestError]]]
+'''query_batch(handles) -> file datas (or errors) in the same order'''
+
+
+class BatchUrlResolver:
+    """
+    Resolves download urls of files in batches, following download queue order.
+    Urls of the next `lookahead` queued files are resolved in background while current files are being transferred,
+    so transfer slots find their urls ready. Urls resolved more than `max_age` seconds ago are resolved again before use.
+    Url age is measured with `clock` (event loop time by default)
+    """
+    def __init__(
+        self, query_batch: UrlBatchQuery, handles: Sequence[str], *,
+        batch_size: int = API_BATCH_SIZE_MAX, lookahead: int = DOWNLOAD_URL_LOOKAHEAD, max_age: float = DOWNLOAD_URL_MAX_AGE,
+        clock: Callable[[], float] | None = None,
+    ) -> None:
+        self._query_batch = query_batch
+        self._handles = list(handles)
+        self._positions = {handle: pos for pos, handle in enumerate(self._handles)}
+        self._batch_size = batch_size
+        self._lookahead = lookahead
+        self._max_age = max_age
+        self._clock = clock
+        self._requested = set[str]()
+        self._futures = dict[str, Future[File]]()
+        self._resolved_at = dict[str, float]()
+        self._tasks = set[Task]()
+        self.batches = 0
+        self.refreshes = 0
+
+    async def resolve(self, handle: str) -> File:
+        """
+        :param handle: file handle, must be one of resolver handles
+        :returns file data containing download url ('g') and file size ('s')
+        """
+        position = self._positions[handle]
+        try:
+            while True:
+                if handle in self._resolved_at and self._now() - self._resolved_at[handle] > self._max_age:
+                    # waited in queue for too long, others resolved at the same time are likely expired too
+                    self._drop_expired(self._now())
+                    self.refreshes += 1
+                if handle not in self._requested:
+                    self._request_batch(position)
+                self._prefetch(position + 1)
+                try:
+                    file_data = await self._futures[handle]
+                except Exception:
+                    # failure is delivered once, next resolve requests it anew
+                    self._requested.discard(handle)
+                    raise
+                if self._now() - self._resolved_at[handle] <= self._max_age:
+                    return file_data
+        finally:
+            self._futures.pop(handle, None)
+            self._resolved_at.pop(handle, None)
+
+    def _now(self) -> float:
+        return self._clock() if self._clock else get_running_loop().time()
+
+    def _prefetch(self, position: int) -> None:
+        for handle in self._handles[position:position + self._lookahead]:
+            if handle not in self._requested:
+                self._request_batch(self._positions[handle])
+
+    def _drop_expired(self, now: float) -> None:
+        for handle, resolved_at in list(self._resolved_at.items()):
+            if now - resolved_at > self._max_age:
+                self._requested.discard(handle)
+                del self._futures[handle]
+                del self._resolved_at[handle]
+
+    def _request_batch(self, position: int) -> None:
+        batch: list[str] = []
+        for handle in self._handles[position:]:
+            if handle not in self._requested:
+                batch.append(handle)
+                if len(batch) >= self._batch_size:
+                    break
+        loop = get_running_loop()
+        for handle in batch:
+            self._requested.add(handle)
+            self._futures[handle] = loop.create_future()
+        task = create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.batches += 1
+
+    async def _run_batch(self, batch: list[str]) -> None:
+        try:
+            results = await self._query_batch(batch)
+            resolved_at = self._now()
+            for handle, result in zip(batch, results, strict=True):
+                future = self._futures.get(handle)
+                if future is None or future.done():
+                    # consumer was cancelled
+                    continue
+                if isinstance(result, RequestError):
+                    future.set_exception(result)
+                else:
+                    self._resolved_at[handle] = resolved_at
+                    future.set_result(result)
+        except BaseException as e:
+            for handle in batch:
+                future = self._futures.get(handle)
+                if future is None or future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            # handles left with no outcome to consume (consumer cancelled, batch cancelled) are requested anew by the next resolve
+            for handle in batch:
+                future = self._futures.get(handle)
+                if future is None or future.cancelled():
+                    self._requested.discard(handle)
+
+#
+#
+#########################################
@@ -10,7 +10,7 @@ import os
 from argparse import ONE_OR_MORE, ArgumentParser, Namespace
 from collections.abc import Sequence
 
-from .api import DOWNLOAD_MODE_DEFAULT, DOWNLOAD_MODES
+from .api import DOWNLOAD_MODE_DEFAULT, DOWNLOAD_MODES, FSYNC_MODE_DEFAULT, FSYNC_MODES, OVERWRITE_POLICIES
 from .config import Config
 from .defs import (
     ACTION_APPEND,
@@ -18,22 +18,33 @@ from .defs import (
     CONNECT_RETRIES_BASE,
     HELP_ARG_COOKIE,
     HELP_ARG_DMMODE,
+    HELP_ARG_DROP_CACHE,
     HELP_ARG_DUMP_LINKS,
     HELP_ARG_DUMP_STRUCTURE,
     HELP_ARG_FILE,
     HELP_ARG_FILTERS,
     HELP_ARG_HEADER,
     HELP_ARG_LINKS,
+    HELP_ARG_LISTING_CACHE,
+    HELP_ARG_LOG_JSON,
     HELP_ARG_LOGGING,
+    HELP_ARG_MANIFEST,
     HELP_ARG_MAXJOBS,
+    HELP_ARG_METRICS_JSON,
+    HELP_ARG_METRICS_PROMETHEUS,
     HELP_ARG_NOCOLORS,
+    HELP_ARG_OVERWRITE,
     HELP_ARG_PATH,
     HELP_ARG_PROXY,
     HELP_ARG_RETRIES,
+    HELP_ARG_SEGMENTS,
+    HELP_ARG_SESSION_CACHE,
+    HELP_ARG_SYNC_MODE,
     HELP_ARG_TIMEOUT,
     HELP_ARG_VERSION,
     LOGGING_FLAGS_DEFAULT,
     MAX_JOBS_DEFAULT,
+    SEGMENTS_DEFAULT,
 )
 from .logger import Log
 from .validators import (
@@ -44,9 +55,11 @@ from .validators import (
     valid_folder_path,
     valid_kwarg,
     valid_maxjobs,
+    valid_new_file_path,
     valid_pattern,
     valid_proxy,
     valid_range,
+    valid_segments,
     valid_timeout,
 )
 from .version import APP_NAME, APP_VERSION
@@ -116,9 +129,11 @@ def add_common_args(par: ArgumentParser) -> None:
     par.add_argument('-x', '--proxy', metavar='#type://[u:p@]a.d.d.r:port', default=None, help=HELP_ARG_PROXY, type=valid_proxy)
     par.add_argument('-t', '--timeout', metavar='#seconds', default=valid_timeout(''), help=HELP_ARG_TIMEOUT, type=valid_timeout)
     par.add_argument('-j', '--max-jobs', metavar='#number', default=MAX_JOBS_DEFAULT, help=HELP_ARG_MAXJOBS, type=valid_maxjobs)
+    par.add_argument('-sg', '--segments', metavar='#number', default=SEGMENTS_DEFAULT, help=HELP_ARG_SEGMENTS, type=valid_segments)
     par.add_argument('-r', '--retries', metavar='#number', default=CONNECT_RETRIES_BASE, help=HELP_ARG_RETRIES, type=positive_int)
     par.add_argument('-v', '--log-level', default=LOGGING_DEFAULT, help=HELP_ARG_LOGGING, type=log_level)
     par.add_argument('-g', '--disable-log-colors', action=ACTION_STORE_TRUE, help=HELP_ARG_NOCOLORS)
+    par.add_argument('-lj', '--log-json', metavar='#filepath', default=None, help=HELP_ARG_LOG_JSON, type=valid_new_file_path)
     par.add_argument('-h', '--header', metavar='#name=value', action=ACTION_APPEND, help=HELP_ARG_HEADER, type=valid_kwarg)
     par.add_argument('-c', '--cookie', metavar='#name=value', action=ACTION_APPEND, help=HELP_ARG_COOKIE, type=valid_kwarg)
     par.add_argument('-fu', '--filter-filenum', metavar='#min-max', default=None, help='', type=valid_range)
@@ -126,6 +141,15 @@ def add_common_args(par: ArgumentParser) -> None:
     par.add_argument('-fn', '--filter-filename', metavar='#pattern', default=None, help='', type=valid_pattern)
     par.add_argument('-fe', '--filter-extensions', metavar='#.EXT', action=ACTION_APPEND, help=HELP_ARG_FILTERS, type=valid_ext)
     par.add_argument('-d', '--download-mode', default=DM_DEFAULT, help=HELP_ARG_DMMODE, choices=DOWNLOAD_MODES)
+    par.add_argument('-sy', '--sync-mode', default=FSYNC_MODE_DEFAULT, help=HELP_ARG_SYNC_MODE, choices=FSYNC_MODES)
+    par.add_argument('-sc', '--session-cache', metavar='#filepath', default=None, help=HELP_ARG_SESSION_CACHE, type=valid_new_file_path)
+    par.add_argument('-lc', '--listing-cache', metavar='#folderpath', default=None, help=HELP_ARG_LISTING_CACHE, type=valid_folder_path)
+    par.add_argument('-mf', '--manifest', action=ACTION_STORE_TRUE, help=HELP_ARG_MANIFEST)
+    par.add_argument('-nc', '--drop-cache', action=ACTION_STORE_TRUE, help=HELP_ARG_DROP_CACHE)
+    par.add_argument('-mj', '--metrics-json', metavar='#filepath', default=None, help=HELP_ARG_METRICS_JSON, type=valid_new_file_path)
+    par.add_argument('-mp', '--metrics-prometheus', metavar='#filepath', default=None, help=HELP_ARG_METRICS_PROMETHEUS,
+                     type=valid_new_file_path)
+    par.add_argument('-ow', '--overwrite', default=None, help=HELP_ARG_OVERWRITE, choices=OVERWRITE_POLICIES)
 
 
 def parse_arglist(args: Sequence[str]) -> Namespace:
@@ -37,11 +37,21 @@ class BaseConfig:
         self.links_file: pathlib.Path | None = None
         self.links: list[str] | None = None
         self.max_jobs: int | None = None
+        self.segments: int | None = None
+        self.sync_mode: str | None = None
+        self.drop_cache: bool | None = None
+        self.session_cache: pathlib.Path | None = None
+        self.listing_cache: pathlib.Path | None = None
+        self.manifest: bool | None = None
+        self.overwrite: str | None = None
+        self.metrics_json: pathlib.Path | None = None
+        self.metrics_prometheus: pathlib.Path | None = None
         # common
         self.dest_base: pathlib.Path | None = None
         self.proxy: str | None = None
         self.download_mode: str | None = None
         self.logging_flags: int = 0
+        self.log_json: pathlib.Path | None = None
         self.nocolors: bool | None = None
         self.timeout: ClientTimeout | None = None
         self.retries: int = 0
@@ -64,10 +74,20 @@ class BaseConfigContainer(Protocol):
     links_file: pathlib.Path | None
     links: list[str] | None
     max_jobs: int | None
+    segments: int | None
+    sync_mode: str | None
+    drop_cache: bool | None
+    session_cache: pathlib.Path | None
+    listing_cache: pathlib.Path | None
+    manifest: bool | None
+    overwrite: str | None
+    metrics_json: pathlib.Path | None
+    metrics_prometheus: pathlib.Path | None
     dest_base: pathlib.Path | None
     proxy: str | None
     download_mode: str | None
     logging_flags: int
+    log_json: pathlib.Path | None
     nocolors: bool | None
     timeout: ClientTimeout | None
     retries: int
@@ -17,10 +17,13 @@ CONNECT_TIMEOUT_BASE = 10
 CONNECT_TIMEOUT_SOCKET_READ = 30
 MAX_JOBS_DEFAULT = 2
 MAX_JOBS_MAX = 8
+SEGMENTS_DEFAULT = 1
+SEGMENTS_MAX = 16
 
 SCAN_CANCEL_KEYSTROKE = 'q'
 SCAN_CANCEL_KEYCOUNT = 2
 SLASH = '/'
+LOG_BATCH_SIZE_MAX = 0x100  # log records written at once
 UTF8 = 'utf-8'
 
 
@@ -64,11 +67,30 @@ HELP_ARG_LOGGING = (
     f' All messages equal or above this level will be logged. Default is \'info\''
 )
 HELP_ARG_NOCOLORS = 'Disable logging level dependent colors in log'
+HELP_ARG_LOG_JSON = 'Also append logged messages to this file, as JSON lines'
 HELP_ARG_HEADER = 'Append additional header. Can be used multiple times'
 HELP_ARG_COOKIE = 'Append additional cookie. Can be used multiple times'
 HELP_ARG_TIMEOUT = f'Connection timeout (in seconds). Default is \'{CONNECT_TIMEOUT_BASE:d}\''
 HELP_ARG_MAXJOBS = f'Maximum simultaneous connections, 1..{MAX_JOBS_MAX:d}'
 HELP_ARG_RETRIES = f'Connection retries count. Default is \'{CONNECT_RETRIES_BASE:d}\''
+HELP_ARG_SEGMENTS = (
+    f'Maximum simultaneous connections per single file, 1..{SEGMENTS_MAX:d}.'
+    f' Large files are split into byte ranges downloaded in parallel. Default is \'{SEGMENTS_DEFAULT:d}\''
+)
+HELP_ARG_SYNC_MODE = (
+    'Flush downloaded data to disk: \'never\' (leave it to OS), \'close\' (once file is finished)'
+    ' or \'periodic\' (every 64 MB written). Default is \'never\''
+)
+HELP_ARG_SESSION_CACHE = 'Store anonymous session in this file and reuse it in subsequent runs, skipping login'
+HELP_ARG_MANIFEST = 'Keep a manifest of downloaded files in destination folder, files left unchanged since last run are skipped without checking'
+HELP_ARG_LISTING_CACHE = 'Store decrypted folder listings in this folder, subsequent runs only decrypt new or changed nodes'
+HELP_ARG_DROP_CACHE = 'Do not keep downloaded data in OS page cache (posix only). Useful for very large downloads'
+HELP_ARG_METRICS_JSON = 'Write run metrics (stage latency histograms, retries, quota waits) summary to this file as JSON once finished'
+HELP_ARG_METRICS_PROMETHEUS = 'Write run metrics to this file in Prometheus text format once finished, i.e. for node exporter textfile collector'
+HELP_ARG_OVERWRITE = (
+    'What to do with already existing files: \'ask\' for each one, overwrite \'all\', overwrite \'none\''
+    ' or overwrite only files of \'mismatch\'ing size. Default is \'mismatch\''
+)
 # New
 HELP_ARG_FILE = 'Full path to saved links file'
 HELP_ARG_FILTERS = 'Available filters: file number is queue (order is always the same), file size (MB), file name (pattern)'
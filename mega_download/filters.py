@@ -6,9 +6,10 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+import re
 from typing import Final
 
-from .api import File, Mem, NumRange
+from .api import File, Mem, NodeCheck, NumRange
 from .util import build_regex_from_pattern
 
 
@@ -23,6 +24,13 @@ class FileNumFilter:
         file_num = file['num_in_queue']
         return not self._range.min <= file_num <= self._range.max
 
+    def compile(self) -> NodeCheck:
+        num_min, num_max = self._range
+
+        def check(_file_name: str, _file_size: int, file_num: int) -> bool:
+            return not num_min <= file_num <= num_max
+        return check
+
     def __str__(self) -> str:
         return f'{self.__class__.__name__}<{self._range!s}>'
 
@@ -35,11 +43,20 @@ class FileSizeFilter:
 
     def __init__(self, irange: NumRange) -> None:
         self._range = irange
+        # bounds in bytes, file sizes are compared as is
+        self._size_min = irange.min * FileSizeFilter.resolution
+        self._size_max = irange.max * FileSizeFilter.resolution
 
     def filters_out(self, file: File) -> bool:
         file_size = file['s']
-        file_size /= FileSizeFilter.resolution
-        return not self._range.min <= file_size <= self._range.max
+        return not self._size_min <= file_size <= self._size_max
+
+    def compile(self) -> NodeCheck:
+        size_min, size_max = self._size_min, self._size_max
+
+        def check(_file_name: str, file_size: int, _file_num: int) -> bool:
+            return not size_min <= file_size <= size_max
+        return check
 
     def __str__(self) -> str:
         return f'{self.__class__.__name__}<{self._range!s}>'
@@ -51,10 +68,18 @@ class FileNameFilter:
     """
     def __init__(self, pattern: str) -> None:
         self._regex = build_regex_from_pattern(pattern)
+        self._match = re.compile(rf'(?:{self._regex.pattern})\Z', self._regex.flags).match
 
     def filters_out(self, file: File) -> bool:
         file_name = file['attributes']['n']
-        return self._regex.fullmatch(file_name) is None
+        return self._match(file_name) is None
+
+    def compile(self) -> NodeCheck:
+        match = self._match
+
+        def check(file_name: str, _file_size: int, _file_num: int) -> bool:
+            return match(file_name) is None
+        return check
 
     def __str__(self) -> str:
         return f'{self.__class__.__name__}<{self._regex.pattern!s}>'
@@ -66,10 +91,31 @@ class FileExtFilter:
     """
     def __init__(self, extensions: list[str]) -> None:
         self._extensions = extensions
+        self._check = self._make_check(frozenset(extensions))
+
+    @staticmethod
+    def _make_check(suffixes: frozenset[str]) -> NodeCheck:
+        if '' in suffixes:
+            return lambda _file_name, _file_size, _file_num: False
+        if all(_[0] == '.' and '.' not in _[1:] for _ in suffixes):
+            # '.ext' form: name ends with one of extensions if its last dot suffix is in the set
+            def check_last_dot(file_name: str, _file_size: int, _file_num: int) -> bool:
+                return file_name[file_name.rfind('.'):] not in suffixes
+            return check_last_dot
+
+        # name ends with one of extensions if its suffix of that extension length is in the set
+        lengths = tuple(sorted({-len(_) for _ in suffixes}))
+
+        def check(file_name: str, _file_size: int, _file_num: int) -> bool:
+            return all(file_name[length:] not in suffixes for length in lengths)
+        return check
 
     def filters_out(self, file: File) -> bool:
         file_name = file['attributes']['n']
-        return not any(file_name.endswith(_) for _ in self._extensions)
+        return self._check(file_name, 0, 0)
+
+    def compile(self) -> NodeCheck:
+        return self._check
 
     def __str__(self) -> str:
         return f'{self.__class__.__name__}<{self._extensions!s}>'
@@ -14,6 +14,7 @@ import sys
 from contextlib import AbstractAsyncContextManager
 
 from .api import SITE_PRIMARY, DownloadParams, DownloadParamsDump, FileSystemDump
+from .api.encryption import unpack_sequence
 from .config import Config
 from .defs import SLASH, UTF8
 from .logger import Log
@@ -62,15 +63,16 @@ class DumpLinksCallback(DownloadParamsCallback):
     def execute(self, url: str, download_params: DownloadParams) -> None:
         if url not in self._json:
             self._json[url] = []
+        # keys are dumped as int lists, dump format predates bytes keys
         self._json[url].append(DownloadParams(
             download_params.index,
             download_params.original_pos,
             download_params.direct_file_url,
             download_params.output_path.relative_to(Config.dest_base),
             download_params.file_size,
-            download_params.iv,
-            download_params.meta_mac,
-            download_params.k_decrypted,
+            (*unpack_sequence(download_params.iv), 0, 0),
+            unpack_sequence(download_params.meta_mac),
+            unpack_sequence(download_params.k_decrypted),
         ))
 
     def __str__(self) -> str:
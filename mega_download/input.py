@@ -11,6 +11,8 @@ from collections.abc import Callable
 from contextlib import contextmanager, nullcontext
 from platform import system
 
+from .api import PromptBroker
+
 __all__ = ('wait_for_key',)
 
 if system() == 'Windows':
@@ -42,24 +44,29 @@ else:
     next_input = functools.partial(sys.stdin.read, 1)
 
 
-async def wait_for_key(key: str, count: int, callback: Callable[[], None]) -> None:
+async def wait_for_key(key: str, count: int, callback: Callable[[], None], prompts: PromptBroker | None = None) -> None:
     try:
         stroke_sequence: list[str] = []
-        with set_terminal_raw():
-            while stroke_sequence != [key] * count:
-                await sleep(1.0)
-                if not input_ready():
-                    stroke_sequence.clear()
-                    continue
-                while input_ready():
-                    ch = next_input()
-                    if ch == key:
-                        stroke_sequence.append(ch)
-                    else:
+        while stroke_sequence != [key] * count:
+            if prompts is not None and prompts.prompting:
+                # terminal is handed over while questions are asked, keystrokes typed meanwhile are answers
+                stroke_sequence.clear()
+                await prompts.wait_idle()
+            with set_terminal_raw(), (prompts.holding_terminal() if prompts is not None else nullcontext()):
+                while stroke_sequence != [key] * count and not (prompts is not None and prompts.prompting):
+                    await sleep(1.0)
+                    if not input_ready():
                         stroke_sequence.clear()
-                        while input_ready():
-                            next_input()
-            callback()
+                        continue
+                    while input_ready():
+                        ch = next_input()
+                        if ch == key:
+                            stroke_sequence.append(ch)
+                        else:
+                            stroke_sequence.clear()
+                            while input_ready():
+                                next_input()
+        callback()
     except CancelledError:
         pass
 
@@ -6,13 +6,155 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import pathlib
+import sys
+import time
+from collections.abc import Callable
 from locale import getpreferredencoding
+from queue import SimpleQueue
+from threading import Event, Lock, Thread
+from typing import NamedTuple, TextIO, TypeAlias
 
 from colorama import Fore
 from colorama import init as colorama_init
 
 from .config import Config
-from .defs import UTF8, LoggingFlags
+from .defs import LOG_BATCH_SIZE_MAX, UTF8, LoggingFlags
+
+LogMessage: TypeAlias = str | Callable[[], str]
+'''Message text, or a callable making it. Callable is only called if message is going to be logged'''
+
+
+class LogRecord(NamedTuple):
+    time: float
+    flags: LoggingFlags
+    text: str
+
+
+class LogWriter:
+    """
+    Writes log records to console (and JSON-lines file, if set) in a background thread.
+    Records logged while previous batch is being written are written together as next batch.
+    Output errors (e.g. closed pipe) only drop the failed batch. If writer thread is gone records are written inline
+    """
+    def __init__(self) -> None:
+        self._queue = SimpleQueue[LogRecord | Event | None]()
+        self._thread: Thread | None = None
+        self._lock = Lock()
+        self._queue_lock = Lock()
+        self._stopped = False
+        self._json_file: TextIO | None = None
+
+    def put(self, record: LogRecord) -> None:
+        if self._thread is None:
+            self._start()
+        if not self._enqueue(record):
+            self._write_batch([record])
+
+    def flush(self) -> None:
+        """Waits for all records logged so far to be written"""
+        if self._thread is not None:
+            written = Event()
+            if self._enqueue(written):
+                written.wait()
+
+    def _enqueue(self, item: LogRecord | Event | None) -> bool:
+        """:returns False if writer thread no longer takes items"""
+        with self._queue_lock:
+            if not self._stopped:
+                self._queue.put(item)
+            return not self._stopped
+
+    def close(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                self._enqueue(None)
+                self._thread.join()
+                self._thread = None
+            self.set_json_sink(None)
+
+    def set_json_sink(self, path: pathlib.Path | None) -> None:
+        """Appends log records to this file as JSON lines, None to stop"""
+        self.flush()
+        if self._json_file is not None:
+            self._json_file.close()
+            self._json_file = None
+        if path is not None:
+            self._json_file = path.open('at', encoding=UTF8)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = Thread(target=self._run, name='LogWriter', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < LOG_BATCH_SIZE_MAX and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                try:
+                    self._write_batch([_ for _ in batch if isinstance(_, LogRecord)])
+                finally:
+                    for item in batch:
+                        if isinstance(item, Event):
+                            item.set()
+                if any(item is None for item in batch):
+                    break
+        finally:
+            # nothing waits on a stopped writer: later records are written inline, pending flushes are released
+            with self._queue_lock:
+                self._stopped = True
+            while not self._queue.empty():
+                if isinstance(item := self._queue.get_nowait(), Event):
+                    item.set()
+                elif isinstance(item, LogRecord):
+                    self._write_batch([item])
+
+    def _write_batch(self, records: list[LogRecord]) -> None:
+        """Writes records, output errors drop them"""
+        if not records:
+            return
+        try:
+            self._write_console(records)
+        except Exception:
+            pass
+        if self._json_file is not None:
+            try:
+                self._write_json(records)
+            except Exception:
+                pass
+
+    @staticmethod
+    def _write_console(records: list[LogRecord]) -> None:
+        texts = [_.text if Config.nocolors else Log.colorize(_.text, _.flags) for _ in records]
+        try:
+            sys.stdout.write('\n'.join((*texts, '')))
+        except UnicodeError:
+            for text in texts:
+                try:
+                    sys.stdout.write(f'{text}\n')
+                except UnicodeError:
+                    try:
+                        text = text.encode(UTF8, errors=Log.ERR_POLICY).decode(getpreferredencoding(), errors=Log.ERR_POLICY)
+                        sys.stdout.write(f'{text}\n')
+                    except Exception:
+                        sys.stdout.write('<Message was not logged due to UnicodeError>\n')
+        sys.stdout.flush()
+
+    def _write_json(self, records: list[LogRecord]) -> None:
+        self._json_file.write(''.join(
+            f'{json.dumps({"time": _.time, "level": Log.level_of(_.flags).name, "message": _.text}, ensure_ascii=False)}\n'
+            for _ in records))
+        self._json_file.flush()
 
 
 class Log:
@@ -33,58 +175,68 @@ class Log:
 
     ERR_POLICY = 'backslashreplace'
 
+    writer = LogWriter()
+
     @staticmethod
     def init() -> None:
         if not Config.nocolors:
             colorama_init()
 
+    @staticmethod
+    @functools.cache
+    def level_of(flags: LoggingFlags) -> LoggingFlags:
+        """:returns highest log level in flags, NONE if there is none"""
+        return next((f for f in reversed(Log.COLORS.keys()) if f & flags), LoggingFlags.NONE)
+
+    @staticmethod
+    def colorize(text: str, flags: LoggingFlags) -> str:
+        level = Log.level_of(flags)
+        return f'{Log.COLORS[level]}{text}{Fore.RESET}' if level else text
+
     @staticmethod
     def should_log(flags: LoggingFlags) -> bool:
         return flags >= Config.logging_flags and not Log._disabled
 
     @staticmethod
-    def log(text: str, flags: LoggingFlags) -> None:
-        # if flags & LoggingFlags.FATAL == 0 and Config.logging_flags & flags != flags:
+    def log(message: LogMessage, flags: LoggingFlags) -> None:
         if not Log.should_log(flags):
             return
 
-        if not Config.nocolors:
-            for f in reversed(Log.COLORS.keys()):
-                if f & flags:
-                    text = f'{Log.COLORS[f]}{text}{Fore.RESET}'
-                    break
+        Log.writer.put(LogRecord(time.time(), flags, message if isinstance(message, str) else message()))
+        if flags & LoggingFlags.FATAL:
+            Log.writer.flush()
 
-        try:
-            print(text)
-        except UnicodeError:
-            try:
-                print(text.encode(UTF8, errors=Log.ERR_POLICY).decode(getpreferredencoding(), errors=Log.ERR_POLICY))
-            except Exception:
-                print('<Message was not logged due to UnicodeError>')
+    @staticmethod
+    def flush() -> None:
+        Log.writer.flush()
+
+    @staticmethod
+    def set_json_sink(path: pathlib.Path | None) -> None:
+        Log.writer.set_json_sink(path)
 
     @staticmethod
-    def fatal(text: str) -> None:
-        return Log.log(text, LoggingFlags.FATAL)
+    def fatal(message: LogMessage) -> None:
+        return Log.log(message, LoggingFlags.FATAL)
 
     @staticmethod
-    def error(text: str, extra_flags=LoggingFlags.NONE) -> None:
-        return Log.log(text, LoggingFlags.ERROR | extra_flags)
+    def error(message: LogMessage, extra_flags=LoggingFlags.NONE) -> None:
+        return Log.log(message, LoggingFlags.ERROR | extra_flags)
 
     @staticmethod
-    def warn(text: str, extra_flags=LoggingFlags.NONE) -> None:
-        return Log.log(text, LoggingFlags.WARN | extra_flags)
+    def warn(message: LogMessage, extra_flags=LoggingFlags.NONE) -> None:
+        return Log.log(message, LoggingFlags.WARN | extra_flags)
 
     @staticmethod
-    def info(text: str, extra_flags=LoggingFlags.NONE) -> None:
-        return Log.log(text, LoggingFlags.INFO | extra_flags)
+    def info(message: LogMessage, extra_flags=LoggingFlags.NONE) -> None:
+        return Log.log(message, LoggingFlags.INFO | extra_flags)
 
     @staticmethod
-    def debug(text: str, extra_flags=LoggingFlags.NONE) -> None:
-        return Log.log(text, LoggingFlags.DEBUG | extra_flags)
+    def debug(message: LogMessage, extra_flags=LoggingFlags.NONE) -> None:
+        return Log.log(message, LoggingFlags.DEBUG | extra_flags)
 
     @staticmethod
-    def trace(text: str, extra_flags=LoggingFlags.NONE) -> None:
-        return Log.log(text, LoggingFlags.TRACE | extra_flags)
+    def trace(message: LogMessage, extra_flags=LoggingFlags.NONE) -> None:
+        return Log.log(message, LoggingFlags.TRACE | extra_flags)
 
 #
 #
@@ -7,6 +7,7 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 
 import itertools
+import json
 import pathlib
 import sys
 from asyncio import get_running_loop, run, sleep
@@ -15,7 +16,21 @@ from contextlib import AsyncExitStack
 
 from aiohttp import ClientTimeout
 
-from .api import DownloadMode, DownloadParamsCallback, FileSystemCallback, Mega, MegaNZError, MegaOptions
+from .api import (
+    API_REQUEST_RATE,
+    FSYNC_MODE_DEFAULT,
+    STORAGE_REQUEST_RATE,
+    DownloadMode,
+    DownloadParamsCallback,
+    FileSystemCallback,
+    FsyncMode,
+    Mega,
+    MegaNZError,
+    MegaOptions,
+    OutputPolicy,
+    OverwritePolicy,
+    PromptBroker,
+)
 from .cmdargs import HelpPrintExitException, prepare_arglist
 from .config import BaseConfigContainer, Config
 from .defs import (
@@ -27,6 +42,7 @@ from .defs import (
     MIN_PYTHON_VERSION_STR,
     SCAN_CANCEL_KEYCOUNT,
     SCAN_CANCEL_KEYSTROKE,
+    SEGMENTS_DEFAULT,
     LoggingFlags,
 )
 from .filters import FileExtFilter, FileNameFilter, FileNumFilter, FileSizeFilter
@@ -49,17 +65,32 @@ def at_startup() -> None:
     Log.debug(f'Python {sys.version}\n{APP_NAME} ver {APP_VERSION}\nCommand-line args: {" ".join(sys.argv)}')
 
 
+def write_metrics(mega: Mega) -> None:
+    metrics = mega.metrics
+    Log.debug(lambda: f'Run metrics: {json.dumps(metrics.summary())}')
+    if Config.metrics_json:
+        metrics.write_json(Config.metrics_json)
+    if Config.metrics_prometheus:
+        metrics.write_prometheus(Config.metrics_prometheus)
+
+
 def make_mega_options(
     before_download_callbacks: Iterable[DownloadParamsCallback] = (),
     after_scan_callbacks: Iterable[FileSystemCallback] = (),
+    prompts: PromptBroker | None = None,
 ) -> MegaOptions:
     options = MegaOptions(
         dest_base=Config.dest_base,
         retries=Config.retries,
         max_jobs=Config.max_jobs,
+        segments=Config.segments,
         timeout=Config.timeout,
         nodelay=Config.nodelay,
+        api_request_rate=API_REQUEST_RATE,
+        storage_request_rate=STORAGE_REQUEST_RATE,
         noconfirm=Config.noconfirm,
+        overwrite_policy=OverwritePolicy(Config.overwrite) if Config.overwrite else None,
+        prompts=prompts,
         proxy=Config.proxy,
         extra_headers=Config.extra_headers,
         extra_cookies=Config.extra_cookies,
@@ -70,6 +101,11 @@ def make_mega_options(
             *((FileExtFilter(Config.filter_extensions),) if Config.filter_extensions else ()),
         ),
         download_mode=DownloadMode(Config.download_mode),
+        output_policy=OutputPolicy(fsync_mode=FsyncMode(Config.sync_mode), drop_cache=Config.drop_cache),
+        output_backend=None,
+        session_cache=Config.session_cache,
+        listing_cache=Config.listing_cache,
+        manifest=Config.manifest,
         hooks_before_download=tuple(before_download_callbacks),
         hooks_after_scan=tuple(after_scan_callbacks),
         logger=Log,
@@ -85,41 +121,68 @@ class MegaDownloader:
     def __init__(self, links: list[str], base_config: BaseConfigContainer) -> None:
         self._links = links
         self._config = base_config
+        self.link_results: list[tuple[str, tuple[pathlib.Path, ...] | Exception]] = []
 
     async def run(self) -> list[pathlib.Path]:
         Config.links = self._links or []
         Config.dest_base = self._config.dest_base
         Config.max_jobs = self._config.max_jobs or MAX_JOBS_DEFAULT
+        Config.segments = getattr(self._config, 'segments', None) or SEGMENTS_DEFAULT
         Config.proxy = self._config.proxy or ''
         Config.timeout = self._config.timeout or MegaDownloader._client_timeout_default
         Config.retries = self._config.retries or CONNECT_RETRIES_BASE
         Config.extra_headers = self._config.extra_headers or []
         Config.extra_cookies = self._config.extra_cookies or []
         Config.download_mode = self._config.download_mode or DownloadMode.FULL.value
+        Config.sync_mode = getattr(self._config, 'sync_mode', None) or FSYNC_MODE_DEFAULT
+        Config.drop_cache = getattr(self._config, 'drop_cache', None) or False
+        Config.session_cache = getattr(self._config, 'session_cache', None)
+        Config.listing_cache = getattr(self._config, 'listing_cache', None)
+        Config.manifest = getattr(self._config, 'manifest', None) or False
+        Config.overwrite = getattr(self._config, 'overwrite', None)
+        Config.metrics_json = getattr(self._config, 'metrics_json', None)
+        Config.metrics_prometheus = getattr(self._config, 'metrics_prometheus', None)
         Config.logging_flags = self._config.logging_flags or LoggingFlags.INFO.value
+        Config.log_json = getattr(self._config, 'log_json', None)
         Config.filter_filesize = self._config.filter_filesize
         Config.filter_filename = self._config.filter_filename
         Config.filter_extensions = self._config.filter_extensions
         Config.nocolors = self._config.nocolors or False
         Config.nodelay = self._config.nodelay or False
         Config.noconfirm = getattr(self._config, 'noconfirm', True)
+        if Config.log_json:
+            Log.set_json_sink(Config.log_json)
 
         if not Config.links:
             Log.error('Nothing to process, aborted')
             return []
         before_download_callbacks, after_scan_callbacks = create_callbacks()
-        mega = Mega(make_mega_options(before_download_callbacks, after_scan_callbacks))
-        abort_waiter = get_running_loop().create_task(wait_for_key(SCAN_CANCEL_KEYSTROKE, SCAN_CANCEL_KEYCOUNT, mega.abort))
+        prompts = PromptBroker()
+        mega = Mega(make_mega_options(before_download_callbacks, after_scan_callbacks, prompts))
+        abort_waiter = get_running_loop().create_task(wait_for_key(SCAN_CANCEL_KEYSTROKE, SCAN_CANCEL_KEYCOUNT, mega.abort, prompts))
 
         async with AsyncExitStack() as ctx:
             await ctx.enter_async_context(mega)
             [await ctx.enter_async_context(_) for _ in before_download_callbacks]
             [await ctx.enter_async_context(_) for _ in after_scan_callbacks]
-            results = [await mega.download_url(_) for _ in Config.links]
+            # links are processed concurrently, sharing download jobs budget
+            results = await mega.download_urls(Config.links)
         abort_waiter.cancel()
         await abort_waiter
+        write_metrics(mega)
+
+        self.link_results = list(zip(Config.links, results, strict=True))
+        for link, result in self.link_results:
+            if isinstance(result, MegaNZError):
+                Log.error(f'{link}: {result.__class__.__name__}: {result!s}')
+            elif isinstance(result, Exception):
+                import traceback
+                Log.error(f'{link}: unhandled exception {result.__class__.__name__}!\n{"".join(traceback.format_exception(result))}')
+        return list(itertools.chain(*(_ for _ in results if not isinstance(_, Exception))))
 
-        return list(itertools.chain(*results))
+    @property
+    def failed_links(self) -> list[tuple[str, Exception]]:
+        return [(link, result) for link, result in self.link_results if isinstance(result, Exception)]
 
 
 async def main(args: Sequence[str]) -> int:
@@ -132,6 +195,9 @@ async def main(args: Sequence[str]) -> int:
         mega = MegaDownloader(Config.links, Config)
         results = await mega.run()
         Log.info('\n'.join(('\n', *(_.name for _ in results))) or '\nNothing')
+        if failed_links := mega.failed_links:
+            Log.error(f'{len(failed_links):d} / {len(mega.link_results):d} links failed')
+            return -2 if all(isinstance(e, MegaNZError) for _, e in failed_links) else -3
         return 0
     except MegaNZError:
         import traceback
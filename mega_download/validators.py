@@ -18,6 +18,7 @@ from .defs import (
     CONNECT_TIMEOUT_SOCKET_READ,
     LOGGING_FLAGS,
     MAX_JOBS_MAX,
+    SEGMENTS_MAX,
     NumRange,
 )
 from .logger import Log
@@ -74,6 +75,13 @@ def valid_file_path(pathstr: str) -> pathlib.Path:
     return valid_path(pathstr, is_file=True)
 
 
+def valid_new_file_path(pathstr: str) -> pathlib.Path:
+    newpath = valid_path(pathstr, is_file=False)
+    if newpath.is_dir():
+        raise ArgumentError
+    return newpath
+
+
 def valid_proxy(prox: str) -> str:
     from ctypes import c_uint16, sizeof
     try:
@@ -134,6 +142,10 @@ def valid_maxjobs(maxjobs_str: str) -> int:
     return valid_number(maxjobs_str, lb=1, ub=MAX_JOBS_MAX)
 
 
+def valid_segments(segments_str: str) -> int:
+    return valid_number(segments_str, lb=1, ub=SEGMENTS_MAX)
+
+
 def valid_range(range_str: str) -> NumRange:
     try:
         range_str = range_str or f'0-{2 ** 40:d}'
@@ -6,17 +6,89 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+from __future__ import annotations
+
+import asyncio
+import base64
 import functools
+import io
+import json
+import os
 import pathlib
-from collections.abc import Callable
+import random
+import sys
+import threading
+from collections.abc import AsyncIterator, Callable
 from tempfile import TemporaryDirectory
 from unittest import TestCase
 
+from aiohttp import ClientTimeout, web
+from Crypto.Cipher import AES
+
 from mega_download import APP_NAME, main_sync
-from mega_download.api import DownloadMode, RequestQueue
+from mega_download.api import (
+    AioFileOutputBackend,
+    DownloadMode,
+    DownloadParams,
+    File,
+    FsyncMode,
+    Mega,
+    MegaOptions,
+    Mem,
+    NumRange,
+    OutputPolicy,
+    OverwritePolicy,
+    PosixOutputBackend,
+    ProgressEvent,
+    ProgressEventType,
+    ProgressTracker,
+    PromptBroker,
+    RequestQueue,
+    TokenBucket,
+)
+from mega_download.api.buffers import BufferPool
+from mega_download.api.chunkgen import condense_chunk_macs, make_chunk_generator, make_chunk_mac, make_chunk_segments
+from mega_download.api.containers import ParsedUrl
+from mega_download.api.context import LinkContext
+from mega_download.api.defs import MANIFEST_FILE_NAME, PIPELINE_BUFFERS_PER_TRANSFER, SITE_API
+from mega_download.api.encryption import (
+    base64_to_ints,
+    base64_url_decode,
+    base64_url_encode,
+    decrypt_attr,
+    decrypt_key,
+    encrypt_key,
+    hashcash_nonce_matches,
+    ints_to_base64,
+    make_hashcash_buffer,
+    pack_sequence,
+    parse_hashcash_challenge,
+    unpack_sequence,
+    xor_key_halves,
+)
+from mega_download.api.exceptions import MegaErrorCodes, RequestError
+from mega_download.api.filters import FilterPipeline
+from mega_download.api.hashcash import HashcashSolver
+from mega_download.api.journal import ChunkJournal
+from mega_download.api.listing_stream import ListingStreamParser
+from mega_download.api.logging import Log as ApiLog
+from mega_download.api.logging import set_logger
+from mega_download.api.mac_engine import ChunkMacQueue, MacEngine
+from mega_download.api.manifest import DownloadManifest, ManifestEntry
+from mega_download.api.metrics import Histogram
+from mega_download.api.node_decryptor import EncryptedNode, NodeDecryptor
+from mega_download.api.node_table import NodeTable
+from mega_download.api.output import OutputFile
+from mega_download.api.pipeline import TransferPipeline
+from mega_download.api.process_pool import ProcessPool
+from mega_download.api.scheduler import JobScheduler
+from mega_download.api.session_cache import SessionCache
+from mega_download.api.transfer import TransferState
+from mega_download.api.url_resolver import BatchUrlResolver
 from mega_download.config import Config
 from mega_download.defs import LoggingFlags
-from mega_download.logger import Log
+from mega_download.filters import FileExtFilter, FileNameFilter, FileNumFilter, FileSizeFilter
+from mega_download.logger import Log, LogRecord, LogWriter
 from mega_download.util import compose_link_v2
 
 RUN_CONN_TESTS = 0
@@ -29,7 +101,6 @@ def test_prepare(log=False) -> Callable[[], Callable[[], None]]:
             def set_up_test() -> None:
                 Log._disabled = not log
                 Config._reset()
-                RequestQueue._reset()
             set_up_test()
             test_func(*args, **kwargs)
         return invoke_test
@@ -43,6 +114,1083 @@ class CmdTests(TestCase):
         print(f'{self._testMethodName} passed')
 
 
+class LogCollector:
+    messages: list[str] = []
+
+    @staticmethod
+    def log(text: str) -> None:
+        LogCollector.messages.append(text)
+
+    fatal = error = warn = info = debug = trace = log
+
+
+class LocalStorage:
+    """Local stand-in for mega.nz storage host, serves single encrypted file supporting byte ranges"""
+    def __init__(self, size: int) -> None:
+        self.plain = os.urandom(size)
+        self.key = os.urandom(16)
+        self.iv = os.urandom(8)
+        self.encrypted = AES.new(self.key, AES.MODE_CTR, nonce=self.iv, initial_value=0).encrypt(self.plain)
+        chunk_macs = [make_chunk_mac(self.key, self.iv + self.iv, self.plain[c.offset:c.offset + c.size])
+                      for c in make_chunk_generator(size)]
+        self.meta_mac = condense_chunk_macs(self.key, chunk_macs)
+        self.requests: list[str] = []
+        self.data_limit = size  # data beyond this offset is never served, responses are cut short
+        self._runner: web.AppRunner | None = None
+        self.url = ''
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        range_header = request.headers.get('Range', '')
+        self.requests.append(range_header)
+        if range_header:
+            start, end = (int(_) for _ in range_header.removeprefix('bytes=').split('-'))
+            return web.Response(body=self.encrypted[start:min(end + 1, self.data_limit)], status=206)
+        return web.Response(body=self.encrypted[:self.data_limit])
+
+    async def __aenter__(self) -> LocalStorage:
+        app = web.Application()
+        app.router.add_get('/dl', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{self._runner.addresses[0][1]:d}/dl'
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self._runner.cleanup()
+
+
+def make_local_options(dest_base: pathlib.Path, **kwargs) -> MegaOptions:
+    options = MegaOptions(
+        dest_base=dest_base, retries=2, max_jobs=4, segments=1, timeout=ClientTimeout(total=None, connect=5, sock_read=5.0),
+        nodelay=True, api_request_rate=0.0, storage_request_rate=0.0, noconfirm=True, overwrite_policy=None, prompts=None, proxy='',
+        extra_headers=[], extra_cookies=[], filters=(), hooks_before_download=(), hooks_after_scan=(), download_mode=DownloadMode.FULL,
+        output_policy=OutputPolicy(), output_backend=None, session_cache=None, listing_cache=None, manifest=False, logger=LogCollector,
+    )
+    options.update(kwargs)
+    return options
+
+
+class FakeApiResponse:
+    status = 200
+    closed = True
+    headers: dict[str, str] = {}
+
+    def __init__(self, jresp: list | int) -> None:
+        self._jresp = jresp
+        self.content = self
+
+    async def json(self) -> list | int:
+        return self._jresp
+
+    async def iter_any(self) -> AsyncIterator[bytes]:
+        # small parts to exercise incremental parsing
+        data = json.dumps(self._jresp).encode()
+        for offset in range(0, len(data), 100):
+            yield data[offset:offset + 100]
+
+
+class FakeApi:
+    """
+    Replaces `Mega._wrap_request`, answers login commands with a valid session, 'f' commands with `listing`,
+    'g' commands with file data (file link files must be in `file_attrs`)
+    """
+    def __init__(self) -> None:
+        self.requests = 0
+        self.commands: list[str] = []
+        self.sids: list[str] = []
+        self.reject_sids = set[str]()
+        self.listing: dict = {}
+        self.file_attrs: dict[str, str] = {}
+        self._users: dict[str, dict[str, str]] = {}
+
+    async def wrap_request(self, _method: str, _url: str, *, params: dict[str, str], json: list[dict[str, str]], **_kwargs) -> FakeApiResponse:
+        sid = params.get('sid', '')
+        self.requests += 1
+        results: list[dict[str, str] | str | int] = []
+        for command in json:
+            self.commands.append(command['a'])
+            if command['a'] == 'up':
+                user = f'user{len(self._users):d}'
+                # 'ts' is self challenge followed by self challenge encrypted with master key, that is a valid session id
+                self._users[user] = {'k': command['k'], 'tsid': command['ts']}
+                results.append(user)
+            elif command['a'] == 'us':
+                results.append(self._users[command['user']])
+            elif sid in self.reject_sids:
+                results.append(MegaErrorCodes.ESID.value)
+            elif command['a'] == 'f':
+                results.append(self.listing)
+            elif 'p' in command:
+                if command['p'] in self.file_attrs:
+                    results.append({'s': 1, 'g': 'url', 'at': self.file_attrs[command['p']], 'fh': command['p']})
+                else:
+                    results.append(MegaErrorCodes.ENOENT.value)
+            elif command['n'] == 'bad':
+                results.append(MegaErrorCodes.ENOENT.value)
+            elif command['n'] == 'busy':
+                results.append(MegaErrorCodes.EAGAIN.value)
+            else:
+                self.sids.append(sid)
+                results.append({'h': command['n'], 's': 1, 'g': 'url'})
+        # whole request fails with a single error code
+        return FakeApiResponse(results[0] if len(results) == 1 and isinstance(results[0], int) else results)
+
+
+def make_folder_node(handle: str, parent: str, name: str, node_key: list[int], shared_key: list[int]) -> dict:
+    is_file = len(node_key) == 8
+    k = [node_key[i] ^ node_key[i + 4] for i in range(4)] if is_file else node_key
+    attr = b'MEGA' + json.dumps({'n': name}).encode()
+    attr_enc = AES.new(pack_sequence(k), AES.MODE_CBC, b'\0' * 16).encrypt(attr + b'\0' * (-len(attr) % 16))
+    return {'h': handle, 'p': parent, 't': 0 if is_file else 1, 'u': 'owner', 'ts': 1700000000, 's': 100,
+            'k': f'root:{ints_to_base64(encrypt_key(node_key, shared_key))}', 'a': base64_url_encode(attr_enc)}
+
+
+async def download_local(storage: LocalStorage, dest_base: pathlib.Path, node: File | None = None, **kwargs) -> pathlib.Path:
+    output_path = dest_base / 'file.bin'
+    params = DownloadParams(0, 1, storage.url, output_path, len(storage.plain), storage.iv, storage.meta_mac, storage.key)
+    async with Mega(make_local_options(dest_base, **kwargs)) as mega:
+        return await mega._download(params, LinkContext(ParsedUrl.default(), 1), node)
+
+
+class TransferTests(TestCase):
+    @test_prepare()
+    def test_download_local_baseline_options(self):
+        async def run() -> None:
+            async with LocalStorage(0x100000 + 55) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    dest_base = pathlib.Path(tempdir_name)
+                    # options shaped as before optional keys were introduced
+                    options = make_local_options(dest_base)
+                    for key in ('segments', 'api_request_rate', 'storage_request_rate', 'overwrite_policy', 'prompts',
+                                'output_policy', 'output_backend', 'session_cache', 'listing_cache', 'manifest'):
+                        del options[key]
+                    params = DownloadParams(0, 1, storage.url, dest_base / 'file.bin', len(storage.plain), storage.iv, storage.meta_mac, storage.key)
+                    async with Mega(options) as mega:
+                        self.assertEqual((1, OutputPolicy(), OverwritePolicy.MISMATCH), (mega._segments, mega._output_policy, mega._overwrite_policy))
+                        self.assertEqual((None, None, None), (mega._session_cache, mega._listing_cache, mega._manifest))
+                        output_path = await mega._download(params, LinkContext(ParsedUrl.default(), 1))
+                    self.assertEqual(storage.plain, output_path.read_bytes())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_chunk_segments(self):
+        for size in (0, 1, 0x20000, 0x20001, 50 * 0x100000 + 7):
+            chunks = list(make_chunk_generator(size))
+            for num_segments in (1, 2, 3, 8):
+                segments = make_chunk_segments(size, num_segments)
+                self.assertLessEqual(len(segments), num_segments)
+                self.assertEqual(chunks, [c for s in segments for c in s.chunks])
+                self.assertEqual(size, sum(s.size for s in segments))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_segmented(self):
+        async def run() -> None:
+            async with LocalStorage(50 * 0x100000 + 12345) as storage:
+                for segments in (1, 3):
+                    with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                        storage.requests.clear()
+                        LogCollector.messages.clear()
+                        output_path = await download_local(storage, pathlib.Path(tempdir_name), segments=segments)
+                        self.assertEqual(storage.plain, output_path.read_bytes())
+                        self.assertEqual(segments, len(storage.requests))
+                        self.assertFalse([_ for _ in LogCollector.messages if _.startswith('Mismatched mac')])
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_resume(self):
+        async def run() -> None:
+            async with LocalStorage(5 * 0x100000 + 777) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    chunks = list(make_chunk_generator(len(storage.plain)))
+                    part_path = pathlib.Path(tempdir_name) / 'file.bin.part'
+                    resume_offset = chunks[5].offset
+                    # preallocated, chunk 2 was journaled but its data never made it to disk
+                    lost = chunks[2]
+                    part_data = bytearray(storage.plain[:resume_offset]).ljust(len(storage.plain), b'\0')
+                    part_data[lost.offset:lost.offset + lost.size] = bytes(lost.size)
+                    part_path.write_bytes(part_data)
+                    journal = ChunkJournal(pathlib.Path(f'{part_path}.journal'))
+                    params = DownloadParams(0, 1, storage.url, part_path, len(storage.plain), storage.iv, storage.meta_mac, storage.key)
+                    journal.open(params, chunks, {i: make_chunk_mac(storage.key, storage.iv + storage.iv, storage.plain[c.offset:c.offset + c.size])
+                                                  for i, c in enumerate(chunks[:5])})
+                    journal.close()
+                    output_path = await download_local(storage, pathlib.Path(tempdir_name))
+                    self.assertEqual(storage.plain, output_path.read_bytes())
+                    self.assertEqual([f'bytes={lost.offset:d}-{lost.offset + lost.size - 1:d}',
+                                      f'bytes={resume_offset:d}-{len(storage.plain) - 1:d}'], storage.requests)
+                    self.assertFalse(part_path.exists())
+                    self.assertFalse(pathlib.Path(f'{part_path}.journal').exists())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_incomplete(self):
+        async def run() -> None:
+            async with LocalStorage(3 * 0x100000 + 99) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    dest_base = pathlib.Path(tempdir_name)
+                    storage.data_limit = 0x100000
+                    self.assertEqual(pathlib.Path(), await download_local(storage, dest_base, retries=0))
+                    self.assertFalse((dest_base / 'file.bin').exists())
+                    self.assertTrue((dest_base / 'file.bin.part').is_file())
+                    storage.data_limit = len(storage.plain)
+                    output_path = await download_local(storage, dest_base)
+                    self.assertEqual(storage.plain, output_path.read_bytes())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_manifest(self):
+        async def run() -> None:
+            async with LocalStorage(3 * 0x100000 + 55) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    dest_base = pathlib.Path(tempdir_name)
+                    node = File(h='h0', ts=1600000000)
+                    output_path = await download_local(storage, dest_base, node, manifest=True)
+                    self.assertEqual(storage.plain, output_path.read_bytes())
+                    self.assertEqual(node['ts'], int(output_path.stat().st_mtime))
+                    # up to date file is skipped without being read
+                    storage.requests.clear()
+                    output_path.write_bytes(b'\0' * len(storage.plain))
+                    await download_local(storage, dest_base, node, manifest=True)
+                    self.assertEqual([], storage.requests)
+                    self.assertEqual(b'\0' * len(storage.plain), output_path.read_bytes())
+                    # removed or resized file is downloaded again
+                    for damage in (output_path.unlink, functools.partial(output_path.write_bytes, b'')):
+                        storage.requests.clear()
+                        damage()
+                        await download_local(storage, dest_base, node, manifest=True)
+                        self.assertEqual(1, len(storage.requests))
+                        self.assertEqual(storage.plain, output_path.read_bytes())
+                        storage.requests.clear()
+                        await download_local(storage, dest_base, node, manifest=True)
+                        self.assertEqual([], storage.requests)
+                    # changed node replaces existing file
+                    node['ts'] += 1
+                    await download_local(storage, dest_base, node, manifest=True)
+                    self.assertEqual(1, len(storage.requests))
+                    self.assertEqual(storage.plain, output_path.read_bytes())
+                    self.assertEqual(node['ts'], int(output_path.stat().st_mtime))
+                    manifest = DownloadManifest(dest_base / MANIFEST_FILE_NAME)
+                    self.assertEqual(ManifestEntry.make('h0', len(storage.plain), node['ts'], storage.meta_mac), manifest.lookup('file.bin'))
+                    manifest.close()
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_overwrite(self):
+        async def run() -> None:
+            async with LocalStorage(0x100000 + 99) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    dest_base = pathlib.Path(tempdir_name)
+                    output_path = dest_base / 'file.bin'
+                    for existing, policy, overwritten in (
+                        (b'\1' * 10, OverwritePolicy.NONE, False),
+                        (b'\1' * 10, OverwritePolicy.MISMATCH, True),
+                        (b'\1' * len(storage.plain), OverwritePolicy.MISMATCH, False),
+                        (b'\1' * len(storage.plain), OverwritePolicy.ALL, True),
+                    ):
+                        storage.requests.clear()
+                        output_path.write_bytes(existing)
+                        await download_local(storage, dest_base, overwrite_policy=policy)
+                        self.assertEqual(storage.plain if overwritten else existing, output_path.read_bytes())
+                        self.assertEqual(overwritten, len(storage.requests) == 1)
+                    # questions are asked without blocking other tasks, answers are read from stdin by event loop
+                    read_fd, write_fd = os.pipe()
+                    with open(read_fd, encoding='utf-8') as stdin, open(write_fd, 'w', encoding='utf-8') as stdin_writer:
+                        prompts = PromptBroker(stdin, io.StringIO())
+                        ticks = 0
+
+                        async def tick() -> None:
+                            nonlocal ticks
+                            while True:
+                                ticks += 1
+                                await asyncio.sleep(0.01)
+
+                        async def answer() -> None:
+                            while ticks < 10:
+                                await asyncio.sleep(0.01)
+                            self.assertTrue(prompts.prompting)
+                            stdin_writer.write('maybe\r\ny\n')
+                            stdin_writer.flush()
+                        ticker = asyncio.create_task(tick())
+                        output_path.write_bytes(existing)
+                        await asyncio.gather(answer(), download_local(storage, dest_base, overwrite_policy=OverwritePolicy.ASK,
+                                                                      prompts=prompts))
+                        ticker.cancel()
+                        self.assertEqual(storage.plain, output_path.read_bytes())
+                        self.assertFalse(prompts.prompting)
+                        self.assertEqual(2, prompts._stdout.getvalue().count('Overwrite? [y/N]'))
+                        # questions are serialized, end of input gives default answers
+                        stdin_writer.write('n\n')
+                        stdin_writer.close()
+                        answers = await asyncio.gather(prompts.ask('1?', 'yn', 'y'), prompts.ask('2?', 'yn', 'y'))
+                        self.assertEqual(['n', 'y'], answers)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_progress_tracker(self):
+        async def run() -> None:
+            tracker = ProgressTracker(interval=0.05)
+            events: list[ProgressEvent] = []
+            unsubscribe = tracker.subscribe(events.append)
+            transfer1 = tracker.start('a.bin', 1000, done=400)
+            transfer2 = tracker.start('b.bin', 2000)
+            for step in range(1, 6):
+                transfer1.on_chunk_done(0, 400 + step * 100)
+                transfer2.on_chunk_done(0, step * 100)
+                await asyncio.sleep(0.05)
+            tracker.finish(transfer1)
+            await asyncio.sleep(0.1)
+            tracker.finish(transfer2)
+            total = tracker.total()
+            self.assertEqual((0, 2, 3000, 1400), (len(total.files), total.files_finished, total.size, total.done))
+            self.assertEqual([ProgressEventType.STARTED] * 2, [_.type for _ in events[:2]])
+            self.assertEqual(
+                [('a.bin', 900), ('b.bin', 500)], [(_.file.name, _.file.done) for _ in events if _.type == ProgressEventType.FINISHED])
+            updates = [_ for _ in events if _.type == ProgressEventType.UPDATED]
+            self.assertTrue(updates)
+            self.assertTrue(all(_.file is None for _ in updates))
+            # resumed bytes do not count as transferred
+            self.assertLess(updates[0].total.speed, 400 / 0.05)
+            self.assertGreater(updates[-1].total.speed, 0.0)
+            self.assertIsNotNone(updates[-1].total.eta)
+            unsubscribe()
+            tracker.finish(tracker.start('c.bin', 1))
+            self.assertNotIn('c.bin', [_.file.name for _ in events if _.file])
+            await tracker.close()
+            # transfers report progress to Mega tracker
+            async with LocalStorage(0x300000 + 1) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    events.clear()
+                    async with Mega(make_local_options(pathlib.Path(tempdir_name), segments=2)) as mega:
+                        mega.progress.subscribe(events.append)
+                        await mega._download(DownloadParams(0, 1, storage.url, pathlib.Path(tempdir_name) / 'file.bin', len(storage.plain),
+                                                            storage.iv, storage.meta_mac, storage.key), LinkContext(ParsedUrl.default(), 1))
+                    self.assertEqual([ProgressEventType.STARTED, ProgressEventType.FINISHED],
+                                     [_.type for _ in events if _.type != ProgressEventType.UPDATED])
+                    self.assertEqual(len(storage.plain), events[-1].file.done)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_metrics(self):
+        histogram = Histogram((0.1, 1.0, 10.0))
+        for value in (0.05, 0.05, 0.5, 5.0, 50.0):
+            histogram.observe(value)
+        self.assertEqual([2, 1, 1, 1], histogram.buckets)
+        self.assertEqual((0.1, 10.0, 50.0), (histogram.quantile(0.4), histogram.quantile(0.8), histogram.quantile(1.0)))
+
+        async def run() -> None:
+            async with LocalStorage(0x500000 + 3) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    dest_base = pathlib.Path(tempdir_name)
+                    async with Mega(make_local_options(dest_base, segments=2)) as mega:
+                        await mega._download(DownloadParams(0, 1, storage.url, dest_base / 'file.bin', len(storage.plain), storage.iv,
+                                                            storage.meta_mac, storage.key), LinkContext(ParsedUrl.default(), 1))
+                    summary = mega.metrics.summary()
+                    self.assertEqual({'bytes_transferred': len(storage.plain), 'files_completed': 1, 'http_requests': len(storage.requests)},
+                                     {_: summary['counters'][_] for _ in ('bytes_transferred', 'files_completed', 'http_requests')})
+                    num_chunks = len(list(make_chunk_generator(len(storage.plain))))
+                    for stage in ('chunk_read', 'chunk_decrypt', 'chunk_write', 'chunk_mac'):
+                        self.assertEqual(num_chunks, summary['stages'][stage]['count'])
+                    self.assertEqual(len(storage.requests), summary['stages']['time_to_first_byte']['count'])
+                    self.assertEqual(1, summary['stages']['file_transfer']['count'])
+                    self.assertIn('connect', summary['stages'])
+                    mega.metrics.write_json(dest_base / 'metrics.json')
+                    self.assertEqual(summary['counters'], json.loads((dest_base / 'metrics.json').read_text())['counters'])
+                    mega.metrics.write_prometheus(dest_base / 'metrics.prom')
+                    prom_lines = (dest_base / 'metrics.prom').read_text().splitlines()
+                    self.assertIn(f'mega_download_events_total{{event="bytes_transferred"}} {len(storage.plain):d}', prom_lines)
+                    self.assertIn(f'mega_download_stage_seconds_bucket{{stage="chunk_read",le="+Inf"}} {num_chunks:d}', prom_lines)
+                    self.assertFalse((dest_base / 'metrics.prom.tmp').exists())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_local_output_backends(self):
+        async def run() -> None:
+            async with LocalStorage(9 * 0x100000 + 4321) as storage:
+                for backend, policy in (
+                    (PosixOutputBackend, OutputPolicy()),
+                    (PosixOutputBackend, OutputPolicy(preallocate=False, coalesce_size=0)),
+                    (PosixOutputBackend, OutputPolicy(coalesce_size=0x300000, fsync_mode=FsyncMode.PERIODIC, fsync_interval=0x200000,
+                                                      drop_cache=True)),
+                    (AioFileOutputBackend, OutputPolicy(fsync_mode=FsyncMode.CLOSE)),
+                ):
+                    with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                        output_path = await download_local(
+                            storage, pathlib.Path(tempdir_name), segments=2, output_policy=policy, output_backend=backend)
+                        self.assertEqual(storage.plain, output_path.read_bytes())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_output_file_drop_cache(self):
+        class RecordingOutputBackend(PosixOutputBackend):
+            def __init__(self) -> None:
+                super().__init__()
+                self.calls: list[str] = []
+
+            async def sync(self) -> None:
+                self.calls.append('sync')
+                await super().sync()
+
+            async def drop_cache(self) -> None:
+                self.calls.append('drop_cache')
+                await super().drop_cache()
+
+        async def run() -> None:
+            with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                for policy, expected_calls in (
+                    (OutputPolicy(fsync_mode=FsyncMode.NEVER), []),
+                    (OutputPolicy(fsync_mode=FsyncMode.NEVER, drop_cache=True), ['sync', 'drop_cache']),
+                    (OutputPolicy(fsync_mode=FsyncMode.CLOSE, drop_cache=True), ['sync', 'drop_cache']),
+                ):
+                    backend = RecordingOutputBackend()
+                    async with OutputFile(pathlib.Path(tempdir_name) / 'file.bin', 'wb', 0x100, policy, backend) as output_file:
+                        await output_file.write(b'\xff' * 0x100, 0)
+                    # dirty pages are never dropped, sync must come first
+                    self.assertEqual(expected_calls, backend.calls)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_chunk_mac_queue_order(self):
+        class ManualMacEngine:
+            """MACs complete only when test says so"""
+            def __init__(self) -> None:
+                self.futures: list[asyncio.Future[bytes]] = []
+
+            def submit(self, _k_bytes: bytes, _iv_bytes: bytes, _decrypted_chunk: bytes) -> asyncio.Future[bytes]:
+                self.futures.append(asyncio.get_running_loop().create_future())
+                return self.futures[-1]
+
+        async def run() -> None:
+            engine = ManualMacEngine()
+            queue = ChunkMacQueue(engine, bytes(16), bytes(16))
+            for chunk_idx in range(6):
+                queue.put(chunk_idx, b'')
+            # later chunks completing first are held back by the oldest one
+            engine.futures[2].set_result(b'2')
+            engine.futures[1].set_result(b'1')
+            self.assertEqual([], await queue.pop_ready(8))
+            engine.futures[0].set_result(b'0')
+            self.assertEqual([(0, b'0'), (1, b'1'), (2, b'2')], await queue.pop_ready(8))
+            engine.futures[4].set_result(b'4')
+            self.assertEqual([], await queue.pop_ready(8))
+            # too many pending: oldest is waited for, then ready ones follow in order
+            asyncio.get_running_loop().call_soon(engine.futures[3].set_result, b'3')
+            self.assertEqual([(3, b'3'), (4, b'4')], await queue.pop_ready(2))
+            engine.futures[5].set_result(b'5')
+            self.assertEqual([(5, b'5')], await queue.pop_all())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_pipeline_chunks_done(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+            part_path = pathlib.Path(tempdir_name) / 'file.bin.part'
+            params = DownloadParams(0, 1, '', part_path, 0x100000, bytes(8), bytes(8), bytes(16))
+            state = TransferState(params, 1, ChunkJournal(pathlib.Path(f'{part_path}.journal')))
+            state.journal.open(params, state.chunks, {})
+            engine = MacEngine(1)
+            try:
+                pipeline = TransferPipeline(state, range(len(state.chunks)), engine, BufferPool(0x100000, 1))
+                chunks = state.chunks
+                done: list[tuple[int, int]] = []
+
+                def on_chunk_done(chunk_idx: int, bytes_written: int) -> None:
+                    done.append((chunk_idx, bytes_written))
+                # MAC ready, data not flushed
+                pipeline._macs_ready.append((0, b'0' * 16))
+                pipeline._chunks_done(chunks[0].offset + chunks[0].size - 1, on_chunk_done)
+                self.assertEqual([], done)
+                # data flushed past chunks whose MACs are not ready
+                pipeline._chunks_done(chunks[2].offset + chunks[2].size, on_chunk_done)
+                self.assertEqual([(0, chunks[0].size)], done)
+                pipeline._macs_ready.extend([(1, b'1' * 16), (2, b'2' * 16), (3, b'3' * 16)])
+                pipeline._chunks_done(chunks[2].offset + chunks[2].size, on_chunk_done)
+                self.assertEqual([(0, chunks[0].size), (1, chunks[2].offset), (2, chunks[3].offset)], done)
+                self.assertEqual([b'0' * 16, b'1' * 16, b'2' * 16, None], state.chunk_macs[:4])
+                self.assertEqual([(3, b'3' * 16)], list(pipeline._macs_ready))
+            finally:
+                engine.shutdown()
+                state.journal.close()
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_buffer_pool_reuse(self):
+        pool = BufferPool(0x100, 2)
+        views = [pool.acquire(0x100 - i) for i in range(3)]
+        self.assertEqual([0x100, 0xFF, 0xFE], [len(_) for _ in views])
+        self.assertEqual((3, 3), (pool.allocations, pool.acquisitions))
+        buffers = [_.obj for _ in views]
+        for view in views:
+            pool.release(view)
+        # only `max_buffers` released buffers are retained and reused
+        views = [pool.acquire(0x10) for _ in range(3)]
+        self.assertEqual((4, 6), (pool.allocations, pool.acquisitions))
+        self.assertEqual(2, len([_ for _ in views if any(_.obj is b for b in buffers)]))
+
+        async def run() -> None:
+            async with LocalStorage(30 * 0x100000 + 777) as storage:
+                with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                    dest_base = pathlib.Path(tempdir_name)
+                    params = DownloadParams(0, 1, storage.url, dest_base / 'file.bin', len(storage.plain), storage.iv, storage.meta_mac, storage.key)
+                    async with Mega(make_local_options(dest_base)) as mega:
+                        output_path = await mega._download(params, LinkContext(ParsedUrl.default(), 1))
+                        num_chunks = len(list(make_chunk_generator(len(storage.plain))))
+                        # every chunk goes through a pooled buffer, no more buffers than a single transfer holds are ever allocated
+                        self.assertEqual(num_chunks, mega._buffer_pool.acquisitions)
+                        self.assertLessEqual(mega._buffer_pool.allocations, PIPELINE_BUFFERS_PER_TRANSFER)
+                        self.assertLess(PIPELINE_BUFFERS_PER_TRANSFER, num_chunks)
+                    self.assertEqual(storage.plain, output_path.read_bytes())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class ApiBatchTests(TestCase):
+    @test_prepare()
+    def test_query_api_batch(self):
+        async def run() -> None:
+            with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                async with Mega(make_local_options(pathlib.Path(tempdir_name))) as mega:
+                    api = FakeApi()
+                    mega._wrap_request = api.wrap_request
+                    results = await mega.query_api_batch([{'a': 'g', 'g': 1, 'n': _} for _ in ('a', 'bad', 'c')])
+                    self.assertEqual(['g', 'g', 'g'], api.commands)
+                    self.assertEqual(2, len(api.sids))
+                    self.assertEqual(['a', 'c'], [results[0]['h'], results[2]['h']])
+                    self.assertIsInstance(results[1], RequestError)
+                    self.assertEqual(MegaErrorCodes.ENOENT, results[1].code)
+                async with Mega(make_local_options(pathlib.Path(tempdir_name), retries=0)) as mega:
+                    api = FakeApi()
+                    mega._wrap_request = api.wrap_request
+                    results = await mega.query_api_batch([{'a': 'g', 'g': 1, 'n': _} for _ in ('a', 'busy', 'c')])
+                    # command still failing when out of retries is returned as error along with results of the others
+                    self.assertEqual(['g', 'g', 'g'], api.commands)
+                    self.assertEqual(['a', 'c'], [results[0]['h'], results[2]['h']])
+                    self.assertIsInstance(results[1], RequestError)
+                    self.assertEqual(MegaErrorCodes.EAGAIN, results[1].code)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_download_urls_batched(self):
+        async def run() -> None:
+            with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                api = FakeApi()
+                links: list[str] = []
+                file_keys = {file_id: os.urandom(32) for file_id in ('file0000', 'missing0', 'file0001')}
+                for file_id in ('file0000', 'missing0', 'file0001', 'file0000'):
+                    file_key = file_keys[file_id]
+                    attr = b'MEGA' + json.dumps({'n': f'{file_id}.bin'}).encode()
+                    attr_enc = AES.new(xor_key_halves(file_key), AES.MODE_CBC, b'\0' * 16).encrypt(attr + b'\0' * (-len(attr) % 16))
+                    if not file_id.startswith('missing'):
+                        api.file_attrs[file_id] = base64_url_encode(attr_enc)
+                    links.append(f'https://mega.nz/file/{file_id}#{base64_url_encode(file_key)}')
+                dest_base = pathlib.Path(tempdir_name)
+                async with Mega(make_local_options(dest_base, download_mode=DownloadMode.SKIP)) as mega:
+                    mega._wrap_request = api.wrap_request
+                    results = await mega.download_urls(links)
+                self.assertEqual((dest_base / 'file0000.bin',), results[0])
+                self.assertIsInstance(results[1], RequestError)
+                self.assertEqual((dest_base / 'file0001.bin',), results[2])
+                self.assertEqual((dest_base / 'file0000.bin',), results[3])
+                # url lookups of distinct files are sent in a single batch, repeated link is looked up on its own
+                self.assertEqual(['up', 'us', 'g', 'g', 'g', 'g'], api.commands)
+                self.assertEqual(4, api.requests)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_batch_url_resolver(self):
+        async def run() -> None:
+            batches: list[list[str]] = []
+
+            async def query_batch(handles: list[str]) -> list[File | RequestError]:
+                batches.append(handles)
+                await asyncio.sleep(0.01)
+                return [RequestError(MegaErrorCodes.ENOENT) if _ == 'h3' else File(h=_, s=1, g='url') for _ in handles]
+
+            handles = [f'h{i:d}' for i in range(10)]
+            resolver = BatchUrlResolver(query_batch, handles, batch_size=4)
+            semaphore = asyncio.Semaphore(2)
+
+            async def resolve(handle: str) -> str:
+                async with semaphore:
+                    try:
+                        return (await resolver.resolve(handle))['h']
+                    except RequestError as e:
+                        return str(e.code)
+            results = await asyncio.gather(*(resolve(_) for _ in handles))
+            self.assertEqual([*handles[:3], str(MegaErrorCodes.ENOENT), *handles[4:]], results)
+            self.assertEqual([handles[:4], handles[4:8], handles[8:]], batches)
+            self.assertEqual(3, resolver.batches)
+            # failed handle is requested again
+            with self.assertRaises(RequestError):
+                await resolver.resolve('h3')
+            self.assertEqual([['h3']], batches[3:])
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_batch_url_resolver_lookahead(self):
+        async def run() -> None:
+            batches: list[list[str]] = []
+            released = asyncio.Event()
+            released.set()
+            now = 0.0
+
+            async def query_batch(handles: list[str]) -> list[File | RequestError]:
+                batches.append(handles)
+                await released.wait()
+                return [File(h=_, s=1, g='url') for _ in handles]
+
+            handles = [f'h{i:d}' for i in range(8)]
+            resolver = BatchUrlResolver(query_batch, handles, batch_size=2, lookahead=3, max_age=10.0, clock=lambda: now)
+            await resolver.resolve('h0')
+            await asyncio.gather(*resolver._tasks)
+            self.assertEqual([handles[0:2], handles[2:4]], batches)
+            # next files were resolved in background: no batch is issued for them and in-flight lookahead batch is not waited for
+            released.clear()
+            self.assertEqual('h1', (await asyncio.wait_for(resolver.resolve('h1'), 5.0))['h'])
+            self.assertEqual('h2', (await asyncio.wait_for(resolver.resolve('h2'), 5.0))['h'])
+            self.assertEqual(3, resolver.batches)
+            released.set()
+            await asyncio.gather(*resolver._tasks)
+            self.assertEqual([handles[0:2], handles[2:4], handles[4:6]], batches)
+            # resolved urls expire
+            now = 10.5
+            await resolver.resolve('h3')
+            self.assertEqual(1, resolver.refreshes)
+            self.assertEqual([handles[3:5], handles[5:7]], batches[3:])
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class SessionTests(TestCase):
+    @test_prepare()
+    def test_session_reuse(self):
+        async def run() -> None:
+            with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                cache_path = pathlib.Path(tempdir_name) / 'session.json'
+                api = FakeApi()
+                async with Mega(make_local_options(pathlib.Path(tempdir_name), session_cache=cache_path)) as mega:
+                    mega._wrap_request = api.wrap_request
+                    await asyncio.gather(mega._login(), mega._login())
+                    await mega._login()
+                    self.assertEqual(['up', 'us'], api.commands)
+                    self.assertTrue(mega._sid)
+                    sid = mega._sid
+                self.assertTrue(cache_path.is_file())
+                # next run reuses cached session
+                async with Mega(make_local_options(pathlib.Path(tempdir_name), session_cache=cache_path)) as mega:
+                    mega._wrap_request = api.wrap_request
+                    await mega._login()
+                    self.assertEqual(['up', 'us'], api.commands)
+                    self.assertEqual(sid, mega._sid)
+                    # rejected session is replaced
+                    api.reject_sids.add(sid)
+                    file_data = await mega.query_api({'a': 'g', 'g': 1, 'n': 'h0'})
+                    self.assertEqual('h0', file_data['h'])
+                    self.assertEqual(['up', 'us', 'g', 'up', 'us', 'g'], api.commands)
+                    self.assertNotEqual(sid, mega._sid)
+                    self.assertEqual([mega._sid], api.sids)
+                    self.assertEqual(mega._sid, SessionCache(cache_path).load().sid)
+                # expired cache is discarded
+                self.assertIsNone(SessionCache(cache_path, max_age=-1.0).load())
+                self.assertFalse(cache_path.exists())
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class ListingCacheTests(TestCase):
+    @test_prepare()
+    def test_listing_cache(self):
+        async def run() -> None:
+            with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+                cache_dir = pathlib.Path(tempdir_name) / 'listings'
+                shared_key = [random.getrandbits(32) for _ in range(4)]
+                api = FakeApi()
+                api.listing = {'sn': 'sn1', 'f': [
+                    make_folder_node('root', '', 'root', [random.getrandbits(32) for _ in range(4)], shared_key),
+                    *(make_folder_node(f'h{i:d}', 'root', f'file{i:d}', [random.getrandbits(32) for _ in range(8)], shared_key)
+                      for i in range(3)),
+                ]}
+                listing_orig = json.dumps(api.listing)
+
+                async def prepare() -> tuple[NodeTable, int]:
+                    decrypted: list[int] = []
+                    async with Mega(make_local_options(pathlib.Path(tempdir_name), listing_cache=cache_dir)) as mega:
+                        mega._wrap_request = api.wrap_request
+                        mega._logged_in = True
+
+                        async def decrypt_folder_nodes(table: NodeTable, rows: list[int], nodes: list[EncryptedNode], key: list[int]) -> None:
+                            decrypted.extend(rows)
+                            await Mega._decrypt_folder_nodes(mega, table, rows, nodes, key)
+                        mega._decrypt_folder_nodes = decrypt_folder_nodes
+                        table = await mega._prepare_folder_nodes('folder', shared_key)
+                    api.listing = json.loads(listing_orig)
+                    return table, len(decrypted)
+
+                nodes1, decrypted1 = await prepare()
+                self.assertEqual(4, decrypted1)
+                self.assertEqual(['root', 'file0', 'file1', 'file2'], nodes1.names)
+                self.assertEqual(1, len(list(cache_dir.iterdir())))
+                nodes2, decrypted2 = await prepare()
+                self.assertEqual(0, decrypted2)
+                self.assertEqual([nodes1.node(row) for row in range(len(nodes1))], [nodes2.node(row) for row in range(len(nodes2))])
+                # one file replaced, one added
+                api.listing['sn'] = 'sn2'
+                api.listing['f'][2] = make_folder_node('h1', 'root', 'file1v2', [random.getrandbits(32) for _ in range(8)], shared_key)
+                api.listing['f'].append(make_folder_node('h3', 'root', 'file3', [random.getrandbits(32) for _ in range(8)], shared_key))
+                listing_orig = json.dumps(api.listing)
+                nodes3, decrypted3 = await prepare()
+                self.assertEqual(2, decrypted3)
+                self.assertEqual(['root', 'file0', 'file1v2', 'file2', 'file3'], nodes3.names)
+                # other key does not share cache
+                shared_key = [random.getrandbits(32) for _ in range(4)]
+                for node in api.listing['f']:
+                    node['k'] = f'root:{ints_to_base64(encrypt_key([0] * 8 if node["t"] == 0 else [0] * 4, shared_key))}'
+                listing_orig = json.dumps(api.listing)
+                _, decrypted4 = await prepare()
+                self.assertEqual(5, decrypted4)
+                self.assertEqual(2, len(list(cache_dir.iterdir())))
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class ListingStreamTests(TestCase):
+    @test_prepare()
+    def test_listing_stream(self):
+        listing = [{'f': [{'h': f'h{i:d}', 'a': '\u00fc' * i, 's': i * 1000} for i in range(50)], 'ok': [], 'sn': 'sn1', 'noc': 12}]
+        for text in (json.dumps(listing), json.dumps(listing, separators=(',', ':'), ensure_ascii=False), '-9', '[-9]'):
+            data = text.encode()
+            for step in (1, 7, len(data)):
+                parser = ListingStreamParser()
+                nodes = [node for offset in range(0, len(data), step) for node in parser.feed(data[offset:offset + step])]
+                result = parser.finish()
+                if isinstance(result, dict):
+                    self.assertEqual(listing, [result | {'f': nodes}])
+                else:
+                    self.assertEqual(json.loads(text), result)
+        for text in ('[{"f":[{"h":"h0"}', '[{"f":[{"h":"h0"}],"sn":12', '[{"f":[1 2]}]'):
+            parser = ListingStreamParser()
+            with self.assertRaises(ValueError):
+                parser.feed(text.encode())
+                parser.finish()
+        print(f'{self._testMethodName} passed')
+
+
+class NodeDecryptorTests(TestCase):
+    @test_prepare()
+    def test_key_helpers(self):
+        key = [random.getrandbits(32) for _ in range(4)]
+        for size in (1, 2, 3, 16, 32, 33):
+            data = os.urandom(size)
+            data_b64 = base64.urlsafe_b64encode(data).decode().rstrip('=')
+            self.assertEqual(data_b64, base64_url_encode(data))
+            self.assertEqual(data, base64_url_decode(data_b64))
+            self.assertEqual(data, base64_url_decode(f'{data_b64[:1]},{data_b64[1:]}'))
+        ints = [random.getrandbits(32) for _ in range(8)]
+        # per block CBC with empty IV
+        cbc_blocks = [AES.new(pack_sequence(key), AES.MODE_CBC, b'\0' * 16).decrypt(pack_sequence(ints[i:i + 4])) for i in (0, 4)]
+        self.assertEqual(unpack_sequence(b''.join(cbc_blocks)), decrypt_key(ints, key))
+        self.assertEqual(tuple(ints), decrypt_key(encrypt_key(ints, key), key))
+        self.assertEqual(pack_sequence([ints[i] ^ ints[i + 4] for i in range(4)]), xor_key_halves(pack_sequence(ints)))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_node_decryptor(self):
+        async def run() -> None:
+            shared_key = [random.getrandbits(32) for _ in range(4)]
+            nodes = [make_folder_node(f'h{i:d}', 'root', f'node{i:d}', [random.getrandbits(32) for _ in range(4 if i % 5 else 8)], shared_key)
+                     for i in range(50)]
+            encrypted_nodes = [EncryptedNode(node['t'], node['k'], node['a']) for node in nodes]
+            expected: list[tuple] = []
+            for node in nodes:
+                key = decrypt_key(base64_to_ints(node['k'].split(':')[1]), shared_key)
+                k = (key[0] ^ key[4], key[1] ^ key[5], key[2] ^ key[6], key[3] ^ key[7]) if node['t'] == 0 else key
+                expected.append((decrypt_attr(base64_url_decode(node['a']), k), (pack_sequence(k) + pack_sequence(key[4:8])).ljust(32, b'\0')))
+            self.assertEqual([f'node{i:d}' for i in range(50)], [_[0]['n'] for _ in expected])
+            # in place in batches, sharded across worker processes of a shared pool
+            pool = ProcessPool(2)
+            try:
+                for decryptor in (NodeDecryptor(batch_size=7), NodeDecryptor(pool, shard_size=16), NodeDecryptor(pool, shard_size=16)):
+                    self.assertEqual(expected, [tuple(_) for _ in await decryptor.decrypt(encrypted_nodes, shared_key)])
+                    executor = pool._executor
+                self.assertIs(executor, pool._executor)
+            finally:
+                pool.shutdown()
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class NodeTableTests(TestCase):
+    @test_prepare()
+    def test_node_table(self):
+        async def run() -> None:
+            table = NodeTable()
+            # child listed before its parent, orphan node
+            nodes = [
+                {'h': 'root', 'p': 'up', 't': 1, 'ts': 1700000000},
+                {'h': 'f1', 'p': 'sub', 't': 0, 'ts': 1700000002, 's': 200},
+                {'h': 'sub', 'p': 'root', 't': 1, 'ts': 1700000001},
+                {'h': 'f0', 'p': 'root', 't': 0, 'ts': 1700000003, 's': 100},
+                {'h': 'f2', 'p': 'gone', 't': 0, 'ts': 1700000004, 's': 300},
+            ]
+            names = ['Root', 'b.bin', 'Sub', 'a.bin', 'c.bin']
+            keys = [os.urandom(16) + (os.urandom(16) if node['t'] == 0 else bytes(16)) for node in nodes]
+            for node, name, key_data in zip(nodes, names, keys, strict=True):
+                table.set_decrypted(table.add(node), name, key_data)
+            table.link()
+            self.assertEqual(5, len(table))
+            self.assertEqual([-1, 2, 0, 0, -1], list(table.parents))
+            self.assertEqual(3, table.row('f0'))
+            file = table.node(1)
+            key_ints = unpack_sequence(keys[1])
+            self.assertEqual(('f1', 'sub', 200, 'b.bin'), (file['h'], file['p'], file['s'], file['attributes']['n']))
+            self.assertEqual((key_ints[:4], (*key_ints[4:6], 0, 0), key_ints[6:8]), (file['k_decrypted'], file['iv'], file['meta_mac']))
+            self.assertEqual((keys[1][:16], keys[1][16:24], keys[1][24:]), (table.key_bytes(1), table.iv_bytes(1), table.meta_mac_bytes(1)))
+            self.assertNotIn('iv', table.node(2))
+            ftree = Mega._build_file_system(table, [0])
+            self.assertEqual({'Root': 0, 'Root/Sub': 2, 'Root/Sub/b.bin': 1, 'Root/a.bin': 3}, ftree)
+            # ordered by timestamp, then by path parts
+            self.assertEqual(['Root', 'Root/Sub', 'Root/Sub/b.bin', 'Root/a.bin'], list(ftree))
+            table.timestamps[1] = table.timestamps[3] = 1700000009
+            table.names[3] = 'Sub-a.bin'
+            self.assertEqual(['Root', 'Root/Sub', 'Root/Sub/b.bin', 'Root/Sub-a.bin'], list(Mega._build_file_system(table, [0])))
+            # deeper than recursion limit
+            deep_table = NodeTable()
+            for i in range(5000):
+                deep_table.set_decrypted(deep_table.add({'h': f'd{i:d}', 'p': f'd{i - 1:d}', 't': 1, 'ts': 1700000000}), 'd', bytes(32))
+            deep_table.link()
+            self.assertEqual(5000, len(Mega._build_file_system(deep_table, [0])))
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class FilterTests(TestCase):
+    @test_prepare()
+    def test_filter_pipeline(self):
+        class OddSizeFilter:
+            def filters_out(self, file: File) -> bool:
+                return file['s'] % 2 == 1
+
+            def __str__(self) -> str:
+                return 'OddSizeFilter'
+
+        table = NodeTable()
+        names = ['a.mp4', 'b.MP4', 'c.webm', 'd.tar.gz', 'mp4', 'e.jpg', 'f.mp4.jpg', '.gz']
+        for i in range(400):
+            row = table.add({'h': f'h{i:d}', 'p': 'root', 't': 0, 'ts': 1700000000, 's': i * Mem.MB // 40 + i % 3})
+            table.set_decrypted(row, f'{i:d}_{names[i % len(names)]}', bytes(32))
+            table.nums_in_queue[row] = i + 1
+        table.link()
+        filters = (FileNumFilter(NumRange(0, 1000)), FileNumFilter(NumRange(5, 390)), FileSizeFilter(NumRange(0.5, 9.0)), FileNameFilter('*_?.*'),
+                   FileExtFilter(['.mp4', '.gz', '.webm']), OddSizeFilter())
+        for ffilter in filters[:5]:
+            # compiled check does the same as filters_out
+            node_check = ffilter.compile()
+            self.assertEqual([ffilter.filters_out(table.node(row)) for row in range(len(table))],
+                             [node_check(table.names[row], table.sizes[row], table.nums_in_queue[row]) for row in range(len(table))])
+        self.assertTrue(filters[4].filters_out({'attributes': {'n': 'mp4'}}))
+        self.assertFalse(filters[4].filters_out({'attributes': {'n': 'x.tar.gz'}}))
+        self.assertEqual([False, False, True], [FileExtFilter(['.tar.gz', 'mp4']).filters_out({'attributes': {'n': _}})
+                                                for _ in ('x.tar.gz', 'amp4', 'x.gz')])
+        self.assertTrue(filters[3].filters_out({'attributes': {'n': '12_ab.mp4'}}))
+        self.assertTrue(filters[3].filters_out({'attributes': {'n': '12_a.mp4\n'}}))
+        self.assertFalse(filters[3].filters_out({'attributes': {'n': '12_a.mp4'}}))
+        pipeline = FilterPipeline(filters, batch_size=64)
+        rows = list(range(len(table)))
+        results = pipeline.evaluate(table, rows)
+        expected = [any(ffilter.filters_out(table.node(row)) for ffilter in filters) for row in rows]
+        self.assertEqual(expected, [result is not None for result in results])
+        self.assertTrue(all(result is None or result.filters_out(table.node(row)) for row, result in zip(rows, results, strict=True)))
+        stats = pipeline.stats()
+        self.assertEqual(sum(expected), sum(_.hits for _ in stats))
+        self.assertEqual({str(_) for _ in filters}, {str(_.ffilter) for _ in stats})
+        # filters excluding nothing go last
+        hits = [_.hits for _ in stats]
+        self.assertEqual(sorted(hits, key=lambda _: _ == 0), hits)
+        self.assertEqual(0, next(_.hits for _ in stats if _.ffilter is filters[0]))
+        self.assertIsNotNone(pipeline.first_matching(table.node(0)))
+        self.assertIsNone(pipeline.first_matching(table.node(expected.index(False))))
+        self.assertEqual('', str(FilterPipeline(())))
+        print(f'{self._testMethodName} passed')
+
+
+class LoggingTests(TestCase):
+    @test_prepare(log=True)
+    def test_lazy_logging(self):
+        def never_called() -> str:
+            raise AssertionError('suppressed message was constructed')
+
+        Config.logging_flags = LoggingFlags.INFO
+        # api logger only makes messages logger is going to log
+        set_logger(Log)
+        ApiLog.trace(never_called)
+        ApiLog.debug(never_called)
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir_name:
+            json_path = pathlib.Path(tempdir_name) / 'log.jsonl'
+            Log.set_json_sink(json_path)
+            ApiLog.info(lambda: 'api info')
+            Log.trace(never_called)
+            Log.warn('warning ünicode')
+            Log.error(lambda: 'error')
+            Log.flush()
+            Log.set_json_sink(None)
+            records = [json.loads(line) for line in json_path.read_text(encoding='utf-8').splitlines()]
+        self.assertEqual([('INFO', 'api info'), ('WARN', 'warning ünicode'), ('ERROR', 'error')],
+                         [(_['level'], _['message']) for _ in records])
+        self.assertTrue(all(isinstance(_['time'], float) for _ in records))
+        set_logger(LogCollector)
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare(log=True)
+    def test_log_writer_output_errors(self):
+        class BrokenStdout(io.StringIO):
+            def write(self, _text: str) -> int:
+                raise BrokenPipeError(32, 'Broken pipe')
+
+        def flush_returns(writer: LogWriter) -> bool:
+            flusher = threading.Thread(target=writer.flush, daemon=True)
+            flusher.start()
+            flusher.join(5.0)
+            return not flusher.is_alive()
+
+        Config.logging_flags = LoggingFlags.INFO
+        Config.nocolors = True
+        stdout = sys.stdout
+        writer = LogWriter()
+        try:
+            # failed batch is dropped, writer keeps working
+            sys.stdout = BrokenStdout()
+            writer.put(LogRecord(0.0, LoggingFlags.INFO, 'lost'))
+            self.assertTrue(flush_returns(writer))
+            sys.stdout = io.StringIO()
+            writer.put(LogRecord(0.0, LoggingFlags.INFO, 'written'))
+            self.assertTrue(flush_returns(writer))
+            self.assertEqual('written\n', sys.stdout.getvalue())
+            # writer thread is gone: flushes do not wait for it, records are written inline
+            writer._enqueue(None)
+            writer._thread.join()
+            self.assertTrue(flush_returns(writer))
+            writer.put(LogRecord(0.0, LoggingFlags.INFO, 'inline'))
+            self.assertTrue(flush_returns(writer))
+            self.assertEqual('written\ninline\n', sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+            writer.close()
+        print(f'{self._testMethodName} passed')
+
+
+class RequestQueueTests(TestCase):
+    @test_prepare()
+    def test_token_bucket(self):
+        async def run() -> None:
+            bucket = TokenBucket(20.0, 2)
+            order: list[int] = []
+
+            async def acquire(i: int) -> None:
+                await bucket.acquire()
+                order.append(i)
+            loop = asyncio.get_running_loop()
+            time_start = loop.time()
+            await asyncio.gather(*(acquire(_) for _ in range(6)))
+            elapsed = loop.time() - time_start
+            self.assertEqual(list(range(6)), order)
+            self.assertGreaterEqual(elapsed, 0.19)
+            self.assertLess(elapsed, 0.5)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_request_queue_endpoints(self):
+        async def run() -> None:
+            queue = RequestQueue(2.0, 0.0)
+            loop = asyncio.get_running_loop()
+            time_start = loop.time()
+            await asyncio.gather(*(queue.until_ready('https://gfs270n001.userstorage.mega.co.nz/dl/x') for _ in range(50)))
+            self.assertLess(loop.time() - time_start, 0.1)
+            await asyncio.gather(*(queue.until_ready(f'{SITE_API}?id={_:d}') for _ in range(2)))
+            self.assertGreaterEqual(loop.time() - time_start, 0.45)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class SchedulerTests(TestCase):
+    @test_prepare()
+    def test_job_scheduler_fair_sharing(self):
+        async def run() -> None:
+            scheduler = JobScheduler(2)
+            started: list[str] = []
+
+            async def job(link_id: str, duration: float) -> None:
+                async with scheduler.slot(link_id):
+                    started.append(link_id)
+                    await asyncio.sleep(duration)
+
+            jobs = [job('big', 0.02) for _ in range(6)]
+            jobs.extend(job('small', 0.02) for _ in range(2))
+            await asyncio.gather(*jobs)
+            self.assertEqual(['big', 'big', 'big', 'small', 'big', 'small', 'big', 'big'], started)
+            self.assertEqual(0, scheduler.waiting)
+            # cancelled waiter does not leak a slot
+            async with scheduler.slot('a'), scheduler.slot('a'):
+                waiter = asyncio.create_task(job('b', 0.0))
+                await asyncio.sleep(0.01)
+                waiter.cancel()
+                await asyncio.gather(waiter, return_exceptions=True)
+            await asyncio.wait_for(asyncio.gather(job('c', 0.0), job('c', 0.0)), 1.0)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
+class HashcashTests(TestCase):
+    @test_prepare()
+    def test_hashcash_solver(self):
+        async def run() -> None:
+            ticks = 0
+
+            async def tick() -> None:
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            pool = ProcessPool(2)
+            solver = HashcashSolver(pool, batch_size=4)
+            ticker = asyncio.create_task(tick())
+            try:
+                executors = set()
+                for easiness in (255, 220, 200):
+                    challenge = f'1:{easiness:d}:1700000000:{base64.urlsafe_b64encode(random.randbytes(48)).decode().rstrip("=")}'
+                    version_str, token_str, nonce_str = (await solver.solve(challenge)).split(':')
+                    self.assertEqual(('1', challenge.rsplit(':', 1)[1]), (version_str, token_str))
+                    hashcash = parse_hashcash_challenge(challenge)
+                    nonce = int.from_bytes(base64.urlsafe_b64decode(nonce_str + '=' * (-len(nonce_str) % 4)), 'little')
+                    self.assertTrue(hashcash_nonce_matches(make_hashcash_buffer(hashcash.token), nonce, hashcash.threshold))
+                    executors.add(id(pool._executor))
+                # workers live as long as the pool
+                self.assertEqual(1, len(executors))
+            finally:
+                ticker.cancel()
+                pool.shutdown()
+            self.assertEqual(3, len(solver.history))
+            self.assertGreater(ticks, 0)
+        asyncio.run(run())
+        print(f'{self._testMethodName} passed')
+
+
 class DownloadTests(TestCase):
     @test_prepare()
     def test_download_touch_1(self):